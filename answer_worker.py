@@ -0,0 +1,183 @@
+"""
+Runs answers off the Streamlit script thread.
+
+Each question becomes an AnswerJob keyed by (user, pet, message id) and runs
+on a small process-wide pool. The script run returns immediately and the UI
+polls the job (a fragment with run_every) to render the answer as it
+streams in. A newer question from the same user supersedes the older job:
+it is cancelled, and RagPipeline stops it before its next stage or COMPLETE
+instead of finishing a multi-round-trip answer nobody will see.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from stage_scheduler import StageCancelled
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, DONE, CANCELLED, FAILED = "queued", "running", "done", "cancelled", "failed"
+FINISHED = (DONE, CANCELLED, FAILED)
+
+
+class AnswerJob:
+    """
+    Attributes:
+        key (tuple): (user, pet, message id)
+        status (str): queued, running, done, cancelled or failed
+        text (str): Answer received so far
+        relative_paths (set): Documents the answer was built from
+        errors (list): User-facing messages from the pipeline's on_error
+    """
+
+    def __init__(self, key, supersedable=True):
+        self.key = key
+        self.supersedable = supersedable
+        self.status = QUEUED
+        self.text = ""
+        self.relative_paths = set()
+        self.errors = []
+        self.created = time.monotonic()
+        self.finished = None
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def user(self):
+        return self.key[0]
+
+    @property
+    def pet(self):
+        return self.key[1]
+
+    def cancel(self):
+        self._cancel.set()
+
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def append(self, piece):
+        if self.cancelled():
+            raise StageCancelled("Cancelled while streaming")
+        with self._lock:
+            self.text += piece
+
+    def error(self, message):
+        with self._lock:
+            self.errors.append(message)
+
+    def _set_status(self, status):
+        with self._lock:
+            self.status = status
+            if status in FINISHED:
+                self.finished = time.monotonic()
+
+    def snapshot(self):
+        with self._lock:
+            return {"status": self.status, "text": self.text, "relative_paths": set(self.relative_paths),
+                    "errors": list(self.errors)}
+
+
+class AnswerWorker:
+    """
+    Args:
+        max_workers (int): Answers computed at the same time
+        retain (float): Seconds a finished job is kept for its session to collect
+    """
+
+    def __init__(self, max_workers=4, retain=600):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="answer")
+        self.retain = retain
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self.counts = {QUEUED: 0, DONE: 0, CANCELLED: 0, FAILED: 0}
+
+    def submit(self, key, run, supersede=True):
+        """
+        Start run(job) for a new job and cancel every unfinished job of the same
+        user, whatever pet it was for.
+
+        Args:
+            key (tuple): (user, pet, message id)
+            run (callable): run(job); streams into job.append(). Must not touch
+                st.session_state, which is not available on worker threads.
+            supersede (bool): False for housekeeping jobs (e.g. a chat summary
+                refresh) that neither cancel other jobs nor get cancelled by
+                newer questions
+
+        Returns:
+            AnswerJob
+        """
+        job = AnswerJob(key, supersedable=supersede)
+        with self._lock:
+            self._expire()
+            for other in self._jobs.values():
+                if supersede and other.supersedable and other.user == job.user and other.status not in FINISHED:
+                    other.cancel()
+            self._jobs[key] = job
+            self.counts[QUEUED] += 1
+        self.executor.submit(self._run, job, run)
+        return job
+
+    def _run(self, job, run):
+        if job.cancelled():
+            self._finish(job, CANCELLED)
+            return
+        job._set_status(RUNNING)
+        try:
+            run(job)
+        except StageCancelled:
+            self._finish(job, CANCELLED)
+        except Exception as e:
+            logger.exception("Answer job %s failed", job.key)
+            job.error(f"Error occurred while answering: {e}")
+            self._finish(job, FAILED)
+        else:
+            self._finish(job, CANCELLED if job.cancelled() else DONE)
+
+    def _finish(self, job, status):
+        job._set_status(status)
+        with self._lock:
+            self.counts[status] += 1
+
+    def _expire(self):
+        now = time.monotonic()
+        for key, job in list(self._jobs.items()):
+            if job.finished is not None and now - job.finished > self.retain:
+                del self._jobs[key]
+
+    def get(self, key):
+        with self._lock:
+            return self._jobs.get(key)
+
+    def pop(self, key):
+        """
+        Remove and return a job once its answer has been stored by the session.
+        """
+        with self._lock:
+            return self._jobs.pop(key, None)
+
+    def cancel(self, user, pet=None):
+        """
+        Cancel the user's unfinished answer jobs, or only those for one pet.
+        Housekeeping jobs (submitted with supersede=False) are left to finish.
+        """
+        with self._lock:
+            for job in self._jobs.values():
+                if (job.supersedable and job.user == user and (pet is None or job.pet == pet)
+                        and job.status not in FINISHED):
+                    job.cancel()
+
+    def metrics(self):
+        with self._lock:
+            active = sum(1 for job in self._jobs.values() if job.status not in FINISHED)
+            return {"active": active, "retained": len(self._jobs),
+                    "submitted": self.counts[QUEUED], "done": self.counts[DONE],
+                    "cancelled": self.counts[CANCELLED], "failed": self.counts[FAILED]}
+
+    def shutdown(self):
+        with self._lock:
+            for job in self._jobs.values():
+                job.cancel()
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,95 @@
+"""
+User registration and login against the users table.
+
+Login is one parameterized point lookup that returns the ID together with
+the stored hash, and registration is a single MERGE, so neither scans the
+table. Snowflake does not enforce UNIQUE constraints on standard tables;
+the MERGE is what keeps usernames unique.
+
+Passwords are stored as salted PBKDF2-SHA256 hashes:
+    pbkdf2_sha256$<iterations>$<salt b64>$<hash b64>
+Rows still holding a plaintext password from before hashing are accepted
+once and upgraded in place. The hashes are ~90 characters; rag2.sql widens
+the password column to VARCHAR(256).
+"""
+import base64
+import hashlib
+import hmac
+import os
+
+HASH_SCHEME = "pbkdf2_sha256"
+DEFAULT_ITERATIONS = 600_000
+
+
+def _b64(data):
+    return base64.b64encode(data).decode("ascii")
+
+
+def hash_password(password, iterations=DEFAULT_ITERATIONS):
+    salt = os.urandom(16)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations)
+    return f"{HASH_SCHEME}${iterations}${_b64(salt)}${_b64(digest)}"
+
+
+def verify_password(password, stored, iterations=DEFAULT_ITERATIONS):
+    """
+    Check password against a stored value.
+
+    Returns:
+        tuple: (matches, needs_rehash). needs_rehash is True for plaintext
+            legacy values and hashes made with a different iteration count.
+            A malformed hash never matches.
+    """
+    if stored is None:
+        return False, False
+    parts = stored.split("$")
+    if len(parts) != 4 or parts[0] != HASH_SCHEME:
+        matches = hmac.compare_digest(password.encode("utf-8"), stored.encode("utf-8"))
+        return matches, matches
+    try:
+        stored_iterations = int(parts[1])
+        salt = base64.b64decode(parts[2], validate=True)
+        expected = base64.b64decode(parts[3], validate=True)
+        digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, stored_iterations)
+    except ValueError:
+        # Corrupt stored hash (binascii.Error is a ValueError): a failed login, not a crash
+        return False, False
+    matches = hmac.compare_digest(digest, expected)
+    return matches, matches and stored_iterations != iterations
+
+
+def authenticate(db, username, password, iterations=DEFAULT_ITERATIONS):
+    """
+    Returns:
+        The user's ID, or None if the username/password pair is wrong.
+    """
+    result = db.sql("SELECT id, password FROM users WHERE username = ? LIMIT 1", (username,))
+    if not result:
+        # Hash anyway so unknown usernames take as long as wrong passwords
+        hash_password(password, iterations)
+        return None
+    matches, needs_rehash = verify_password(password, result[0]['PASSWORD'], iterations)
+    if not matches:
+        return None
+    if needs_rehash:
+        db.sql("UPDATE users SET password = ? WHERE id = ?",
+               (hash_password(password, iterations), result[0]['ID']))
+    return result[0]['ID']
+
+
+def create_user(db, username, password, iterations=DEFAULT_ITERATIONS):
+    """
+    Insert the user unless the username is taken.
+
+    Returns:
+        bool: True if the user was created
+    """
+    result = db.sql(
+        """MERGE INTO users u
+           USING (SELECT ? AS username, ? AS password) s
+           ON u.username = s.username
+           WHEN NOT MATCHED THEN INSERT (username, password) VALUES (s.username, s.password)""",
+        (username, hash_password(password, iterations))
+    )
+    # MERGE returns one row: number of rows inserted
+    return bool(result and result[0][0])
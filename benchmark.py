@@ -0,0 +1,388 @@
+"""
+Offline end-to-end latency benchmark for the RAG path.
+
+Runs a scripted conversation through RagPipeline.answer_question against
+LocalBackend and reports, per question, wall time, backend round trips and
+the bytes sent to COMPLETE.
+
+    python benchmark.py
+    python benchmark.py --complete-latency 1.2 --search-latency 0.4 --json
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+import tracing
+from call_policy import CallPolicy
+from chat_store import ChatHistoryStore, Conversation
+from completion_cache import CompletionCache
+from cortex_backend import LocalBackend
+from rag_pipeline import (CORTEX_SEARCH_SERVICE_CONDITION, REWRITE_MODES, SEARCH_DEADLINE, SEARCH_SERVICE_COLUMNS,
+                          SEARCH_SERVICES, RagPipeline)
+from model_router import ModelRouter
+from pet_context import PetContextStore
+from rewrite_gate import RewriteGate, load_vocabulary
+from search_cache import SearchCache
+from search_fanout import FanOutSearch
+from stage_scheduler import StageScheduler
+from tracing import percentile
+
+PET_ID = 1
+PET_TYPES = ['Large Cat', 'Small Cat', 'Large Dog', 'Small Dog', 'Undefined']
+CONDITIONS = [
+    "vomiting and loss of appetite", "itchy skin and hair loss", "limping after exercise",
+    "excessive thirst and urination", "coughing and nasal discharge", "diarrhea after diet change",
+    "ear infection with head shaking", "dental disease and bad breath", "lethargy and fever",
+    "weight gain and low activity", "vaccination schedule for puppies", "flea and tick prevention",
+]
+QUESTIONS = [
+    "My dog has been vomiting since this morning, what should I do?",
+    "Could it be something he ate?",
+    "How long before I should call the vet?",
+    "What vaccines does a small dog need?",
+    "Is that also true for older dogs?",
+]
+SLIDE_WINDOW = 7
+# Stand-in COMPLETE speed of each model relative to mistral-large2, for --route
+MODEL_SPEED = {"llama3.1-8b": 0.25, "mistral-7b": 0.25, "mixtral-8x7b": 0.5, "llama3.1-70b": 0.7,
+               "snowflake-arctic": 0.6}
+
+
+def make_chunks(n_chunks=120):
+    chunks = []
+    for i in range(n_chunks):
+        condition = CONDITIONS[i % len(CONDITIONS)]
+        chunks.append({
+            "chunk": f"Section {i}: {condition}. " + "Monitor symptoms, keep the pet hydrated and consult a vet. " * 20,
+            "relative_path": f"handbook_{i // 20}.pdf",
+            "file_url": f"https://example.invalid/handbook_{i // 20}.pdf",
+            "pet_type": PET_TYPES[i % len(PET_TYPES)],
+            "condition": condition,
+        })
+    return chunks
+
+
+def with_tail(latency, rate, factor):
+    """
+    A latency that is `factor` times slower for a `rate` fraction of calls, to
+    give the stand-in services a tail worth hedging.
+    """
+    if rate <= 0:
+        return latency
+    return lambda: latency * factor if random.random() < rate else latency
+
+
+def make_backend(sql_latency=0.05, complete_latency=0.8, complete_latency_per_kb=0.02,
+                 search_latency=0.3, n_chunks=120, n_history=30, token_latency=0.01, model_speed=MODEL_SPEED):
+    """
+    LocalBackend seeded with one pet, its health records and a small corpus.
+    """
+    backend = LocalBackend(sql_latency=sql_latency, complete_latency=complete_latency,
+                           complete_latency_per_kb=complete_latency_per_kb, search_latency=search_latency,
+                           token_latency=token_latency, model_speed=model_speed)
+    start = date(2024, 1, 1)
+    pet = {"NAME": "Buddy", "BREED": "Beagle", "TYPE": "Small Dog", "GENDER": "Male", "AGE": 4}
+    clinical = [{"DATE": start + timedelta(days=30 * i), "NOTES": f"Routine visit {i}, weight stable."}
+                for i in range(n_history)]
+    checkins = [{"DATE": start + timedelta(days=i), "CONDITION": "Good", "NOTES": f"Ate well on day {i}."}
+                for i in range(n_history)]
+    backend.add_sql_handler(r"AS clinical_version", lambda params: [
+        {"CLINICAL_VERSION": len(clinical), "CHECKIN_VERSION": len(checkins)}
+    ])
+    backend.add_sql_handler(r"FROM pets WHERE id = \?", lambda params: [pet])
+    backend.add_sql_handler(r"FROM clinical_history WHERE pet_id = \?", lambda params: clinical)
+    backend.add_sql_handler(r"FROM daily_check_ins WHERE pet_id = \?", lambda params: checkins)
+    backend.add_sql_handler(r"SELECT DISTINCT condition FROM docs_chunks_table",
+                            lambda params: [{"CONDITION": condition} for condition in CONDITIONS])
+
+    chunks = make_chunks(n_chunks)
+    for service, (on, attributes) in SEARCH_SERVICE_COLUMNS.items():
+        backend.add_search_service(service, chunks, on=on, attributes=attributes)
+    return backend
+
+
+def run_conversation(pipeline, questions=QUESTIONS, stream=False, chat_store=None):
+    """
+    Ask questions in order, carrying chat history the same way streamlit_bot does.
+
+    With stream=True the answer is consumed through answer_question_stream and
+    ttft_s records the time to the first piece of the answer. With a
+    chat_store the history is its rolling summary plus recent messages rather
+    than the last SLIDE_WINDOW raw messages; summary refreshes run between
+    questions (in the app they run in the background) and are not timed.
+    """
+    backend = pipeline.backend
+    conversation = Conversation(user=1, pet=PET_ID)
+    messages = []
+    results = []
+    for question in questions:
+        messages.append({"role": "user", "content": question})
+        if chat_store is not None:
+            chat_store.append(conversation, "user", question)
+            chat_history = conversation.prompt_history()
+        else:
+            chat_history = messages[max(0, len(messages) - SLIDE_WINDOW):len(messages) - 1]
+        backend.stats.reset()
+        started = time.perf_counter()
+        with tracing.span("question", stream=stream):
+            if stream:
+                pieces, _ = pipeline.answer_question_stream(question, PET_ID, chat_history)
+                response = next(pieces, "")
+                ttft = time.perf_counter() - started
+                response += "".join(pieces)
+            else:
+                response, _ = pipeline.answer_question(question, PET_ID, chat_history)
+        elapsed = time.perf_counter() - started
+        ttft = ttft if stream else elapsed
+        messages.append({"role": "assistant", "content": response})
+        results.append({"question": question, "wall_s": round(elapsed, 4), "ttft_s": round(ttft, 4),
+                        **backend.stats.snapshot(), "prompt_tokens": dict(pipeline.last_prompt_report)})
+        if chat_store is not None:
+            chat_store.append(conversation, "assistant", response)
+            chat_store.flush()
+            chat_store.refresh_summary(conversation, pipeline.summarize_history)
+    return results
+
+
+def load_rewrites(path):
+    """
+    Recorded rewrites: the JSON lines printed by --compare-rewrite or
+    --audit-gate (run with --snowflake), keyed by question.
+    """
+    with open(path) as f:
+        return {row["question"]: row for row in (json.loads(line) for line in f if line.strip())}
+
+
+def compare_rewrite_modes(pipeline, questions=QUESTIONS, pet_id=PET_ID, rewrites=None):
+    """
+    For every follow-up question, retrieve with both rewrite modes and report
+    how much the retrieved chunks overlap (Jaccard) and what each mode costs.
+
+    The rewrites have to come from a real model: LocalBackend's responder
+    echoes the question, so both modes would always retrieve the same chunks.
+    Run it against SnowparkBackend, or pass `rewrites` recorded from such a
+    run (see load_rewrites) to replay its queries without calling COMPLETE.
+    """
+    backend = pipeline.backend
+    pet_type = pipeline.get_pet_info(pet_id)['TYPE']
+    messages = []
+    rows = []
+    for question in questions:
+        messages.append({"role": "user", "content": question})
+        chat_history = messages[max(0, len(messages) - SLIDE_WINDOW):len(messages) - 1]
+        if rewrites is not None and question not in rewrites:
+            continue
+        if chat_history or rewrites is not None:
+            retrieved = {}
+            row = {"question": question}
+            for mode in REWRITE_MODES:
+                if rewrites is not None:
+                    row[f"{mode}_complete_calls"] = rewrites[question][f"{mode}_complete_calls"]
+                    query = rewrites[question][f"{mode}_query"]
+                else:
+                    backend.stats.reset()
+                    query = pipeline.search_query(question, chat_history, rewrite_mode=mode)
+                    row[f"{mode}_complete_calls"] = backend.stats.snapshot()["complete_calls"]
+                row[f"{mode}_query"] = query
+                results = pipeline.get_similar_chunks_search_service(query, pet_type)["results"]
+                retrieved[mode] = {item["chunk"] for item in results}
+            union = retrieved["fused"] | retrieved["chain"]
+            row["jaccard"] = round(len(retrieved["fused"] & retrieved["chain"]) / len(union), 3) if union else 1.0
+            rows.append(row)
+        if rewrites is None:
+            response, _ = pipeline.answer_question(question, pet_id, chat_history)
+            messages.append({"role": "assistant", "content": response})
+    return rows
+
+
+def audit_rewrite_gate(pipeline, questions=QUESTIONS, pet_id=PET_ID, rewrites=None):
+    """
+    For every question, record the gate's decision and how much retrieval with
+    the raw question overlaps retrieval with the LLM rewrite (Jaccard). Skipped
+    rewrites with low overlap are the ones to look at.
+
+    As with compare_rewrite_modes, the rewrite has to come from a real model:
+    run against SnowparkBackend or replay `rewrites` recorded from such a run.
+    """
+    pet_type = pipeline.get_pet_info(pet_id)['TYPE']
+    messages = []
+    rows = []
+    for question in questions:
+        messages.append({"role": "user", "content": question})
+        chat_history = messages[max(0, len(messages) - SLIDE_WINDOW):len(messages) - 1]
+        if rewrites is not None and question not in rewrites:
+            continue
+        decision = pipeline.rewrite_gate.decide(question, bool(chat_history))
+        if rewrites is not None:
+            rewritten = rewrites[question]["rewritten_query"]
+        else:
+            rewritten = pipeline.search_query(question, chat_history, gate=False)
+        raw = {item["chunk"] for item in pipeline.get_similar_chunks_search_service(question, pet_type)["results"]}
+        full = {item["chunk"] for item in pipeline.get_similar_chunks_search_service(rewritten, pet_type)["results"]}
+        union = raw | full
+        rows.append({"question": question, **decision.to_dict(), "rewritten_query": rewritten,
+                     "jaccard": round(len(raw & full) / len(union), 3) if union else 1.0})
+        if rewrites is None:
+            response, _ = pipeline.answer_question(question, pet_id, chat_history)
+            messages.append({"role": "assistant", "content": response})
+    return rows
+
+
+def summarize(results):
+    walls = [r["wall_s"] for r in results]
+    return {
+        "questions": len(results),
+        "mean_wall_s": round(statistics.mean(walls), 4),
+        "p95_wall_s": round(percentile(sorted(walls), 95), 4),
+        "max_wall_s": round(max(walls), 4),
+        "mean_ttft_s": round(statistics.mean(r["ttft_s"] for r in results), 4),
+        "mean_round_trips": round(statistics.mean(r["round_trips"] for r in results), 2),
+        "mean_prompt_bytes": round(statistics.mean(r["prompt_bytes"] for r in results)),
+    }
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sql-latency", type=float, default=0.05)
+    parser.add_argument("--complete-latency", type=float, default=0.8)
+    parser.add_argument("--complete-latency-per-kb", type=float, default=0.02)
+    parser.add_argument("--search-latency", type=float, default=0.3)
+    parser.add_argument("--token-latency", type=float, default=0.01, help="Seconds per generated word")
+    parser.add_argument("--chunks", type=int, default=120, help="Corpus size")
+    parser.add_argument("--history", type=int, default=30, help="Clinical and check-in rows for the pet")
+    parser.add_argument("--sequential", action="store_true", help="Run create_prompt stages one at a time")
+    parser.add_argument("--stream", action="store_true", help="Stream the final answer and report ttft_s")
+    parser.add_argument("--rewrite-mode", choices=REWRITE_MODES, default="fused")
+    parser.add_argument("--compare-rewrite", action="store_true",
+                        help="Compare retrieval between the fused and chained rewrite instead of timing")
+    parser.add_argument("--cache", action="store_true",
+                        help="Cache COMPLETE, search results and each pet's health records")
+    parser.add_argument("--rewrite-gate", action="store_true",
+                        help="Skip the query rewrite for self-contained questions (rewrite_gate.py)")
+    parser.add_argument("--audit-gate", action="store_true",
+                        help="Report the rewrite gate's decisions and their retrieval overlap instead of timing")
+    parser.add_argument("--snowflake", action="store_true",
+                        help="With --compare-rewrite or --audit-gate, run against SnowparkBackend "
+                             "(SNOWFLAKE_* environment variables) instead of LocalBackend")
+    parser.add_argument("--pet-id", type=int, default=PET_ID, help="With --snowflake, the pet to ask about")
+    parser.add_argument("--rewrites", metavar="PATH",
+                        help="With --compare-rewrite or --audit-gate, replay the rewrites recorded in PATH "
+                             "(their JSON lines output from a --snowflake run) instead of calling COMPLETE")
+    parser.add_argument("--search-deadline", type=float, default=SEARCH_DEADLINE,
+                        help="Shared deadline for the parallel search across services")
+    parser.add_argument("--single-service", action="store_true",
+                        help="Search only condition_match_search, as before the fan-out")
+    parser.add_argument("--local-retrieval", action="store_true",
+                        help="Search a local hybrid index (local_retrieval.py) instead of the stand-in services")
+    parser.add_argument("--chat-summary", action="store_true",
+                        help="Send a rolling summary + recent messages (chat_store.py) instead of a raw window")
+    parser.add_argument("--turns", type=int, default=len(QUESTIONS),
+                        help="Conversation length; the scripted questions repeat as needed")
+    parser.add_argument("--slow-rate", type=float, default=0.0,
+                        help="Fraction of COMPLETE and search calls that are --slow-factor times slower")
+    parser.add_argument("--slow-factor", type=float, default=8.0)
+    parser.add_argument("--budget", type=float,
+                        help="Latency budget per question in seconds, with hedged and retried calls (call_policy.py)")
+    parser.add_argument("--no-hedge", action="store_true", help="With --budget, never send hedged requests")
+    parser.add_argument("--route", action="store_true",
+                        help="Per-stage models (model_router.py) instead of mistral-large2 everywhere")
+    parser.add_argument("--model", action="append", default=[], metavar="STAGE=MODEL",
+                        help="With --route, run STAGE on MODEL; repeatable")
+    parser.add_argument("--passes", type=int, default=1, help="Ask the scripted conversation this many times")
+    parser.add_argument("--trace", metavar="PATH", help="Append every question's trace to PATH as JSON lines")
+    parser.add_argument("--json", action="store_true", help="Print JSON lines instead of a table")
+    return parser
+
+
+def make_pipeline(args):
+    if args.snowflake:
+        from cortex_backend import SnowparkBackend
+        from session_pool import connection_params_from_env
+
+        backend = SnowparkBackend.from_connection_params(connection_params_from_env(), pool_size=2)
+    else:
+        backend = make_backend(args.sql_latency, with_tail(args.complete_latency, args.slow_rate, args.slow_factor),
+                               args.complete_latency_per_kb, with_tail(args.search_latency, args.slow_rate, args.slow_factor),
+                               args.chunks, args.history, args.token_latency)
+    if args.local_retrieval:
+        from local_retrieval import SERVICE_COLUMNS, HybridIndex, LocalRetrievalBackend
+
+        rows = make_chunks(args.chunks)
+        backend = LocalRetrievalBackend(
+            {service: HybridIndex.build(rows, on, attributes) for service, (on, attributes) in SERVICE_COLUMNS.items()},
+            backend)
+    scheduler = StageScheduler(ThreadPoolExecutor(max_workers=1)) if args.sequential else StageScheduler()
+    completion_cache = CompletionCache() if args.cache else None
+    search_cache = SearchCache() if args.cache else None
+    context_store = PetContextStore(backend) if args.cache else None
+    services = (CORTEX_SEARCH_SERVICE_CONDITION,) if args.single_service else SEARCH_SERVICES
+    search = FanOutSearch(services, args.search_deadline)
+    rewrite_gate = RewriteGate(load_vocabulary(backend)) if args.rewrite_gate or args.audit_gate else None
+    call_policy = None
+    if args.budget:
+        call_policy = CallPolicy(budget=args.budget, hedge=() if args.no_hedge else ("search.", "complete."))
+    model_route = None
+    if args.route:
+        model_route = ModelRouter(dict(option.split("=", 1) for option in args.model)).route()
+    return RagPipeline(backend, scheduler=scheduler, search=search, rewrite_gate=rewrite_gate, rewrite_mode=args.rewrite_mode,
+                       completion_cache=completion_cache, search_cache=search_cache,
+                       context_store=context_store, call_policy=call_policy, model_route=model_route)
+
+
+def main():
+    parser = build_parser()
+    args = parser.parse_args()
+    if args.compare_rewrite or args.audit_gate:
+        if not (args.snowflake or args.rewrites):
+            parser.error("--compare-rewrite and --audit-gate need --snowflake or --rewrites: LocalBackend "
+                         "echoes the question as the rewrite, so every overlap would be 1.0")
+    elif args.snowflake or args.rewrites:
+        parser.error("--snowflake and --rewrites only apply to --compare-rewrite and --audit-gate")
+    if args.trace:
+        tracing.configure(export_path=args.trace)
+    pipeline = make_pipeline(args)
+    rewrites = load_rewrites(args.rewrites) if args.rewrites else None
+    if args.compare_rewrite:
+        for row in compare_rewrite_modes(pipeline, pet_id=args.pet_id, rewrites=rewrites):
+            print(json.dumps(row))
+        return
+    if args.audit_gate:
+        for row in audit_rewrite_gate(pipeline, pet_id=args.pet_id, rewrites=rewrites):
+            print(json.dumps(row))
+        return
+
+    questions = [QUESTIONS[i % len(QUESTIONS)] for i in range(args.turns)]
+    results = []
+    for _ in range(args.passes):
+        chat_store = ChatHistoryStore(pipeline.backend) if args.chat_summary else None
+        results += run_conversation(pipeline, questions, stream=args.stream, chat_store=chat_store)
+    summary = summarize(results)
+    if pipeline.completion_cache is not None:
+        summary["completion_cache"] = pipeline.completion_cache.stats()
+    if pipeline.search_cache is not None:
+        summary["search_cache"] = pipeline.search_cache.stats()
+    if pipeline.call_policy is not None:
+        summary["call_policy"] = pipeline.call_policy.stats()
+    if pipeline.model_route is not None:
+        summary["models"] = pipeline.model_route.router.stats()["by_model"]
+    summary["stage_latency"] = tracing.tracer.histograms()
+
+    if args.json:
+        for row in results:
+            print(json.dumps(row))
+        print(json.dumps({"summary": summary}))
+        return
+
+    print(f"{'wall s':>8} {'ttft s':>8} {'trips':>6} {'prompt B':>9}  question")
+    for row in results:
+        print(f"{row['wall_s']:>8.3f} {row['ttft_s']:>8.3f} {row['round_trips']:>6} {row['prompt_bytes']:>9}"
+              f"  {row['question']}")
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
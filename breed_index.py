@@ -0,0 +1,190 @@
+"""
+Local breed -> pet type index used by add_pet.
+
+Common breeds resolve from a curated table after normalization (case,
+punctuation, "mix" suffixes, aliases) or a close fuzzy match. A species
+word in the input ("maltese cat", "lab puppy") is kept, and a match of the
+other species is rejected rather than returned.
+Only misses go to the LLM, and valid LLM answers are learned back so the
+same breed never costs a second COMPLETE.
+"""
+import difflib
+import json
+import os
+import re
+import threading
+
+from rag_pipeline import PET_TYPES
+
+CURATED_BREEDS = {
+    # Large dogs
+    "labrador retriever": "Large Dog", "golden retriever": "Large Dog", "german shepherd": "Large Dog",
+    "rottweiler": "Large Dog", "great dane": "Large Dog", "boxer": "Large Dog",
+    "doberman pinscher": "Large Dog", "siberian husky": "Large Dog", "alaskan malamute": "Large Dog",
+    "bernese mountain": "Large Dog", "saint bernard": "Large Dog", "newfoundland": "Large Dog",
+    "mastiff": "Large Dog", "bullmastiff": "Large Dog", "great pyrenees": "Large Dog",
+    "irish wolfhound": "Large Dog", "akita": "Large Dog", "weimaraner": "Large Dog",
+    "rhodesian ridgeback": "Large Dog", "standard poodle": "Large Dog", "rough collie": "Large Dog",
+    "old english sheepdog": "Large Dog", "belgian malinois": "Large Dog", "cane corso": "Large Dog",
+    "leonberger": "Large Dog", "vizsla": "Large Dog", "german shorthaired pointer": "Large Dog",
+    "bloodhound": "Large Dog", "dalmatian": "Large Dog", "afghan hound": "Large Dog",
+    "greyhound": "Large Dog", "australian shepherd": "Large Dog", "border collie": "Large Dog",
+    "chesapeake bay retriever": "Large Dog", "flat coated retriever": "Large Dog",
+    "english bulldog": "Large Dog", "american bulldog": "Large Dog",
+    # Small dogs
+    "chihuahua": "Small Dog", "pomeranian": "Small Dog", "yorkshire terrier": "Small Dog",
+    "shih tzu": "Small Dog", "maltese": "Small Dog", "pug": "Small Dog", "french bulldog": "Small Dog",
+    "dachshund": "Small Dog", "beagle": "Small Dog", "boston terrier": "Small Dog",
+    "cavalier king charles spaniel": "Small Dog", "miniature schnauzer": "Small Dog",
+    "toy poodle": "Small Dog", "miniature poodle": "Small Dog", "bichon frise": "Small Dog",
+    "havanese": "Small Dog", "papillon": "Small Dog", "jack russell terrier": "Small Dog",
+    "west highland white terrier": "Small Dog", "lhasa apso": "Small Dog", "pekingese": "Small Dog",
+    "pembroke welsh corgi": "Small Dog", "cardigan welsh corgi": "Small Dog",
+    "shetland sheepdog": "Small Dog", "cocker spaniel": "Small Dog", "miniature pinscher": "Small Dog",
+    "italian greyhound": "Small Dog", "scottish terrier": "Small Dog", "cairn terrier": "Small Dog",
+    "border terrier": "Small Dog", "japanese chin": "Small Dog", "shiba inu": "Small Dog",
+    "brussels griffon": "Small Dog", "affenpinscher": "Small Dog", "maltipoo": "Small Dog",
+    # Large cats
+    "maine coon": "Large Cat", "ragdoll": "Large Cat", "norwegian forest": "Large Cat",
+    "siberian": "Large Cat", "savannah": "Large Cat", "british shorthair": "Large Cat",
+    "chausie": "Large Cat", "ragamuffin": "Large Cat", "turkish van": "Large Cat",
+    "bengal": "Large Cat", "american bobtail": "Large Cat",
+    # Small cats
+    "siamese": "Small Cat", "singapura": "Small Cat", "devon rex": "Small Cat",
+    "cornish rex": "Small Cat", "munchkin": "Small Cat", "abyssinian": "Small Cat",
+    "burmese": "Small Cat", "russian blue": "Small Cat", "sphynx": "Small Cat",
+    "scottish fold": "Small Cat", "persian": "Small Cat", "exotic shorthair": "Small Cat",
+    "american shorthair": "Small Cat", "domestic shorthair": "Small Cat", "tonkinese": "Small Cat",
+    "balinese": "Small Cat", "oriental shorthair": "Small Cat", "birman": "Small Cat",
+}
+
+ALIASES = {
+    "lab": "labrador retriever", "labrador": "labrador retriever", "golden": "golden retriever",
+    "gsd": "german shepherd", "alsatian": "german shepherd", "husky": "siberian husky",
+    "doberman": "doberman pinscher", "dobermann": "doberman pinscher", "pyrenees": "great pyrenees",
+    "yorkie": "yorkshire terrier", "doxie": "dachshund", "sausage": "dachshund",
+    "westie": "west highland white terrier", "frenchie": "french bulldog", "pom": "pomeranian",
+    "cavalier": "cavalier king charles spaniel", "sheltie": "shetland sheepdog",
+    "corgi": "pembroke welsh corgi", "jack russell": "jack russell terrier", "bichon": "bichon frise",
+    "min pin": "miniature pinscher", "schnauzer": "miniature schnauzer", "shih tsu": "shih tzu",
+    "collie": "rough collie", "aussie": "australian shepherd", "maine coon cat": "maine coon",
+    "bulldog": "english bulldog", "british bulldog": "english bulldog", "poodle": "standard poodle",
+    "mini poodle": "miniature poodle", "teacup poodle": "toy poodle",
+    "dsh": "domestic shorthair", "tabby": "domestic shorthair", "moggy": "domestic shorthair",
+}
+
+_NOISE_WORDS = {"mix", "mixed", "cross", "breed", "a", "the"}
+_SPECIES_WORDS = {"dog": "dog", "dogs": "dog", "puppy": "dog", "pup": "dog",
+                  "cat": "cat", "cats": "cat", "kitten": "cat", "kitty": "cat"}
+
+
+def normalize_breed(breed):
+    """
+    Lower-case breed words without punctuation or filler. A species word is
+    kept as a trailing "dog" or "cat", unless the input names both.
+    """
+    words = re.sub(r"[^a-z ]+", " ", breed.lower().replace("-", " ")).split()
+    species = {_SPECIES_WORDS[word] for word in words if word in _SPECIES_WORDS}
+    words = [word for word in words if word not in _NOISE_WORDS and word not in _SPECIES_WORDS]
+    if len(species) == 1:
+        words.append(species.pop())
+    return " ".join(words)
+
+
+def split_species(key):
+    """
+    Returns:
+        tuple: (breed words, "dog" / "cat" / None) of a normalize_breed() key
+    """
+    head, _, last = key.rpartition(" ")
+    if last in ("dog", "cat"):
+        return head, last
+    return key, None
+
+
+def species_matches(pet_type, species):
+    return species is None or pet_type.lower().endswith(species)
+
+
+class BreedIndex:
+    """
+    Args:
+        learned_path (str): Optional JSON file holding breeds learned from the LLM
+        fuzzy_cutoff (float): difflib ratio required for a fuzzy match
+    """
+
+    def __init__(self, learned_path=None, fuzzy_cutoff=0.8):
+        self.learned_path = learned_path
+        self.fuzzy_cutoff = fuzzy_cutoff
+        self._lock = threading.Lock()
+        self._table = {normalize_breed(breed): pet_type for breed, pet_type in CURATED_BREEDS.items()}
+        for alias, breed in ALIASES.items():
+            self._table.setdefault(normalize_breed(alias), CURATED_BREEDS[breed])
+        self._builtin = set(self._table)
+        if learned_path and os.path.exists(learned_path):
+            with open(learned_path) as f:
+                self._table.update(json.load(f))
+        self._by_species = self._species_tables()
+
+    def _species_tables(self):
+        """
+        Breed words -> pet type for each species named in an input (None for
+        neither), without the other species' entries, so "maltese cat" never
+        becomes a Small Dog. Rebuilt only when a breed is learned.
+        """
+        tables = {}
+        for species in (None, "dog", "cat"):
+            table = tables[species] = {}
+            for known, pet_type in self._table.items():
+                if species_matches(pet_type, species):
+                    table.setdefault(split_species(known)[0], pet_type)
+        return tables
+
+    def resolve(self, breed):
+        """
+        Returns:
+            str: The pet type, or None if the breed is unknown locally
+        """
+        key = normalize_breed(breed)
+        base, species = split_species(key)
+        if not base:
+            return None
+        with self._lock:
+            if key in self._table:
+                return self._table[key]
+            table = self._by_species[species]
+        if base in table:
+            return table[base]
+        # "golden retriever poodle" style inputs: the longest known breed named in the text
+        contained = [known for known in table if f" {known} " in f" {base} "]
+        if contained:
+            return table[max(contained, key=len)]
+        close = difflib.get_close_matches(base, table.keys(), n=1, cutoff=self.fuzzy_cutoff)
+        return table[close[0]] if close else None
+
+    def learn(self, breed, pet_type):
+        key = normalize_breed(breed)
+        if not key or pet_type not in PET_TYPES or pet_type == 'Undefined':
+            return
+        with self._lock:
+            self._table[key] = pet_type
+            self._by_species = self._species_tables()
+            if self.learned_path:
+                learned = {k: v for k, v in self._table.items() if k not in self._builtin}
+                with open(self.learned_path, "w") as f:
+                    json.dump(learned, f, indent=0, sort_keys=True)
+
+    def classify(self, breed, llm_classify):
+        """
+        Resolve locally, falling back to llm_classify(breed) on a miss. The
+        LLM answer is validated against PET_TYPES and the species named in
+        the breed, and learned when usable.
+        """
+        pet_type = self.resolve(breed)
+        if pet_type is not None:
+            return pet_type
+        pet_type = (llm_classify(breed) or "").strip().strip("'\".")
+        if pet_type not in PET_TYPES or not species_matches(pet_type, split_species(normalize_breed(breed))[1]):
+            return 'Undefined'
+        self.learn(breed, pet_type)
+        return pet_type
@@ -0,0 +1,329 @@
+"""
+Deadlines, hedging and retries for Cortex calls.
+
+COMPLETE and Cortex Search calls used to run without a timeout, so one slow
+warehouse response stalled the whole answer. CallPolicy runs every call
+under:
+
+- a per-question latency budget (QuestionBudget) split across the stages of
+  a question: "query" (the rewrite), "context" (search) and "answer". A stage
+  may use at most its share of the budget, and never more than is left;
+- a hedge: when an attempt runs longer than the p95 of recent attempts of
+  the same call, an identical request is sent and the first answer wins;
+- retries of transient errors (timeouts, dropped connections, throttling)
+  with jittered exponential backoff, inside the same deadline.
+
+RagPipeline uses the budget to degrade rather than fail: the rewrite is
+skipped when its recent p95 no longer fits, and the search deadline shrinks
+to what the context stage has left.
+"""
+import contextvars
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+from tenacity import Retrying, retry_if_exception, stop_after_attempt, stop_any, wait_random_exponential
+
+from tracing import annotate, percentile
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUDGET = 20.0
+# Most a stage may take, as a fraction of the budget; the answer gets whatever is left
+STAGE_SHARES = {"query": 0.25, "context": 0.25, "answer": 1.0}
+DEFAULT_MAX_WORKERS = 32
+
+# Exception class names of the Snowflake connector / Snowpark that are worth retrying,
+# matched by name so neither package has to be importable here
+TRANSIENT_ERROR_NAMES = {
+    "OperationalError", "InterfaceError", "RequestTimeoutError", "ServiceUnavailableError",
+    "OtherHTTPRetryableError", "BadGatewayError", "GatewayTimeoutError", "SnowparkFetchDataException",
+}
+TRANSIENT_MARKERS = (
+    "timeout", "timed out", "temporarily unavailable", "too many requests", "throttl",
+    "connection reset", "connection aborted", "429", "502", "503", "504",
+)
+
+_current_budget = contextvars.ContextVar("question_budget", default=None)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_call_executor():
+    """
+    Process-wide pool the attempts run on, so a caller can stop waiting for
+    one. Separate from the stage and search pools, which the callers run on.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=DEFAULT_MAX_WORKERS, thread_name_prefix="cortex-call")
+        return _executor
+
+
+class DeadlineExceeded(TimeoutError):
+    """
+    A call ran out of its stage's share of the question budget. Not retried.
+    """
+
+
+def is_transient(exc):
+    if isinstance(exc, DeadlineExceeded):
+        return False
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+    if any(cls.__name__ in TRANSIENT_ERROR_NAMES for cls in type(exc).__mro__):
+        return True
+    message = str(exc).lower()
+    return any(marker in message for marker in TRANSIENT_MARKERS)
+
+
+def current_budget():
+    return _current_budget.get()
+
+
+class QuestionBudget:
+    """
+    Time left for one question.
+
+    Args:
+        total (float): Seconds for the whole question
+        shares (dict): Stage -> most of the budget it may use, as a fraction
+    """
+
+    def __init__(self, total, shares=None):
+        self.total = total
+        self.shares = dict(STAGE_SHARES if shares is None else shares)
+        self.deadline = time.monotonic() + total
+        self.degraded = []
+        self._stage_deadlines = {}
+        self._lock = threading.Lock()
+
+    def remaining(self):
+        return max(0.0, self.deadline - time.monotonic())
+
+    def stage_deadline(self, stage):
+        """
+        Deadline of a stage, fixed when its first call asks for it, so every
+        call of the stage (retries, hedges, a chained rewrite) shares it.
+        """
+        with self._lock:
+            if stage not in self._stage_deadlines:
+                share = self.shares.get(stage, 1.0)
+                self._stage_deadlines[stage] = min(self.deadline, time.monotonic() + share * self.total)
+            return self._stage_deadlines[stage]
+
+    def stage_remaining(self, stage):
+        return max(0.0, self.stage_deadline(stage) - time.monotonic())
+
+    def degrade(self, what):
+        with self._lock:
+            self.degraded.append(what)
+        annotate(degraded=what)
+
+    @contextmanager
+    def active(self):
+        # Calls made in this context (and in stages it starts) use this budget
+        token = _current_budget.set(self)
+        try:
+            yield self
+        finally:
+            _current_budget.reset(token)
+
+
+class CallPolicy:
+    """
+    Args:
+        budget (float): Seconds per question; None runs questions without a budget
+        shares (dict): Stage -> fraction of the budget; see STAGE_SHARES
+        call_timeout (float): Most a single call may take, with or without a budget
+        max_attempts (int): Tries per call when the errors are transient
+        backoff (float): Base seconds of the jittered exponential backoff
+        max_backoff (float): Longest single wait between tries
+        hedge (tuple): Prefixes of the call names that may be hedged, e.g.
+            ("search.", "complete.rewrite"); () disables hedging
+        hedge_quantile (float): Percentile of recent attempt latencies after
+            which a duplicate request is sent
+        min_samples (int): Finished attempts of a call before it is hedged
+        window (int): Latest attempt latencies kept per call name
+        executor (Executor): Pool for the attempts; defaults to a shared one
+    """
+
+    def __init__(self, budget=DEFAULT_BUDGET, shares=None, call_timeout=30.0, max_attempts=3, backoff=0.2,
+                 max_backoff=2.0, hedge=("search.", "complete."), hedge_quantile=95, min_samples=20,
+                 window=200, executor=None):
+        self.budget = budget
+        self.shares = shares
+        self.call_timeout = call_timeout
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hedge = tuple(hedge)
+        self.hedge_quantile = hedge_quantile
+        self.min_samples = min_samples
+        self.window = window
+        self.executor = executor or get_call_executor()
+        self._latencies = {}
+        self._lock = threading.Lock()
+        self.counts = {"calls": 0, "retries": 0, "hedges": 0, "hedge_wins": 0, "deadline_exceeded": 0,
+                       "degraded": 0}
+
+    def question(self):
+        """
+        Returns:
+            QuestionBudget: A new budget, or None without one; activate it with
+            `with budget.active():` around the question's calls
+        """
+        if self.budget is None:
+            return None
+        return QuestionBudget(self.budget, self.shares)
+
+    def _count(self, counter, n=1):
+        with self._lock:
+            self.counts[counter] += n
+
+    def _record(self, name, seconds):
+        with self._lock:
+            samples = self._latencies.get(name)
+            if samples is None:
+                samples = self._latencies[name] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def expected(self, name, q=None):
+        """
+        Recent q-th percentile latency of a call in seconds, or None before min_samples.
+        """
+        with self._lock:
+            samples = sorted(self._latencies.get(name, ()))
+        if len(samples) < self.min_samples:
+            return None
+        return percentile(samples, self.hedge_quantile if q is None else q)
+
+    def fits(self, names, stage):
+        """
+        Whether calls with these names, one after the other, are likely to
+        finish within what the current question has left for stage.
+        """
+        budget = current_budget()
+        if budget is None:
+            return True
+        needed = sum(self.expected(name) or 0.0 for name in names)
+        return needed <= budget.stage_remaining(stage)
+
+    def degrade(self, what):
+        budget = current_budget()
+        if budget is not None:
+            budget.degrade(what)
+        self._count("degraded")
+
+    def deadline(self, stage=None):
+        deadline = time.monotonic() + self.call_timeout
+        budget = current_budget()
+        if budget is not None:
+            deadline = min(deadline, budget.stage_deadline(stage) if stage else budget.deadline)
+        return deadline
+
+    def call(self, name, fn, stage=None, discard=None):
+        """
+        Run fn() under the deadline of stage, hedged and retried.
+
+        Args:
+            name (str): Call name for latencies and hedging, e.g. "complete.rewrite"
+            fn (callable): The call; must be safe to run twice at once
+            stage (str): Budget stage the call belongs to, or None for the
+                whole question budget
+            discard (callable): discard(result) for results of attempts that
+                lost a hedge, e.g. to close a stream
+
+        Raises:
+            DeadlineExceeded: The stage ran out of time
+            Exception: The last error, once retries are used up or the error
+                is not transient
+        """
+        self._count("calls")
+        deadline = self.deadline(stage)
+
+        def log_retry(state):
+            self._count("retries")
+            annotate(retries=state.attempt_number)
+            logger.info("Retrying %s after %s", name, state.outcome.exception())
+
+        retrying = Retrying(
+            stop=stop_any(stop_after_attempt(self.max_attempts), lambda state: time.monotonic() >= deadline),
+            wait=wait_random_exponential(multiplier=self.backoff, max=self.max_backoff),
+            retry=retry_if_exception(is_transient),
+            before_sleep=log_retry,
+            reraise=True,
+        )
+        try:
+            for attempt in retrying:
+                with attempt:
+                    return self._hedged(name, fn, deadline, discard)
+        except DeadlineExceeded:
+            self._count("deadline_exceeded")
+            annotate(deadline_exceeded=True)
+            raise
+
+    def _timed(self, name, fn):
+        started = time.monotonic()
+        result = fn()
+        # Recorded even when nobody waits any more, so slow attempts still count
+        self._record(name, time.monotonic() - started)
+        return result
+
+    def _submit(self, name, fn):
+        return self.executor.submit(contextvars.copy_context().run, self._timed, name, fn)
+
+    def _hedged(self, name, fn, deadline, discard):
+        if deadline <= time.monotonic():
+            raise DeadlineExceeded(f"No time left for {name}")
+        attempts = [self._submit(name, fn)]
+        delay = self.expected(name) if name.startswith(self.hedge) else None
+        if delay is not None and time.monotonic() + delay < deadline:
+            done, _ = wait(attempts, timeout=delay)
+            if not done:
+                attempts.append(self._submit(name, fn))
+                self._count("hedges")
+                annotate(hedged=True)
+
+        pending = set(attempts)
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, deadline - time.monotonic()),
+                                 return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            winner = next((future for future in done if future.exception() is None), None)
+            if winner is not None:
+                for future in (done | pending) - {winner}:
+                    self._release(future, discard)
+                if winner is not attempts[0]:
+                    self._count("hedge_wins")
+                return winner.result()
+            error = next(iter(done)).exception()
+
+        for future in pending:
+            # Left running; its result is dropped
+            self._release(future, discard)
+        if pending or error is None:
+            raise DeadlineExceeded(f"{name} did not finish in time")
+        raise error
+
+    @staticmethod
+    def _release(future, discard):
+        if future.cancel() or discard is None:
+            return
+        future.add_done_callback(lambda f: f.exception() is None and discard(f.result()))
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self.counts)
+            names = sorted(self._latencies)
+        expected = {name: self.expected(name) for name in names}
+        counts["p95_ms"] = {name: round(seconds * 1000, 1) for name, seconds in expected.items()
+                            if seconds is not None}
+        return counts
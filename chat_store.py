@@ -0,0 +1,193 @@
+"""
+Persisted chat history with a rolling summary.
+
+Conversations used to live only in st.session_state, and every turn re-sent
+the last seven raw messages to the rewrite and answer prompts, so long
+answers were paid for again and again. Here:
+
+- messages are stored in CHAT_MESSAGES (rag2.sql), append-only, and buffered
+  so a whole turn (question + answer) is written with one INSERT;
+- opening a pet loads only the latest page; older pages are fetched on
+  demand with keyset pagination on (SEQ, ID). SEQ is counted per session,
+  so two sessions on one conversation can repeat it; ID comes from a
+  sequence (rag2.sql) and keeps the cursor unique;
+- every `refresh_every` turns the messages that have scrolled out of the
+  recent window are folded into a per-conversation summary (CHAT_SUMMARIES)
+  with one COMPLETE, and prompts get summary + recent messages instead of a
+  raw window, so prompt size stays flat as the conversation grows.
+"""
+import threading
+
+INSERT_MESSAGES_SQL = "INSERT INTO chat_messages (id, user_id, pet_id, seq, role, content, created_at) VALUES "
+MESSAGE_ROW_SQL = "(chat_message_id_seq.NEXTVAL, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP())"
+LATEST_PAGE_SQL = """SELECT id, seq, role, content FROM chat_messages
+                     WHERE user_id = ? AND pet_id = ? ORDER BY seq DESC, id DESC LIMIT ?"""
+EARLIER_PAGE_SQL = """SELECT id, seq, role, content FROM chat_messages
+                      WHERE user_id = ? AND pet_id = ? AND (seq < ? OR (seq = ? AND id < ?))
+                      ORDER BY seq DESC, id DESC LIMIT ?"""
+SUMMARY_SQL = "SELECT summary, through_seq FROM chat_summaries WHERE user_id = ? AND pet_id = ?"
+SAVE_SUMMARY_SQL = """MERGE INTO chat_summaries s
+                      USING (SELECT ? AS user_id, ? AS pet_id, ? AS summary, ? AS through_seq) n
+                      ON s.user_id = n.user_id AND s.pet_id = n.pet_id
+                      WHEN MATCHED THEN UPDATE SET summary = n.summary, through_seq = n.through_seq,
+                                                   updated_at = CURRENT_TIMESTAMP()
+                      WHEN NOT MATCHED THEN INSERT (user_id, pet_id, summary, through_seq, updated_at)
+                           VALUES (n.user_id, n.pet_id, n.summary, n.through_seq, CURRENT_TIMESTAMP())"""
+
+SUMMARY_ROLE = "summary"
+
+
+class Conversation:
+    """
+    The loaded part of one user's conversation about one pet.
+
+    Attributes:
+        messages (list): {"seq", "role", "content"} dicts, oldest first; loaded
+            ones also carry the row "id"
+        has_more (bool): Whether older messages exist that are not loaded
+        summary (str): Rolling summary of messages up to summary_seq
+        summary_seq (int): Last message seq folded into the summary, or -1
+        next_seq (int): Seq the next appended message gets
+    """
+
+    def __init__(self, user, pet, messages=(), has_more=False, summary="", summary_seq=-1):
+        self.user = user
+        self.pet = pet
+        self.messages = list(messages)
+        self.has_more = has_more
+        self.summary = summary
+        self.summary_seq = summary_seq
+        self.next_seq = self.messages[-1]["seq"] + 1 if self.messages else summary_seq + 1
+        self._lock = threading.Lock()
+
+    def add(self, role, content):
+        """
+        Append a message with the next seq. Summary refreshes read the
+        conversation on a worker thread, so changes go through the lock.
+        """
+        with self._lock:
+            message = {"seq": self.next_seq, "role": role, "content": content}
+            self.next_seq += 1
+            self.messages.append(message)
+            return message
+
+    def set_summary(self, summary, through_seq):
+        with self._lock:
+            self.summary = summary
+            self.summary_seq = through_seq
+
+    def unsummarized(self):
+        with self._lock:
+            return [m for m in self.messages if m["seq"] > self.summary_seq]
+
+    def prompt_history(self):
+        """
+        What the prompts see instead of a raw window: the summary, then every
+        message after it except the newest (the question being answered).
+        """
+        recent = [{"role": m["role"], "content": m["content"]} for m in self.unsummarized()[:-1]]
+        summary = self.summary
+        if summary:
+            return [{"role": SUMMARY_ROLE, "content": summary}] + recent
+        return recent
+
+
+class ChatHistoryStore:
+    """
+    Args:
+        backend (CortexBackend): Where the chat tables live
+        page_size (int): Messages loaded when a pet is opened, and per "load earlier"
+        refresh_every (int): Turns (question + answer) between summary refreshes
+        keep_recent (int): Newest messages always kept verbatim in prompts
+    """
+
+    def __init__(self, backend, page_size=20, refresh_every=2, keep_recent=2):
+        self.backend = backend
+        self.page_size = page_size
+        self.refresh_every = refresh_every
+        self.keep_recent = keep_recent
+        self._pending = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _rows(rows):
+        return [{"id": row['ID'], "seq": row['SEQ'], "role": row['ROLE'], "content": row['CONTENT']}
+                for row in reversed(rows)]
+
+    def open(self, user, pet):
+        """
+        Load the summary and the latest page of a conversation.
+        """
+        summary = self.backend.sql(SUMMARY_SQL, (user, pet))
+        rows = self.backend.sql(LATEST_PAGE_SQL, (user, pet, self.page_size + 1))
+        has_more = len(rows) > self.page_size
+        messages = self._rows(rows[:self.page_size])
+        if summary:
+            return Conversation(user, pet, messages, has_more, summary[0]['SUMMARY'] or "",
+                                summary[0]['THROUGH_SEQ'])
+        return Conversation(user, pet, messages, has_more)
+
+    def load_earlier(self, conversation):
+        """
+        Prepend the next older page (keyset pagination on (SEQ, ID)).
+        """
+        if not conversation.has_more or not conversation.messages:
+            return
+        # has_more is only set by loads, so the oldest message came from the table and has an id
+        oldest = conversation.messages[0]
+        rows = self.backend.sql(EARLIER_PAGE_SQL, (conversation.user, conversation.pet, oldest["seq"],
+                                                   oldest["seq"], oldest["id"], self.page_size + 1))
+        conversation.has_more = len(rows) > self.page_size
+        conversation.messages[:0] = self._rows(rows[:self.page_size])
+
+    def append(self, conversation, role, content):
+        """
+        Add a message to the conversation and buffer it for the next flush().
+        """
+        message = conversation.add(role, content)
+        with self._lock:
+            self._pending.append((conversation.user, conversation.pet, message["seq"], role, content))
+        return message
+
+    def flush(self):
+        """
+        Write every buffered message with a single INSERT.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return 0
+        try:
+            self.backend.sql(INSERT_MESSAGES_SQL + ", ".join([MESSAGE_ROW_SQL] * len(pending)),
+                             [value for row in pending for value in row])
+        except Exception:
+            with self._lock:
+                self._pending[:0] = pending
+            raise
+        return len(pending)
+
+    def needs_summary(self, conversation):
+        return len(conversation.unsummarized()) >= self.refresh_every * 2 + self.keep_recent
+
+    def refresh_summary(self, conversation, summarize):
+        """
+        Fold older unsummarized messages into the summary when refresh_every
+        turns have piled up beyond keep_recent.
+
+        Args:
+            summarize (callable): summarize(previous_summary, messages) -> str,
+                e.g. RagPipeline.summarize_history
+
+        Returns:
+            bool: Whether the summary was refreshed
+        """
+        if not self.needs_summary(conversation):
+            return False
+        folded = conversation.unsummarized()[:-self.keep_recent]
+        summary = summarize(conversation.summary, [{"role": m["role"], "content": m["content"]} for m in folded])
+        if not summary:
+            return False
+        conversation.set_summary(summary.strip(), folded[-1]["seq"])
+        self.backend.sql(SAVE_SUMMARY_SQL, (conversation.user, conversation.pet,
+                                            conversation.summary, conversation.summary_seq))
+        return True
@@ -0,0 +1,94 @@
+"""
+Local ingestion-throughput benchmark for text_chunker.py.
+
+Generates a synthetic markdown handbook of the requested size, the shape
+PARSE_DOCUMENT LAYOUT mode produces, and chunks it without a warehouse.
+
+    python chunker_benchmark.py --mb 8
+    python chunker_benchmark.py --mb 2 --legacy    # also time the old heading loop
+    python chunker_benchmark.py --mb 8 --memory    # peak Python memory via tracemalloc
+"""
+import argparse
+import json
+import random
+import time
+import tracemalloc
+
+from text_chunker import iter_chunk_spans, iter_headings, text_chunker
+
+WORDS = ("dog cat vomiting appetite vaccine fever skin ear dental weight hydration vet "
+         "symptom treatment dose daily monitor breed puppy kitten senior diet").split()
+
+
+def synthetic_document(size_mb, seed=0):
+    rng = random.Random(seed)
+    target = int(size_mb * 1024 * 1024)
+    parts = []
+    size = 0
+    section = 0
+    while size < target:
+        section += 1
+        block = [f"# Chapter {section}\n"]
+        for sub in range(rng.randint(2, 5)):
+            block.append(f"## Topic {section}.{sub}\n")
+            for _ in range(rng.randint(2, 6)):
+                block.append(" ".join(rng.choice(WORDS) for _ in range(rng.randint(40, 160))) + ".\n\n")
+        text = "".join(block)
+        parts.append(text)
+        size += len(text)
+    return "".join(parts)[:target]
+
+
+def legacy_heading_pass(pdf_text, chunks):
+    """
+    The heading assignment the UDTF used before: every heading against every chunk.
+    """
+    headings = [heading for _, _, heading in iter_headings(pdf_text)]
+    data = []
+    current_main_heading = "No Main Heading"
+    for chunk in chunks:
+        for heading in headings:
+            if heading in chunk:
+                current_main_heading = heading
+        data.append((current_main_heading, chunk))
+    return data
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mb", type=float, default=8.0, help="Synthetic document size in MB")
+    parser.add_argument("--legacy", action="store_true", help="Also time the old chunks x headings loop")
+    parser.add_argument("--memory", action="store_true", help="Measure peak memory (slower)")
+    args = parser.parse_args()
+
+    document = synthetic_document(args.mb)
+    chunker = text_chunker()
+
+    if args.memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    rows = 0
+    for _ in chunker.process(document, "paragraph"):
+        rows += 1
+    elapsed = time.perf_counter() - started
+    result = {
+        "document_mb": round(len(document) / 1024 / 1024, 2),
+        "chunks": rows,
+        "seconds": round(elapsed, 3),
+        "mb_per_s": round(len(document) / 1024 / 1024 / elapsed, 2),
+    }
+    if args.memory:
+        result["peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 2)
+        tracemalloc.stop()
+
+    if args.legacy:
+        chunks = [document[start:end] for start, end in iter_chunk_spans(document)]
+        started = time.perf_counter()
+        legacy_heading_pass(document, chunks)
+        result["legacy_heading_pass_s"] = round(time.perf_counter() - started, 3)
+
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+Cache for SNOWFLAKE.CORTEX.COMPLETE results.
+
+Entries are keyed by model, pipeline stage and a hash of the whitespace-
+normalized prompt. Only stages listed in stage_ttls are cached, so the final
+personalized answer stays uncached unless explicitly opted in. An optional
+SQLite file keeps entries across process restarts.
+"""
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from tracing import annotate
+
+# Seconds each stage's completions stay valid. Breed -> pet type never changes;
+# rewrites are deterministic for the same text but prompts get tuned over time.
+DEFAULT_STAGE_TTLS = {
+    "pet_type": 30 * 24 * 3600,
+    "rewrite": 24 * 3600,
+    "contextual_rewrite": 24 * 3600,
+    "summarize": 24 * 3600,
+}
+
+
+def normalize_prompt(prompt):
+    return " ".join(prompt.split())
+
+
+def cache_key(model, stage, prompt):
+    digest = hashlib.sha256(normalize_prompt(prompt).encode("utf-8")).hexdigest()
+    return f"{model}:{stage}:{digest}"
+
+
+class LRUTTLCache:
+    """
+    Thread-safe in-memory cache with a maximum entry count, LRU eviction and
+    a per-entry expiry time.
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.time() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SqliteCacheTier:
+    """
+    On-disk second tier so cached completions survive restarts.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS completions (key TEXT PRIMARY KEY, value TEXT, expires_at REAL)"
+            )
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM completions WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or row[1] <= time.time():
+            return None
+        return row[0], row[1]
+
+    def set(self, key, value, ttl):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO completions (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, time.time() + ttl),
+            )
+
+    def purge_expired(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM completions WHERE expires_at <= ?", (time.time(),))
+
+
+class CompletionCache:
+    """
+    Stage-aware cache in front of CortexBackend.complete.
+
+    Args:
+        stage_ttls (dict): Stage name -> TTL seconds; stages not listed are never cached
+        max_entries (int): In-memory LRU capacity
+        sqlite_path (str): Optional file for the persistent tier
+    """
+
+    def __init__(self, stage_ttls=None, max_entries=1024, sqlite_path=None):
+        self.stage_ttls = dict(DEFAULT_STAGE_TTLS if stage_ttls is None else stage_ttls)
+        self.memory = LRUTTLCache(max_entries)
+        self.disk = SqliteCacheTier(sqlite_path) if sqlite_path else None
+        self._lock = threading.Lock()
+        self.hits = {}
+        self.misses = {}
+
+    def enabled(self, stage):
+        return stage in self.stage_ttls
+
+    def _count(self, counter, stage):
+        with self._lock:
+            counter[stage] = counter.get(stage, 0) + 1
+
+    def get(self, model, stage, prompt):
+        key = cache_key(model, stage, prompt)
+        value = self.memory.get(key)
+        if value is None and self.disk is not None:
+            found = self.disk.get(key)
+            if found is not None:
+                value, expires_at = found
+                self.memory.set(key, value, expires_at - time.time())
+        self._count(self.misses if value is None else self.hits, stage)
+        return value
+
+    def set(self, model, stage, prompt, value):
+        key = cache_key(model, stage, prompt)
+        ttl = self.stage_ttls[stage]
+        self.memory.set(key, value, ttl)
+        if self.disk is not None:
+            self.disk.set(key, value, ttl)
+
+    def complete(self, backend, model, prompt, stage, fetch=None):
+        """
+        backend.complete(model, prompt), served from cache when the stage allows it.
+        On a miss, fetch() makes the call instead when given (e.g. through a
+        CallPolicy, so that only real round trips are timed).
+        """
+        if fetch is None:
+            fetch = lambda: backend.complete(model, prompt)
+        if not self.enabled(stage):
+            return fetch()
+        value = self.get(model, stage, prompt)
+        annotate(cache_hit=value is not None)
+        if value is None:
+            value = fetch()
+            if value:
+                self.set(model, stage, prompt, value)
+        return value
+
+    def stats(self):
+        with self._lock:
+            stages = sorted(set(self.hits) | set(self.misses))
+            return {stage: {"hits": self.hits.get(stage, 0), "misses": self.misses.get(stage, 0)}
+                    for stage in stages}
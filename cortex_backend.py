@@ -0,0 +1,368 @@
+"""
+Backends for everything the FurWell RAG pipeline needs from Snowflake:
+plain SQL, SNOWFLAKE.CORTEX.COMPLETE and Cortex Search.
+
+SnowparkBackend talks to a live account. LocalBackend is a deterministic,
+in-process stand-in with configurable latencies, used by benchmark.py to
+measure the pipeline without a warehouse.
+"""
+import hashlib
+import importlib
+import json
+import logging
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+COMPLETE_SQL = "SELECT SNOWFLAKE.CORTEX.COMPLETE(?, ?)"
+# Server-sent events endpoint the streamed answer comes from (the SQL function cannot stream)
+COMPLETE_REST_PATH = "/api/v2/cortex/inference:complete"
+COMPLETE_REST_TIMEOUT = (10, 120)  # connect, read between events
+
+
+def matches_filter(row, filter_condition):
+    """
+    Evaluate a Cortex Search filter (@eq / @or / @and / @not) against a row.
+
+    Args:
+        row (dict): Column name -> value
+        filter_condition (dict): Filter in Cortex Search syntax, or None
+
+    Returns:
+        bool: True if the row passes the filter
+    """
+    if not filter_condition:
+        return True
+    for op, arg in filter_condition.items():
+        if op == "@eq":
+            if any(row.get(col) != value for col, value in arg.items()):
+                return False
+        elif op == "@or":
+            if not any(matches_filter(row, sub) for sub in arg):
+                return False
+        elif op == "@and":
+            if not all(matches_filter(row, sub) for sub in arg):
+                return False
+        elif op == "@not":
+            if matches_filter(row, arg):
+                return False
+        else:
+            raise ValueError(f"Unsupported filter operator: {op}")
+    return True
+
+
+def filter_columns(filter_condition):
+    """
+    Columns a Cortex Search filter refers to.
+    """
+    columns = set()
+    for op, arg in (filter_condition or {}).items():
+        if op == "@eq":
+            columns.update(arg)
+        elif op in ("@or", "@and"):
+            for sub in arg:
+                columns |= filter_columns(sub)
+        elif op == "@not":
+            columns |= filter_columns(arg)
+    return columns
+
+
+class BackendStats:
+    """
+    Thread-safe round-trip counters shared by all backends.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.calls = {"sql": 0, "complete": 0, "search": 0}
+            self.prompt_bytes = 0
+
+    def record(self, kind, prompt_bytes=0):
+        with self._lock:
+            self.calls[kind] += 1
+            self.prompt_bytes += prompt_bytes
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "round_trips": sum(self.calls.values()),
+                "prompt_bytes": self.prompt_bytes,
+                **{f"{kind}_calls": n for kind, n in self.calls.items()},
+            }
+
+
+class CortexBackend:
+    """
+    Interface for the three kinds of round trips the app makes.
+
+    Rows returned by sql() support both row['COLUMN'] and row[index] access,
+    like snowflake.snowpark.Row.
+    """
+
+    def __init__(self):
+        self.stats = BackendStats()
+
+    def sql(self, query, params=None):
+        raise NotImplementedError
+
+    def complete(self, model, prompt):
+        raise NotImplementedError
+
+    def complete_stream(self, model, prompt):
+        """
+        Yield the completion in pieces as they arrive. Backends that cannot
+        stream yield the whole blocking answer once.
+        """
+        yield self.complete(model, prompt)
+
+    def search(self, service, query, columns, filter=None, limit=5):
+        raise NotImplementedError
+
+
+class SnowparkBackend(CortexBackend):
+    """
+    Backend over a pool of Snowpark sessions (see session_pool.py). Every
+    call borrows a connection for its own duration only.
+    """
+
+    def __init__(self, pool, database, schema):
+        super().__init__()
+        self.pool = pool
+        self.database = database
+        self.schema = schema
+
+    @classmethod
+    def from_connection_params(cls, connection_params, pool_size=4):
+        from session_pool import ConnectionPool, SnowflakeConnection
+
+        pool = ConnectionPool(lambda: SnowflakeConnection.create(connection_params), max_size=pool_size)
+        return cls(pool, connection_params["database"], connection_params["schema"])
+
+    def sql(self, query, params=None):
+        self.stats.record("sql")
+        with self.pool.checkout() as connection:
+            return connection.session.sql(query, params=params).collect()
+
+    def complete(self, model, prompt):
+        self.stats.record("complete", len(prompt.encode("utf-8")))
+        with self.pool.checkout() as connection:
+            return connection.session.sql(COMPLETE_SQL, params=[model, prompt]).collect()[0][0]
+
+    def complete_stream(self, model, prompt):
+        """
+        Stream from the Cortex REST endpoint, authenticated with a pooled
+        session's token. The connection goes back to the pool before the
+        answer streams, so a long answer does not hold it. Falls back to the
+        blocking SQL call when the endpoint refuses the request or cannot be
+        reached.
+        """
+        import requests
+
+        with self.pool.checkout() as connection:
+            rest = connection.session.connection
+            url, token = f"https://{rest.host}{COMPLETE_REST_PATH}", rest.rest.token
+        try:
+            response = requests.post(
+                url,
+                json={"model": model, "messages": [{"role": "user", "content": prompt}], "stream": True},
+                headers={"Authorization": f'Snowflake Token="{token}"', "Content-Type": "application/json",
+                         "Accept": "text/event-stream"},
+                stream=True, timeout=COMPLETE_REST_TIMEOUT,
+            )
+        except requests.RequestException as e:
+            # Connection refused, DNS, TLS or COMPLETE_REST_TIMEOUT
+            logger.warning("Streaming COMPLETE request failed (%s); using the SQL function", e)
+            yield from super().complete_stream(model, prompt)
+            return
+        if response.status_code >= 400:
+            logger.warning("Streaming COMPLETE failed with HTTP %s; using the SQL function",
+                           response.status_code)
+            response.close()
+            yield from super().complete_stream(model, prompt)
+            return
+        self.stats.record("complete", len(prompt.encode("utf-8")))
+        with response:
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                for choice in json.loads(data).get("choices", ()):
+                    piece = choice.get("delta", {}).get("content")
+                    if piece:
+                        yield piece
+
+    def search(self, service, query, columns, filter=None, limit=5):
+        self.stats.record("search")
+        with self.pool.checkout() as connection:
+            if service not in connection.services:
+                connection.services[service] = (
+                    connection.root.databases[self.database].schemas[self.schema].cortex_search_services[service]
+                )
+            response = connection.services[service].search(query, columns, limit=limit, filter=filter)
+        # results are already parsed dicts; no need to round-trip through JSON
+        return {"results": response.results, "request_id": response.request_id}
+
+
+class LocalRow(dict):
+    """
+    dict that also allows positional access, mirroring snowpark Row.
+    """
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return list(self.values())[key]
+        return super().__getitem__(key)
+
+
+def default_responder(model, prompt, answer_chars=600):
+    """
+    Deterministic COMPLETE stand-in.
+
+    Rewrite-style prompts echo their <question> so retrieval stays meaningful
+    (as {"query": ...} when the prompt asks for JSON); everything else gets a
+    canned answer whose text depends only on the prompt.
+    """
+    question = re.findall(r"<question>\s*(.*?)\s*</question>", prompt, re.S)
+    if question and "Answer:" not in prompt:
+        if '{"query":' in prompt:
+            return json.dumps({"query": question[-1]})
+        return question[-1]
+    digest = hashlib.sha256(f"{model}\n{prompt}".encode("utf-8")).hexdigest()
+    sentence = f"Stand-in answer {digest[:12]}. Keep your pet hydrated and watch for changes. "
+    return (sentence * (answer_chars // len(sentence) + 1))[:answer_chars]
+
+
+class LocalBackend(CortexBackend):
+    """
+    Deterministic in-process stand-in for SnowparkBackend.
+
+    Latencies are seconds per call; each may also be a zero-argument callable
+    so callers can sample from a distribution. COMPLETE additionally pays
+    complete_latency_per_kb for every KB of prompt, which is what makes prompt
+    size visible in benchmarks.
+
+    Args:
+        sql_latency: Delay for every sql() call
+        complete_latency: Fixed delay for every complete() call
+        complete_latency_per_kb: Extra delay per KB of prompt
+        token_latency: Delay per streamed piece (a word) of the answer; the
+            blocking complete() pays it for all pieces before returning
+        search_latency: Delay for every search() call
+        responder: callable(model, prompt) -> str producing COMPLETE output
+        model_speed: Model -> factor on every COMPLETE delay, e.g. 0.25 for a
+            small model; models not listed use 1.0
+    """
+
+    def __init__(self, sql_latency=0.0, complete_latency=0.0, complete_latency_per_kb=0.0,
+                 search_latency=0.0, responder=default_responder, token_latency=0.0, model_speed=None):
+        super().__init__()
+        self.sql_latency = sql_latency
+        self.complete_latency = complete_latency
+        self.complete_latency_per_kb = complete_latency_per_kb
+        self.token_latency = token_latency
+        self.search_latency = search_latency
+        self.responder = responder
+        self.model_speed = model_speed or {}
+        self._sql_handlers = []
+        self._services = {}
+
+    @staticmethod
+    def _sleep(latency, extra=0.0):
+        seconds = (latency() if callable(latency) else latency) + extra
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def add_sql_handler(self, pattern, handler):
+        """
+        Register handler(params) -> list[dict] for statements matching pattern.
+
+        Patterns are regular expressions matched case-insensitively against
+        the statement with whitespace collapsed. The first match wins.
+        """
+        self._sql_handlers.append((re.compile(pattern, re.I), handler))
+
+    def add_search_service(self, name, rows, on, attributes=()):
+        """
+        Register a search service over rows, ranking by token overlap with the `on` column.
+
+        Like Cortex Search, filters may only use the `attributes` columns
+        (the service's ATTRIBUTES clause); search() rejects any other filter.
+        """
+        self._services[name] = (on, set(attributes), list(rows))
+
+    def sql(self, query, params=None):
+        self.stats.record("sql")
+        self._sleep(self.sql_latency)
+        statement = " ".join(query.split())
+        for pattern, handler in self._sql_handlers:
+            if pattern.search(statement):
+                return [LocalRow(row) for row in handler(tuple(params or ()))]
+        return []
+
+    def complete(self, model, prompt):
+        pieces = list(self.complete_stream(model, prompt, token_latency=0.0))
+        self._sleep(self.token_latency * self.model_speed.get(model, 1.0) * len(pieces))
+        return "".join(pieces)
+
+    def complete_stream(self, model, prompt, token_latency=None):
+        prompt_bytes = len(prompt.encode("utf-8"))
+        self.stats.record("complete", prompt_bytes)
+        speed = self.model_speed.get(model, 1.0)
+        latency = self.complete_latency() if callable(self.complete_latency) else self.complete_latency
+        self._sleep(speed * (latency + self.complete_latency_per_kb * prompt_bytes / 1024))
+        token_latency = speed * (self.token_latency if token_latency is None else token_latency)
+        for piece in re.findall(r"\S+\s*|\s+", self.responder(model, prompt)):
+            self._sleep(token_latency)
+            yield piece
+
+    def search(self, service, query, columns, filter=None, limit=5):
+        self.stats.record("search")
+        self._sleep(self.search_latency)
+        on, attributes, rows = self._services[service]
+        unknown = filter_columns(filter) - attributes
+        if unknown:
+            raise ValueError(f"Filter columns {sorted(unknown)} are not ATTRIBUTES of {service}")
+        terms = set(re.findall(r"\w+", query.lower()))
+        scored = []
+        for position, row in enumerate(rows):
+            if not matches_filter(row, filter):
+                continue
+            score = len(terms & set(re.findall(r"\w+", str(row.get(on, "")).lower())))
+            scored.append((-score, position, row))
+        scored.sort(key=lambda item: item[:2])
+        return {"results": [{col: row.get(col) for col in columns} for _, _, row in scored[:limit]]}
+
+
+# name -> zero-argument factory, for create_backend
+BACKEND_FACTORIES = {}
+
+
+def register_backend(name, factory):
+    BACKEND_FACTORIES[name] = factory
+
+
+def create_backend(spec):
+    """
+    Build the backend the app should use instead of Snowflake, e.g. the fake
+    that load_test.py registers before driving streamlit_bot.py.
+
+    Args:
+        spec (str): A name passed to register_backend, or "module:callable"
+
+    Returns:
+        CortexBackend
+    """
+    if spec in BACKEND_FACTORIES:
+        return BACKEND_FACTORIES[spec]()
+    module_name, sep, attr = spec.partition(":")
+    if not sep:
+        raise ValueError(f"Unknown backend {spec!r}: register it or use 'module:callable'")
+    return getattr(importlib.import_module(module_name), attr)()
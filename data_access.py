@@ -0,0 +1,126 @@
+"""
+Request-scoped data access for one Streamlit script run.
+
+RequestScope wraps the process-wide backend for the length of a rerun. It
+runs identical parameterized reads only once, forgets them on any write,
+and counts the statements and bytes the rerun fetched for the debug panel.
+
+The process-wide stores (pet context, chat history, rewrite vocabulary)
+outlive any one rerun, so they cannot hold a RequestScope. They get a
+SharedBackend instead, whose SQL is counted in the scope active in the
+calling context, so the debug panel's totals include them.
+"""
+import contextvars
+import threading
+
+from cortex_backend import CortexBackend
+
+_current_scope = contextvars.ContextVar("request_scope", default=None)
+
+READ_PREFIXES = ("SELECT", "WITH", "SHOW", "DESCRIBE")
+
+
+def is_read(query):
+    return query.lstrip().upper().startswith(READ_PREFIXES)
+
+
+def row_bytes(row):
+    values = row.values() if isinstance(row, dict) else row
+    return sum(len(str(value)) for value in values)
+
+
+class RequestScope(CortexBackend):
+    """
+    Memoizing, counting wrapper around another backend. Safe to share with
+    the pipeline's worker threads.
+
+    Attributes:
+        statements (int): SQL statements actually sent
+        deduped (int): Reads answered from the memo
+        bytes_fetched (int): Approximate size of the rows returned
+    """
+
+    def __init__(self, backend):
+        super().__init__()
+        self.backend = backend
+        self._memo = {}
+        self._lock = threading.Lock()
+        self.statements = 0
+        self.shared_statements = 0
+        self.deduped = 0
+        self.bytes_fetched = 0
+
+    def activate(self):
+        """
+        Count SQL that SharedBackends send from this context (and from the
+        stages it starts) in this scope.
+        """
+        _current_scope.set(self)
+        return self
+
+    def count_shared(self, result):
+        with self._lock:
+            self.statements += 1
+            self.shared_statements += 1
+            self.bytes_fetched += sum(row_bytes(row) for row in result)
+
+    def sql(self, query, params=None):
+        statement = " ".join(query.split())
+        key = (statement, tuple(params or ()))
+        read = is_read(statement)
+        if read:
+            with self._lock:
+                if key in self._memo:
+                    self.deduped += 1
+                    return self._memo[key]
+        result = self.backend.sql(query, params)
+        with self._lock:
+            self.statements += 1
+            self.bytes_fetched += sum(row_bytes(row) for row in result)
+            if read:
+                self._memo[key] = result
+            else:
+                self._memo.clear()
+        return result
+
+    def complete(self, model, prompt):
+        return self.backend.complete(model, prompt)
+
+    def complete_stream(self, model, prompt):
+        return self.backend.complete_stream(model, prompt)
+
+    def search(self, service, query, columns, filter=None, limit=5):
+        return self.backend.search(service, query, columns, filter=filter, limit=limit)
+
+    def summary(self):
+        with self._lock:
+            return {"statements": self.statements, "from_shared_stores": self.shared_statements,
+                    "deduped_reads": self.deduped, "bytes_fetched": self.bytes_fetched}
+
+
+class SharedBackend(CortexBackend):
+    """
+    The process-wide backend as seen by process-wide stores: no memo, but
+    every statement is counted in the active RequestScope, if any.
+    """
+
+    def __init__(self, backend):
+        super().__init__()
+        self.backend = backend
+        self.stats = backend.stats
+
+    def sql(self, query, params=None):
+        result = self.backend.sql(query, params)
+        scope = _current_scope.get()
+        if scope is not None:
+            scope.count_shared(result)
+        return result
+
+    def complete(self, model, prompt):
+        return self.backend.complete(model, prompt)
+
+    def complete_stream(self, model, prompt):
+        return self.backend.complete_stream(model, prompt)
+
+    def search(self, service, query, columns, filter=None, limit=5):
+        return self.backend.search(service, query, columns, filter=filter, limit=limit)
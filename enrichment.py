@@ -0,0 +1,185 @@
+"""
+Batched pet-type classification and condition summarization for ingested chunks.
+
+Instead of one CLASSIFY_TEXT / COMPLETE per chunk, many chunks are packed
+into a single COMPLETE that answers with a JSON array. Each item is
+validated on its own (known id, pet_type in the allowed set, non-empty
+condition) and only the items that failed are retried. Batch size and the
+number of batches in flight are tunable.
+
+Use with ingest_docs(FALSE) from rag2.sql, which leaves PET_TYPE and
+CONDITION empty for this script to fill:
+
+    python enrichment.py --batch-size 20 --workers 4
+"""
+import argparse
+import json
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from rag_pipeline import PET_TYPES
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "mistral-large2"
+MAX_CHUNK_CHARS = 2000
+# Rows per MERGE. Each statement carries its own VALUES, so it can run on any pooled session
+MERGE_PAGE_SIZE = 500
+MERGE_ENRICHMENT_SQL = """MERGE INTO docs_chunks_table t
+    USING (SELECT column1 AS chunk_id, column2 AS pet_type, column3 AS condition FROM VALUES {rows}) e
+    ON TO_VARCHAR(HASH(t.relative_path, t.chunk)) = e.chunk_id
+    WHEN MATCHED THEN UPDATE SET pet_type = e.pet_type, condition = e.condition"""
+
+
+def build_batch_prompt(items):
+    """
+    items: list of (item_id, heading, chunk)
+    """
+    blocks = "\n".join(
+        f'<item id="{item_id}">\nHeading: {heading}\nText: {chunk[:MAX_CHUNK_CHARS]}\n</item>'
+        for item_id, heading, chunk in items
+    )
+    return f"""
+        For every item below, do two things:
+        1. Identify if the text refers to a large cat, small cat, large dog, or small dog.
+           pet_type must be exactly one of: 'Large Cat', 'Small Cat', 'Large Dog', 'Small Dog', 'Undefined'.
+           Choose 'Undefined' if the text cannot be clearly classified into the other four categories.
+        2. Based on the text and its related heading, summarize the main condition described in one or two sentences.
+
+        Respond with only a JSON array, one object per item, in the form
+        [{{"id": <item id>, "pet_type": "<pet type>", "condition": "<summary>"}}]
+        Do not add any explanation.
+
+        {blocks}
+        """
+
+
+def parse_batch_response(text, expected_ids):
+    """
+    Returns:
+        dict: item id -> {"pet_type", "condition"} for every valid item
+    """
+    match = re.search(r"\[.*\]", text, re.S)
+    if not match:
+        return {}
+    try:
+        data = json.loads(match.group(0))
+    except ValueError:
+        return {}
+    valid = {}
+    for entry in data if isinstance(data, list) else []:
+        if not isinstance(entry, dict):
+            continue
+        item_id = entry.get("id")
+        pet_type = entry.get("pet_type")
+        condition = entry.get("condition")
+        if str(item_id) not in expected_ids or pet_type not in PET_TYPES:
+            continue
+        if not isinstance(condition, str) or not condition.strip():
+            continue
+        valid[str(item_id)] = {"pet_type": pet_type, "condition": condition.strip()}
+    return valid
+
+
+class BatchEnricher:
+    """
+    Args:
+        backend (CortexBackend): Where the COMPLETE calls go
+        batch_size (int): Chunks per COMPLETE call
+        max_workers (int): Batches in flight at once
+        max_retries (int): Extra attempts for items that came back invalid
+        model (str): COMPLETE model
+    """
+
+    def __init__(self, backend, batch_size=20, max_workers=4, max_retries=2, model=DEFAULT_MODEL):
+        self.backend = backend
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.model = model
+
+    def _run_batch(self, items):
+        expected = {str(item_id) for item_id, _, _ in items}
+        try:
+            response = self.backend.complete(self.model, build_batch_prompt(items))
+        except Exception as e:
+            logger.warning("Enrichment batch of %d failed: %s", len(items), e)
+            return {}
+        return parse_batch_response(response, expected)
+
+    def enrich(self, items):
+        """
+        Args:
+            items: list of (item_id, heading, chunk); ids must be unique
+
+        Returns:
+            tuple: (results dict id -> {"pet_type", "condition"}, list of ids that never validated)
+        """
+        by_id = {str(item[0]): item for item in items}
+        pending = list(by_id)
+        results = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for attempt in range(self.max_retries + 1):
+                if not pending:
+                    break
+                batches = [[by_id[i] for i in pending[start:start + self.batch_size]]
+                           for start in range(0, len(pending), self.batch_size)]
+                for batch_results in executor.map(self._run_batch, batches):
+                    results.update(batch_results)
+                pending = [i for i in pending if i not in results]
+                if pending:
+                    logger.info("Attempt %d: %d item(s) to retry", attempt + 1, len(pending))
+        return results, pending
+
+
+def enrich_pending_chunks(backend, enricher):
+    """
+    Fill PET_TYPE and CONDITION for chunks that have no CONDITION yet, then
+    mark CHUNKED files DONE if all of their chunks were enriched.
+    """
+    rows = backend.sql(
+        """SELECT TO_VARCHAR(HASH(relative_path, chunk)) AS chunk_id,
+                  COALESCE(main_heading, '') || ' / ' || COALESCE(sub_heading, '') AS heading,
+                  chunk
+           FROM docs_chunks_table WHERE condition IS NULL"""
+    )
+    items = [(row['CHUNK_ID'], row['HEADING'], row['CHUNK']) for row in rows]
+    results, failed = enricher.enrich(items)
+
+    # No session-scoped staging table: consecutive backend.sql calls may borrow different sessions
+    values = list(results.items())
+    for start in range(0, len(values), MERGE_PAGE_SIZE):
+        page = values[start:start + MERGE_PAGE_SIZE]
+        backend.sql(
+            MERGE_ENRICHMENT_SQL.format(rows=", ".join(["(?, ?, ?)"] * len(page))),
+            [value for chunk_id, result in page for value in (chunk_id, result["pet_type"], result["condition"])]
+        )
+    backend.sql(
+        """UPDATE docs_ingest_state SET status = 'DONE', updated_at = CURRENT_TIMESTAMP()
+           WHERE status = 'CHUNKED' AND relative_path NOT IN (
+               SELECT relative_path FROM docs_chunks_table WHERE condition IS NULL)"""
+    )
+    return len(results), failed
+
+
+def main():
+    from cortex_backend import SnowparkBackend
+    from session_pool import connection_params_from_env
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--retries", type=int, default=2)
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    backend = SnowparkBackend.from_connection_params(connection_params_from_env(), pool_size=args.workers)
+    enricher = BatchEnricher(backend, args.batch_size, args.workers, args.retries, args.model)
+    enriched, failed = enrich_pending_chunks(backend, enricher)
+    print(json.dumps({"enriched": enriched, "failed": len(failed), **backend.stats.snapshot()}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,470 @@
+"""
+Multi-user load test for streamlit_bot.py.
+
+Every simulated user is its own Streamlit AppTest, so it has its own session
+state, while all of them share this process's st.cache_resource singletons
+(backend, caches, answer worker), as the sessions of one server process do.
+Snowflake is replaced through FURWELL_BACKEND by a stateful LocalBackend
+whose SQL, COMPLETE and search latencies are drawn from lognormal
+distributions.
+
+Each user logs in, then for every round switches pets, asks a question and
+waits for the answer, and records a daily check-in. Reported:
+
+- reruns/sec: script runs the app served across all users
+- latency percentiles per interaction (what a user waits for a click)
+- statements per interaction, from one user running alone first, so the
+  counts are not blurred by the other users' background work
+- peak RSS of the process
+
+    python load_test.py --users 10 --rounds 3
+    python load_test.py --users 10 --save-baseline load_baseline.json
+    python load_test.py --users 10 --baseline load_baseline.json    # exit 1 on regression
+"""
+import argparse
+import contextlib
+import itertools
+import json
+import logging
+import math
+import os
+import random
+import resource
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from unittest.mock import MagicMock
+
+import auth
+from benchmark import CONDITIONS, QUESTIONS, make_chunks
+from cortex_backend import LocalBackend, register_backend
+from rag_pipeline import SEARCH_SERVICE_COLUMNS
+from tracing import percentile
+
+APP_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "streamlit_bot.py")
+BACKEND_NAME = "load-test"
+PASSWORD = "load-test-password"
+BREEDS = [("Beagle", "Small Dog"), ("Maine Coon", "Large Cat")]
+# share_app_test_globals patches private Streamlit internals; re-check them before moving this pin
+STREAMLIT_VERSION = "1.41.1"
+
+
+def lognormal(median, sigma):
+    """
+    Latency sampler for LocalBackend: lognormal around median seconds; sigma
+    is the spread of log(latency), 0 for a fixed delay.
+    """
+    if median <= 0:
+        return 0.0
+    return lambda: median * math.exp(random.gauss(0.0, sigma))
+
+
+class FakeSnowflake:
+    """
+    The tables the app flows touch, kept in memory and served through
+    LocalBackend SQL handlers. Users are user0..user{n-1}, each with two pets.
+    """
+
+    def __init__(self, n_users, n_history=30, auth_iterations=1000):
+        self.users = {}
+        self.pets = {}
+        self.clinical = {}
+        self.checkins = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        password = auth.hash_password(PASSWORD, auth_iterations)
+        start = date.today() - timedelta(days=n_history)
+        for user in range(n_users):
+            self.users[f"user{user}"] = {"ID": user + 1, "PASSWORD": password}
+            for n, (breed, pet_type) in enumerate(BREEDS):
+                pet = user * len(BREEDS) + n + 1
+                self.pets[pet] = {"ID": pet, "USER_ID": user + 1, "NAME": f"Pet{pet}", "BREED": breed,
+                                  "TYPE": pet_type, "GENDER": "Female", "AGE": 3}
+                self.clinical[pet] = [{"ID": next(self._ids), "DATE": start + timedelta(days=30 * i),
+                                       "NOTES": f"Routine visit {i}."} for i in range(n_history // 30 + 1)]
+                self.checkins[pet] = [{"ID": next(self._ids), "DATE": start + timedelta(days=i), "CONDITION": "Good",
+                                       "NOTES": f"Ate well on day {i}."} for i in range(n_history)]
+
+    @staticmethod
+    def _newest(rows, limit):
+        return sorted(rows, key=lambda row: (row["DATE"], row["ID"]), reverse=True)[:limit]
+
+    def _version(self, table, pet):
+        # Stand-in for HASH_AGG: changes with any insert, edit or delete
+        with self._lock:
+            return hash(tuple(tuple(sorted(row.items())) for row in table.get(pet, [])))
+
+    def _insert(self, table, row):
+        with self._lock:
+            table.setdefault(row.pop("PET_ID"), []).append({"ID": next(self._ids), **row})
+        return []
+
+    def install(self, backend):
+        handlers = [
+            (r"FROM users WHERE username = \?", lambda p: [self.users[p[0]]] if p[0] in self.users else []),
+            (r"FROM pets WHERE user_id = \?",
+             lambda p: [pet for pet in self.pets.values() if pet["USER_ID"] == p[0]]),
+            (r"FROM pets WHERE id = \?", lambda p: [self.pets[p[0]]] if p[0] in self.pets else []),
+            (r"AS clinical_version", lambda p: [{"CLINICAL_VERSION": self._version(self.clinical, p[0]),
+                                                "CHECKIN_VERSION": self._version(self.checkins, p[0])}]),
+            (r"FROM clinical_history WHERE pet_id = \?",
+             lambda p: self._newest(self.clinical.get(p[0], []), p[-1])),
+            (r"FROM daily_check_ins WHERE pet_id = \?",
+             lambda p: self._newest(self.checkins.get(p[0], []), p[-1])),
+            (r"INSERT INTO clinical_history",
+             lambda p: self._insert(self.clinical, {"PET_ID": p[0], "DATE": p[1], "NOTES": p[2]})),
+            (r"INSERT INTO daily_check_ins",
+             lambda p: self._insert(self.checkins, {"PET_ID": p[0], "DATE": p[1], "CONDITION": p[2],
+                                                    "NOTES": p[3]})),
+            (r"SELECT DISTINCT condition FROM docs_chunks_table",
+             lambda p: [{"CONDITION": condition} for condition in CONDITIONS]),
+        ]
+        for pattern, handler in handlers:
+            backend.add_sql_handler(pattern, handler)
+        # Unmatched statements (chat history, summary MERGEs) return no rows: every session starts a new chat
+        return backend
+
+
+def make_backend(args):
+    backend = LocalBackend(sql_latency=lognormal(args.sql_latency, args.sigma),
+                           complete_latency=lognormal(args.complete_latency, args.sigma),
+                           complete_latency_per_kb=args.complete_latency_per_kb,
+                           search_latency=lognormal(args.search_latency, args.sigma),
+                           token_latency=args.token_latency)
+    FakeSnowflake(args.users, args.history, args.auth_iterations).install(backend)
+    chunks = make_chunks(args.chunks)
+    for service, (on, attributes) in SEARCH_SERVICE_COLUMNS.items():
+        backend.add_search_service(service, chunks, on=on, attributes=attributes)
+    return backend
+
+
+class Recorder:
+    """
+    Thread-safe log of interactions: (kind, seconds, reruns, error).
+    """
+
+    def __init__(self):
+        self.samples = []
+        self._lock = threading.Lock()
+
+    def record(self, kind, seconds, reruns, error=None):
+        with self._lock:
+            self.samples.append((kind, seconds, reruns, error))
+
+    def reruns(self):
+        with self._lock:
+            return sum(sample[2] for sample in self.samples)
+
+    def summary(self):
+        with self._lock:
+            samples = list(self.samples)
+        kinds = {}
+        for kind, seconds, reruns, error in samples:
+            entry = kinds.setdefault(kind, {"durations": [], "reruns": 0, "errors": 0})
+            entry["durations"].append(seconds)
+            entry["reruns"] += reruns
+            entry["errors"] += error is not None
+        report = {}
+        for kind, entry in kinds.items():
+            durations = sorted(entry["durations"])
+            report[kind] = {
+                "count": len(durations), "errors": entry["errors"], "reruns": entry["reruns"],
+                **{f"p{q}_ms": round(percentile(durations, q) * 1000, 1) for q in (50, 95, 99)},
+                "max_ms": round(durations[-1] * 1000, 1),
+            }
+        return report
+
+
+def share_app_test_globals(secrets):
+    """
+    AppTest is written for one test at a time: every run installs a mock
+    Streamlit Runtime, st.secrets and the global.appTest option and removes
+    them when it finishes, which breaks any session that is still running.
+    Install them once for the whole process instead. Every run also compiles
+    the script into a fresh ScriptCache, and concurrent compiles of the same
+    AST can fail on Python 3.11; share one cache, as the server does.
+    """
+    import streamlit as st
+
+    if st.__version__ != STREAMLIT_VERSION:
+        raise RuntimeError(f"load_test.py patches Streamlit {STREAMLIT_VERSION} internals, found {st.__version__}; "
+                           "check share_app_test_globals against the new version and update STREAMLIT_VERSION")
+    from streamlit import config
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.runtime.secrets import Secrets
+    from streamlit.testing.v1 import app_test, local_script_runner
+
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime._instance = runtime
+    # AppTest's per-run install and teardown now land on a throwaway subclass
+    app_test.Runtime = type("PerRunRuntime", (Runtime,), {})
+    st.secrets = Secrets()
+    st.secrets._secrets = secrets
+    config.set_option("global.appTest", True)
+    app_test.patch_config_options = lambda options: contextlib.nullcontext()
+    script_cache = ScriptCache()
+    local_script_runner.ScriptCache = lambda: script_cache
+    # Reading session state from the harness threads is fine; silence the bare-mode warning
+    logging.getLogger("streamlit.runtime.scriptrunner_utils.script_run_context").setLevel(logging.ERROR)
+
+
+def app_secrets(args):
+    return {
+        "snowflake": {key: "load-test" for key in
+                      ("account", "user", "password", "role", "database", "schema", "warehouse")},
+        "auth": {"iterations": args.auth_iterations},
+        "worker": {"max_workers": args.workers},
+    }
+
+
+class SimulatedUser:
+    """
+    One browser session: an AppTest over streamlit_bot.py and the clicks a user makes.
+    """
+
+    def __init__(self, index, args, recorder, stats=None):
+        from streamlit.testing.v1 import AppTest
+
+        self.index = index
+        self.args = args
+        self.recorder = recorder
+        # Backend round trips per interaction, only for the solo calibration user
+        self.stats = stats
+        self.statements = {}
+        # Secrets come from share_app_test_globals, not per app
+        self.app = AppTest.from_file(APP_SCRIPT, default_timeout=args.timeout)
+        self.rng = random.Random(index)
+
+    def _widget(self, kind, label):
+        for widget in getattr(self.app, kind):
+            if widget.label == label:
+                return widget
+        raise LookupError(f"No {kind} labelled {label!r}")
+
+    def _run(self, widget=None):
+        (widget or self.app).run()
+        if self.app.exception:
+            raise RuntimeError(self.app.exception[0].message)
+        return 1
+
+    def interact(self, kind, action):
+        before = self.stats.snapshot() if self.stats else None
+        started = time.perf_counter()
+        try:
+            reruns = action()
+        except Exception as e:
+            self.recorder.record(kind, time.perf_counter() - started, 1, error=str(e))
+            raise
+        self.recorder.record(kind, time.perf_counter() - started, reruns)
+        if before is not None:
+            after = self.stats.snapshot()
+            totals = self.statements.setdefault(kind, {"count": 0, "sql": 0, "complete": 0, "search": 0})
+            totals["count"] += 1
+            for call in ("sql", "complete", "search"):
+                totals[call] += after[f"{call}_calls"] - before[f"{call}_calls"]
+
+    def open(self):
+        return self._run()
+
+    def login(self):
+        self.app.text_input[0].input(f"user{self.index}")
+        self.app.text_input[1].input(PASSWORD)
+        return self._run(self._widget("button", "Login").click())
+
+    def switch_pet(self):
+        selectbox = self._widget("selectbox", "Select a pet to manage:")
+        other = [option for option in selectbox.options if option != selectbox.value][0]
+        return self._run(selectbox.select(other))
+
+    def ask(self):
+        question = self.rng.choice(QUESTIONS)
+        return self._run(self.app.chat_input[0].set_value(question))
+
+    def wait_for_answer(self):
+        # Stands in for the pending_answer fragment's run_every polling
+        reruns = 0
+        deadline = time.monotonic() + self.args.timeout
+        while self.app.session_state["pending_answer"] is not None:
+            if time.monotonic() > deadline:
+                raise TimeoutError("Answer did not finish in time")
+            time.sleep(self.args.poll)
+            reruns += self._run()
+        return reruns
+
+    def navigate(self, view):
+        return self._run(self._widget("radio", "Choose what you want to do:").set_value(view))
+
+    def check_in(self):
+        self._widget("radio", "How is your pet's condition today?").set_value(self.rng.choice(["Good", "Fair"]))
+        self.app.text_area[0].input("Load test check-in")
+        return self._run(self._widget("button", "Save Check-In").click())
+
+    def think(self):
+        if self.args.think > 0:
+            time.sleep(self.rng.uniform(0, 2 * self.args.think))
+
+    def session(self):
+        self.interact("open", self.open)
+        self.interact("login", self.login)
+        for _ in range(self.args.rounds):
+            self.think()
+            self.interact("switch_pet", self.switch_pet)
+            self.think()
+            self.interact("ask", self.ask)
+            self.interact("answer", self.wait_for_answer)
+            self.think()
+            self.interact("navigate", lambda: self.navigate("Daily Check In"))
+            self.interact("check_in", self.check_in)
+            self.interact("navigate", lambda: self.navigate("Current Pet"))
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def run_load_test(args):
+    backend = make_backend(args)
+    register_backend(BACKEND_NAME, lambda: backend)
+    os.environ["FURWELL_BACKEND"] = BACKEND_NAME
+    share_app_test_globals(app_secrets(args))
+
+    # Solo pass: exact statement counts per interaction; also warms the process-wide caches
+    calibration = SimulatedUser(0, args, Recorder(), stats=backend.stats)
+    calibration.session()
+    time.sleep(args.poll)
+    statements = {kind: {call: round(n / totals["count"], 2) for call, n in totals.items() if call != "count"}
+                  for kind, totals in calibration.statements.items()}
+
+    recorder = Recorder()
+    users = [SimulatedUser(index, args, recorder) for index in range(args.users)]
+    errors = []
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.users, thread_name_prefix="load-user") as executor:
+        futures = []
+        for user in users:
+            futures.append(executor.submit(user.session))
+            time.sleep(args.ramp_up / max(args.users, 1))
+        for future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                errors.append(str(e))
+    wall = time.perf_counter() - started
+
+    return {
+        "users": args.users,
+        "rounds": args.rounds,
+        "wall_s": round(wall, 2),
+        "reruns": recorder.reruns(),
+        "reruns_per_s": round(recorder.reruns() / wall, 2),
+        "interactions": recorder.summary(),
+        "statements_per_interaction": statements,
+        "peak_rss_mb": peak_rss_mb(),
+        "failed_sessions": len(errors),
+        "errors": sorted(set(errors))[:5],
+        "config": {key: getattr(args, key) for key in
+                   ("sql_latency", "complete_latency", "complete_latency_per_kb", "search_latency",
+                    "token_latency", "sigma", "think", "workers", "chunks", "history")},
+    }
+
+
+def compare(report, baseline, tolerance):
+    """
+    Regressions of report against a saved baseline: p95 latency, reruns/sec
+    and peak RSS worse by more than tolerance (a fraction), and any extra
+    statements per interaction.
+
+    Returns:
+        list[str]: One line per regression
+    """
+    regressions = []
+    if report["config"] != baseline.get("config") or report["users"] != baseline.get("users"):
+        print("warning: baseline was recorded with different settings", file=sys.stderr)
+    for kind, stats in report["interactions"].items():
+        old = baseline["interactions"].get(kind)
+        if old and stats["p95_ms"] > old["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{kind}: p95 {old['p95_ms']} -> {stats['p95_ms']} ms")
+    for kind, calls in report["statements_per_interaction"].items():
+        old = baseline["statements_per_interaction"].get(kind, {})
+        for call, n in calls.items():
+            if n > old.get(call, n):
+                regressions.append(f"{kind}: {call} statements {old[call]} -> {n}")
+    if report["reruns_per_s"] < baseline["reruns_per_s"] * (1 - tolerance):
+        regressions.append(f"reruns/s {baseline['reruns_per_s']} -> {report['reruns_per_s']}")
+    if report["peak_rss_mb"] > baseline["peak_rss_mb"] * (1 + tolerance):
+        regressions.append(f"peak RSS {baseline['peak_rss_mb']} -> {report['peak_rss_mb']} MB")
+    return regressions
+
+
+def print_report(report):
+    print(f"{report['users']} users x {report['rounds']} rounds in {report['wall_s']}s: "
+          f"{report['reruns']} reruns, {report['reruns_per_s']} reruns/s, "
+          f"peak RSS {report['peak_rss_mb']} MB, {report['failed_sessions']} failed sessions")
+    print(f"{'interaction':<12} {'count':>6} {'p50_ms':>9} {'p95_ms':>9} {'max_ms':>9} {'sql':>6} {'cmpl':>5} "
+          f"{'srch':>5}")
+    for kind, stats in report["interactions"].items():
+        calls = report["statements_per_interaction"].get(kind, {})
+        print(f"{kind:<12} {stats['count']:>6} {stats['p50_ms']:>9} {stats['p95_ms']:>9} {stats['max_ms']:>9} "
+              f"{calls.get('sql', 0):>6} {calls.get('complete', 0):>5} {calls.get('search', 0):>5}")
+    for error in report["errors"]:
+        print(f"error: {error}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10, help="Concurrent simulated sessions")
+    parser.add_argument("--rounds", type=int, default=2, help="Question + check-in rounds per user")
+    parser.add_argument("--ramp-up", type=float, default=2.0, help="Seconds over which users start")
+    parser.add_argument("--think", type=float, default=0.5, help="Mean seconds a user pauses between actions")
+    parser.add_argument("--sql-latency", type=float, default=0.05, help="Median seconds per SQL statement")
+    parser.add_argument("--complete-latency", type=float, default=0.8, help="Median seconds per COMPLETE")
+    parser.add_argument("--complete-latency-per-kb", type=float, default=0.02)
+    parser.add_argument("--search-latency", type=float, default=0.3, help="Median seconds per search")
+    parser.add_argument("--token-latency", type=float, default=0.005, help="Seconds per generated word")
+    parser.add_argument("--sigma", type=float, default=0.5, help="Lognormal spread of every latency")
+    parser.add_argument("--workers", type=int, default=4, help="[worker] max_workers for the answer pool")
+    parser.add_argument("--chunks", type=int, default=120, help="Corpus size")
+    parser.add_argument("--history", type=int, default=90, help="Check-ins per pet")
+    parser.add_argument("--auth-iterations", type=int, default=1000,
+                        help="PBKDF2 iterations; the production default makes login CPU-bound")
+    parser.add_argument("--poll", type=float, default=0.5, help="Seconds between answer polls (run_every)")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Seconds a script run or answer may take")
+    parser.add_argument("--save-baseline", metavar="PATH", help="Write the report to PATH")
+    parser.add_argument("--baseline", metavar="PATH", help="Compare with a saved report; exit 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed relative slowdown against the baseline")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    report = run_load_test(args)
+    if args.json:
+        print(json.dumps(report, indent=2, default=str))
+    else:
+        print_report(report)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2, default=str)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"regression: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
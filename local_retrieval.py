@@ -0,0 +1,457 @@
+"""
+Embedded hybrid retrieval over a DOCS_CHUNKS_TABLE export, no Cortex Search needed.
+
+Each search service gets a HybridIndex: a BM25 inverted index plus a matrix
+of L2-normalized vectors from a pluggable embedder, scored together. The
+numeric arrays are saved as .npy files and opened memory-mapped, so loading
+an index is cheap and the OS page cache is shared between processes. The
+chunk rows are written once for all services (rows.jsonl plus an offsets
+array) and read through a RowStore that decodes a row only when a search
+returns it. Filters use the same @eq / @or / @and / @not semantics as
+Cortex Search (cortex_backend.matches_filter) and, like it, only the
+service's ATTRIBUTES columns; they are evaluated on per-column value codes
+(AttributeColumns), never on the rows.
+
+LocalRetrievalBackend answers search() from these indexes and passes SQL
+and COMPLETE through to another backend, so it drops in wherever a
+CortexBackend is used. Build the indexes with
+
+    python local_retrieval.py export --out retrieval_index
+
+and point `[retrieval] local_index` in secrets.toml at the directory.
+retrieval_benchmark.py measures queries/sec and recall against saved
+Cortex results.
+"""
+import argparse
+import json
+import math
+import mmap
+import os
+import re
+import zlib
+
+import numpy as np
+
+from cortex_backend import CortexBackend, filter_columns
+from rag_pipeline import SEARCH_SERVICE_COLUMNS
+
+# Service -> (column it searches, ATTRIBUTES a filter may use), as created in rag2.sql
+SERVICE_COLUMNS = SEARCH_SERVICE_COLUMNS
+EXPORT_COLUMNS = ["chunk", "relative_path", "file_url", "pet_type", "condition"]
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(str(text or "").lower())
+
+
+class HashingEmbedder:
+    """
+    Dependency-free embedder: unigrams and bigrams hashed into `dim` signed
+    buckets with sublinear term frequency. Deterministic across processes.
+
+    Any object with `name`, `dim` and embed(texts) -> float32 array of shape
+    (len(texts), dim) with unit-length rows can be used instead, e.g. a
+    wrapper around a local sentence-transformers model.
+    """
+
+    name = "hashing"
+
+    def __init__(self, dim=256):
+        self.dim = dim
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            tokens = tokenize(text)
+            counts = {}
+            for feature in tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]:
+                counts[feature] = counts.get(feature, 0) + 1
+            for feature, count in counts.items():
+                h = zlib.crc32(feature.encode("utf-8"))
+                sign = 1.0 if h & 0x80000000 else -1.0
+                vectors[row, h % self.dim] += sign * (1.0 + math.log(count))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+
+EMBEDDERS = {"hashing": HashingEmbedder}
+
+ROWS_FILE = "rows.jsonl"
+ROW_OFFSETS_FILE = "row_offsets.npy"
+ATTRIBUTE_PREFIX = "attribute_"
+
+
+def write_rows(rows, root, attributes=()):
+    """
+    Save rows once under root for every service index to share: one JSON
+    document per line, and the byte offset of each line in row_offsets.npy.
+    The `attributes` columns are also saved as AttributeColumns.
+    """
+    os.makedirs(root, exist_ok=True)
+    rows = list(rows)
+    AttributeColumns.build(rows, attributes).save(root)
+    offsets = [0]
+    with open(os.path.join(root, ROWS_FILE), "wb") as f:
+        for row in rows:
+            line = json.dumps(row, default=str).encode("utf-8") + b"\n"
+            f.write(line)
+            offsets.append(offsets[-1] + len(line))
+    np.save(os.path.join(root, ROW_OFFSETS_FILE), np.array(offsets, dtype=np.int64))
+
+
+class RowStore:
+    """
+    Read-only sequence over the rows from write_rows(). rows.jsonl is
+    memory-mapped on first access and a row is decoded only when indexed,
+    so search() pays for the few rows it returns, not the whole corpus.
+    """
+
+    def __init__(self, root):
+        self.path = os.path.join(root, ROWS_FILE)
+        self.offsets = np.load(os.path.join(root, ROW_OFFSETS_FILE), mmap_mode="r")
+        self._data = None
+
+    def _map(self):
+        if self._data is None:
+            with open(self.path, "rb") as f:
+                self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._data
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return json.loads(self._map()[int(self.offsets[i]):int(self.offsets[i + 1])])
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+def _attribute_key(value):
+    # Rows round-trip through JSON with default=str, so compare non-scalar values as strings
+    return value if value is None or isinstance(value, (str, int, float, bool)) else str(value)
+
+
+class AttributeColumns:
+    """
+    Filterable columns kept apart from the rows: for each column, its
+    distinct values and one int32 code per row. Filters compare codes, so a
+    filtered search never decodes a row. Loaded codes are memory-mapped, and
+    a column's values are read the first time a filter uses it.
+
+    Args:
+        codes (dict): Column -> int32 array, one code per row
+        values (dict): Column -> {value: code}; columns missing here are read from root
+        root (str): Directory of a saved instance
+    """
+
+    def __init__(self, codes, values=None, root=None):
+        self.codes = codes
+        self._values = dict(values or {})
+        self.root = root
+
+    @classmethod
+    def build(cls, rows, columns):
+        codes, values = {}, {}
+        for column in columns:
+            lookup = {}
+            codes[column] = np.fromiter(
+                (lookup.setdefault(_attribute_key(row.get(column)), len(lookup)) for row in rows),
+                dtype=np.int32, count=len(rows))
+            values[column] = lookup
+        return cls(codes, values)
+
+    def save(self, root):
+        os.makedirs(root, exist_ok=True)
+        for column, codes in self.codes.items():
+            np.save(os.path.join(root, f"{ATTRIBUTE_PREFIX}{column}.npy"), np.asarray(codes, dtype=np.int32))
+            with open(os.path.join(root, f"{ATTRIBUTE_PREFIX}{column}.json"), "w") as f:
+                json.dump(sorted(self._lookup(column), key=self._lookup(column).get), f, default=str)
+
+    @classmethod
+    def load(cls, root):
+        codes = {
+            name[len(ATTRIBUTE_PREFIX):-len(".npy")]: np.load(os.path.join(root, name), mmap_mode="r")
+            for name in os.listdir(root) if name.startswith(ATTRIBUTE_PREFIX) and name.endswith(".npy")
+        }
+        return cls(codes, root=root)
+
+    def _lookup(self, column):
+        lookup = self._values.get(column)
+        if lookup is None:
+            with open(os.path.join(self.root, f"{ATTRIBUTE_PREFIX}{column}.json")) as f:
+                lookup = {_attribute_key(value): code for code, value in enumerate(json.load(f))}
+            self._values[column] = lookup
+        return lookup
+
+    def mask(self, filter_condition, n):
+        """
+        Boolean mask over n rows for a Cortex Search filter on these columns.
+        """
+        mask = np.ones(n, dtype=bool)
+        for op, arg in filter_condition.items():
+            if op == "@eq":
+                for column, value in arg.items():
+                    code = self._lookup(column).get(_attribute_key(value))
+                    if code is None:
+                        mask[:] = False
+                    else:
+                        mask &= np.asarray(self.codes[column]) == code
+            elif op == "@or":
+                either = np.zeros(n, dtype=bool)
+                for sub in arg:
+                    either |= self.mask(sub, n)
+                mask &= either
+            elif op == "@and":
+                for sub in arg:
+                    mask &= self.mask(sub, n)
+            elif op == "@not":
+                mask &= ~self.mask(arg, n)
+            else:
+                raise ValueError(f"Unsupported filter operator: {op}")
+        return mask
+
+
+class HybridIndex:
+    """
+    Args:
+        rows (Sequence[dict]): Documents, a list or a RowStore; the columns
+            search() can return
+        on (str): Column whose text is indexed
+        embedder: See HashingEmbedder
+        attributes (tuple): Columns filters may use, like a service's ATTRIBUTES
+        attribute_columns (AttributeColumns): Codes of (at least) those columns
+        postings, vocab, doc_len, vectors: Index arrays, from build() or load()
+        alpha (float): Weight of the dense score; 1 - alpha goes to BM25
+    """
+
+    def __init__(self, rows, on, embedder, vocab, postings_doc, postings_tf, doc_len, vectors,
+                 attributes=(), attribute_columns=None, k1=1.2, b=0.75, alpha=0.5):
+        self.rows = rows
+        self.on = on
+        self.embedder = embedder
+        self.attributes = tuple(attributes)
+        self.attribute_columns = attribute_columns or AttributeColumns({})
+        self.vocab = vocab
+        self.postings_doc = postings_doc
+        self.postings_tf = postings_tf
+        self.doc_len = doc_len
+        self.vectors = vectors
+        self.k1 = k1
+        self.b = b
+        self.alpha = alpha
+        self.avgdl = float(doc_len.mean()) if len(doc_len) else 0.0
+        self._masks = {}
+
+    @classmethod
+    def build(cls, rows, on, attributes=(), embedder=None, **kwargs):
+        embedder = embedder or HashingEmbedder()
+        rows = list(rows)
+        postings = {}
+        doc_len = np.zeros(len(rows), dtype=np.float32)
+        for doc, row in enumerate(rows):
+            tokens = tokenize(row.get(on))
+            doc_len[doc] = len(tokens)
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, count in counts.items():
+                postings.setdefault(token, []).append((doc, count))
+
+        # One flat array per field; vocab maps term -> (start, count) into them
+        vocab = {}
+        docs, tfs = [], []
+        for term in sorted(postings):
+            vocab[term] = (len(docs), len(postings[term]))
+            for doc, count in postings[term]:
+                docs.append(doc)
+                tfs.append(count)
+        vectors = embedder.embed([str(row.get(on) or "") for row in rows]) if rows \
+            else np.zeros((0, embedder.dim), dtype=np.float32)
+        return cls(rows, on, embedder, vocab, np.array(docs, dtype=np.int32),
+                   np.array(tfs, dtype=np.float32), doc_len, vectors, attributes=attributes,
+                   attribute_columns=AttributeColumns.build(rows, attributes), **kwargs)
+
+    def save(self, directory):
+        """
+        Save the index arrays; the rows and attribute columns are saved
+        separately, once for all services, with write_rows().
+        """
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, "postings_doc.npy"), self.postings_doc)
+        np.save(os.path.join(directory, "postings_tf.npy"), self.postings_tf)
+        np.save(os.path.join(directory, "doc_len.npy"), self.doc_len)
+        np.save(os.path.join(directory, "vectors.npy"), np.asarray(self.vectors, dtype=np.float32))
+        with open(os.path.join(directory, "vocab.json"), "w") as f:
+            json.dump(self.vocab, f)
+        meta = {"on": self.on, "attributes": list(self.attributes), "embedder": self.embedder.name,
+                "dim": self.embedder.dim, "k1": self.k1, "b": self.b, "alpha": self.alpha}
+        with open(os.path.join(directory, "meta.json"), "w") as f:
+            json.dump(meta, f, indent=2)
+
+    @classmethod
+    def load(cls, directory, rows, embedder=None, attribute_columns=None):
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+        embedder = embedder or EMBEDDERS[meta["embedder"]](meta["dim"])
+        if embedder.dim != meta["dim"]:
+            raise ValueError(f"Index {directory} was built with dim={meta['dim']}, embedder has {embedder.dim}")
+        with open(os.path.join(directory, "vocab.json")) as f:
+            vocab = {term: tuple(span) for term, span in json.load(f).items()}
+
+        def array(name):
+            return np.load(os.path.join(directory, name), mmap_mode="r")
+
+        return cls(rows, meta["on"], embedder, vocab, array("postings_doc.npy"), array("postings_tf.npy"),
+                   array("doc_len.npy"), array("vectors.npy"), attributes=meta.get("attributes", ()),
+                   attribute_columns=attribute_columns, k1=meta["k1"], b=meta["b"], alpha=meta["alpha"])
+
+    def __len__(self):
+        return len(self.rows)
+
+    def bm25(self, query):
+        n = len(self.rows)
+        scores = np.zeros(n, dtype=np.float32)
+        for term in set(tokenize(query)):
+            span = self.vocab.get(term)
+            if span is None:
+                continue
+            start, count = span
+            docs = self.postings_doc[start:start + count]
+            tf = self.postings_tf[start:start + count]
+            idf = math.log(1.0 + (n - count + 0.5) / (count + 0.5))
+            norm = self.k1 * (1.0 - self.b + self.b * self.doc_len[docs] / (self.avgdl or 1.0))
+            scores[docs] += idf * tf * (self.k1 + 1.0) / (tf + norm)
+        return scores
+
+    def mask(self, filter):
+        """
+        Boolean row mask for a filter, from the attribute codes and cached:
+        the app only ever sends a handful of distinct pet_type filters.
+
+        Raises:
+            ValueError: The filter uses a column outside self.attributes
+        """
+        if not filter:
+            return None
+        unknown = filter_columns(filter) - set(self.attributes)
+        if unknown:
+            raise ValueError(f"Filter columns {sorted(unknown)} are not ATTRIBUTES of the index on {self.on}")
+        key = json.dumps(filter, sort_keys=True)
+        mask = self._masks.get(key)
+        if mask is None:
+            mask = self.attribute_columns.mask(filter, len(self.rows))
+            self._masks[key] = mask
+        return mask
+
+    def search(self, query, columns, filter=None, limit=5):
+        if not self.rows:
+            return []
+        lexical = self.bm25(query)
+        top = lexical.max()
+        if top > 0:
+            lexical /= top
+        dense = np.asarray(self.vectors @ self.embedder.embed([query])[0])
+        scores = self.alpha * dense + (1.0 - self.alpha) * lexical
+        mask = self.mask(filter)
+        if mask is not None:
+            scores = np.where(mask, scores, -np.inf)
+        k = min(limit, len(scores))
+        candidates = np.argpartition(-scores, k - 1)[:k]
+        ranked = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [{col: self.rows[i].get(col) for col in columns} for i in ranked if np.isfinite(scores[i])]
+
+
+def load_indexes(root, embedder=None):
+    """
+    Load every service index under root (one subdirectory per service),
+    all sharing one RowStore over root's rows and its AttributeColumns.
+    """
+    rows = RowStore(root)
+    attribute_columns = AttributeColumns.load(root)
+    return {
+        name: HybridIndex.load(os.path.join(root, name), rows, embedder, attribute_columns)
+        for name in sorted(os.listdir(root))
+        if os.path.exists(os.path.join(root, name, "meta.json"))
+    }
+
+
+def export_indexes(backend, root, embedder=None, service_columns=None):
+    """
+    Read DOCS_CHUNKS_TABLE through backend and build one index per service.
+    """
+    rows = backend.sql(f"SELECT {', '.join(EXPORT_COLUMNS)} FROM docs_chunks_table")
+    rows = [{col: row[i] for i, col in enumerate(EXPORT_COLUMNS)} for row in rows]
+    service_columns = service_columns or SERVICE_COLUMNS
+    write_rows(rows, root, sorted({col for _, attributes in service_columns.values() for col in attributes}))
+    indexes = {}
+    for service, (on, attributes) in service_columns.items():
+        indexes[service] = HybridIndex.build(rows, on, attributes, embedder)
+        indexes[service].save(os.path.join(root, service))
+    return indexes
+
+
+class LocalRetrievalBackend(CortexBackend):
+    """
+    search() from local HybridIndexes; sql() and COMPLETE go to `base`.
+    Services without a local index are still searched through `base`.
+
+    Shares base's BackendStats so round-trip accounting stays in one place.
+    """
+
+    def __init__(self, indexes, base):
+        super().__init__()
+        self.indexes = indexes
+        self.base = base
+        self.stats = base.stats
+
+    @classmethod
+    def from_directory(cls, root, base, embedder=None):
+        return cls(load_indexes(root, embedder), base)
+
+    @property
+    def pool(self):
+        return self.base.pool
+
+    def sql(self, query, params=None):
+        return self.base.sql(query, params)
+
+    def complete(self, model, prompt):
+        return self.base.complete(model, prompt)
+
+    def complete_stream(self, model, prompt):
+        return self.base.complete_stream(model, prompt)
+
+    def search(self, service, query, columns, filter=None, limit=5):
+        index = self.indexes.get(service)
+        if index is None:
+            return self.base.search(service, query, columns, filter=filter, limit=limit)
+        self.stats.record("search")
+        return {"results": index.search(query, columns, filter=filter, limit=limit)}
+
+
+def main():
+    from cortex_backend import SnowparkBackend
+    from session_pool import connection_params_from_env
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    export = sub.add_parser("export", help="Build indexes from DOCS_CHUNKS_TABLE")
+    export.add_argument("--out", default="retrieval_index")
+    export.add_argument("--dim", type=int, default=256)
+    args = parser.parse_args()
+
+    backend = SnowparkBackend.from_connection_params(connection_params_from_env(), pool_size=1)
+    indexes = export_indexes(backend, args.out, HashingEmbedder(args.dim))
+    print(json.dumps({name: len(index) for name, index in indexes.items()}))
+
+
+if __name__ == "__main__":
+    main()
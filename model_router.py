@@ -0,0 +1,205 @@
+"""
+Which COMPLETE model each pipeline stage uses, and what that costs.
+
+Every stage used to run on mistral-large2, including the query rewrite, the
+chat-history summaries and the five-way pet-type label, which a small model
+answers just as well in a fraction of the time. ModelRouter maps each stage
+to its own model: small and fast for rewriting and classification, large only
+for the answer.
+
+Models come from `[models]` in secrets.toml, and a session may override them
+(the debug sidebar). An experiment assigns each user, by a hash of their
+name, to one of several models for a group of stages, so quality and speed
+can be compared on real traffic. Each COMPLETE is accounted per stage and
+model, and per experiment variant: calls, estimated tokens and latency.
+"""
+import hashlib
+import threading
+from collections import deque
+
+from prompt_builder import estimate_tokens
+from tracing import percentile
+
+SMALL_MODEL = "llama3.1-8b"
+LARGE_MODEL = "mistral-large2"
+
+# Stage names as passed to RagPipeline.complete, plus "pet_type" for breed classification
+DEFAULT_MODELS = {
+    "summarize": SMALL_MODEL,
+    "rewrite": SMALL_MODEL,
+    "contextual_rewrite": SMALL_MODEL,
+    "history_summary": SMALL_MODEL,
+    "pet_type": SMALL_MODEL,
+    "answer": LARGE_MODEL,
+}
+
+# Offered in the sidebar; availability of each varies by Snowflake region
+MODEL_CHOICES = ("llama3.1-8b", "mistral-7b", "llama3.1-70b", "mixtral-8x7b", "snowflake-arctic",
+                 "mistral-large2")
+
+
+class Experiment:
+    """
+    An A/B test of models for a group of stages.
+
+    Args:
+        name (str): Experiment name; also salts the assignment hash
+        stages (list): Stages whose model the variant decides
+        variants (dict): Variant name -> model
+        weights (dict): Variant name -> relative share of users; equal by default
+    """
+
+    def __init__(self, name, stages, variants, weights=None):
+        if not variants:
+            raise ValueError(f"Experiment {name!r} has no variants")
+        self.name = name
+        self.stages = tuple(stages)
+        self.variants = dict(variants)
+        weights = weights or {}
+        self.weights = {variant: float(weights.get(variant, 1.0)) for variant in sorted(self.variants)}
+
+    @classmethod
+    def from_settings(cls, name, settings):
+        return cls(name, settings.get("stages", ()), settings.get("variants", {}), settings.get("weights"))
+
+    def assign(self, subject):
+        """
+        Variant of subject (a user name): the same every time and in every process.
+        """
+        digest = hashlib.sha256(f"{self.name}:{subject}".encode("utf-8")).digest()
+        point = int.from_bytes(digest[:8], "big") / 2 ** 64 * sum(self.weights.values())
+        for variant, weight in self.weights.items():
+            point -= weight
+            if point < 0:
+                return variant
+        return variant
+
+
+class ModelRoute:
+    """
+    Models one question (or one session) runs with. Built by ModelRouter.route.
+
+    Attributes:
+        models (dict): Stage -> model
+        variants (dict): Experiment name -> variant of the stages it decides
+    """
+
+    def __init__(self, router, models, variants):
+        self.router = router
+        self.models = models
+        self.variants = variants
+
+    def model(self, stage):
+        return self.models.get(stage, self.router.default)
+
+    def labels(self, stage):
+        """
+        Experiment -> variant for the experiments that decide stage's model.
+        """
+        return {name: variant for name, variant in self.variants.items()
+                if stage in self.router.experiments[name].stages}
+
+    def record(self, stage, prompt, response, seconds, cached=False):
+        self.router.record(stage, self.model(stage), prompt, response, seconds, cached, self.labels(stage))
+
+
+class ModelRouter:
+    """
+    Args:
+        models (dict): Stage -> model; stages not listed use DEFAULT_MODELS,
+            then default
+        default (str): Model of any other stage
+        experiments (list): Experiments; an experiment's variant wins over
+            models for its stages, and a session override wins over both
+        window (int): Latest latencies kept per stage and model
+    """
+
+    def __init__(self, models=None, default=LARGE_MODEL, experiments=None, window=500):
+        self.models = {**DEFAULT_MODELS, **(models or {})}
+        self.default = default
+        self.experiments = {experiment.name: experiment for experiment in experiments or ()}
+        self.window = window
+        self._lock = threading.Lock()
+        self._usage = {}
+
+    @classmethod
+    def from_settings(cls, settings):
+        """
+        Build from the [models] secrets section: stage = "model" entries, an
+        optional default, and [models.experiments.<name>] tables with stages,
+        variants and optional weights.
+        """
+        settings = dict(settings)
+        experiments = [Experiment.from_settings(name, options)
+                       for name, options in dict(settings.pop("experiments", {})).items()]
+        default = settings.pop("default", LARGE_MODEL)
+        return cls(settings, default=default, experiments=experiments)
+
+    def route(self, subject=None, overrides=None):
+        """
+        Args:
+            subject (str): Who is asking, for experiment assignment; None
+                leaves experiments out
+            overrides (dict): Stage -> model chosen for this session
+
+        Returns:
+            ModelRoute
+        """
+        models = dict(self.models)
+        variants = {}
+        if subject is not None:
+            for name, experiment in self.experiments.items():
+                variant = experiment.assign(subject)
+                variants[name] = variant
+                models.update(dict.fromkeys(experiment.stages, experiment.variants[variant]))
+        if overrides:
+            models.update(overrides)
+            # An overridden stage no longer measures its experiment
+            variants = {name: variant for name, variant in variants.items()
+                        if not set(self.experiments[name].stages) & set(overrides)}
+        return ModelRoute(self, models, variants)
+
+    def _entry(self, key):
+        entry = self._usage.get(key)
+        if entry is None:
+            entry = self._usage[key] = {"calls": 0, "cached": 0, "prompt_tokens": 0, "response_tokens": 0,
+                                        "latencies": deque(maxlen=self.window)}
+        return entry
+
+    def record(self, stage, model, prompt, response, seconds, cached=False, labels=None):
+        """
+        Account one COMPLETE. Tokens are estimated from the text (the
+        4-chars-per-token heuristic of prompt_builder); cache hits count as
+        calls but not towards latency.
+        """
+        prompt_tokens, response_tokens = estimate_tokens(prompt), estimate_tokens(response or "")
+        keys = [("model", stage, model)]
+        keys += [("experiment", f"{name}={variant}", model) for name, variant in (labels or {}).items()]
+        with self._lock:
+            for key in keys:
+                entry = self._entry(key)
+                entry["calls"] += 1
+                entry["prompt_tokens"] += prompt_tokens
+                entry["response_tokens"] += response_tokens
+                if cached:
+                    entry["cached"] += 1
+                else:
+                    entry["latencies"].append(seconds)
+
+    def stats(self):
+        """
+        Returns:
+            dict: "by_model" and "by_variant" rows of calls, tokens and
+            latency percentiles in ms
+        """
+        with self._lock:
+            usage = {key: dict(entry, latencies=sorted(entry["latencies"])) for key, entry in self._usage.items()}
+        stats = {"by_model": [], "by_variant": []}
+        for (kind, label, model), entry in sorted(usage.items()):
+            latencies = entry.pop("latencies")
+            row = {"stage" if kind == "model" else "variant": label, "model": model, **entry}
+            for q in (50, 95):
+                value = percentile(latencies, q)
+                row[f"p{q}_ms"] = round(value * 1000, 1) if value is not None else None
+            stats["by_model" if kind == "model" else "by_variant"].append(row)
+        return stats
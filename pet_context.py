@@ -0,0 +1,191 @@
+"""
+Process-wide store of each pet's clinical history and daily check-ins.
+
+A pet's records are loaded once and then served from memory to the prompt
+builder and to the history pages. Inserts made through the store are
+written through to Snowflake and applied in memory. Writes from other
+sessions are detected with a single HASH_AGG query per pet, a fingerprint
+of every row that changes with any insert, edit or delete, and only the
+table that changed is reloaded. Only the most recent records are kept; the
+prompt has room for a handful of them anyway, and pets not used recently are
+evicted once the store holds max_pets of them.
+
+The history pages do not go through the cache: history_page() reads one
+date-ordered page straight from Snowflake with keyset pagination, so a pet
+with years of daily check-ins costs one small query per page.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+# A row count misses edits and a delete paired with an insert; HASH_AGG covers every column
+VERSION_SQL = """SELECT
+    (SELECT HASH_AGG(id, date, notes) FROM clinical_history WHERE pet_id = ?) AS clinical_version,
+    (SELECT HASH_AGG(id, date, condition, notes) FROM daily_check_ins WHERE pet_id = ?) AS checkin_version"""
+
+# view -> (table, columns). The row ID (rag2.sql) breaks ties between records on the same date,
+# so the keyset cursor (date, id) is a total order.
+HISTORY_VIEWS = {
+    "clinical_history": ("clinical_history", "date, notes"),
+    "daily_checkins": ("daily_check_ins", "date, condition, notes"),
+}
+
+
+class PetHealthContext:
+    """
+    Attributes:
+        clinical_history (list): (date, notes) tuples
+        daily_checkins (list): (date, condition, notes) tuples
+        version (tuple): (clinical_version, checkin_version) last seen in
+            Snowflake; None for a table that has to be reloaded
+        checked_at (float): time.monotonic() of the last version check
+    """
+
+    def __init__(self):
+        self.clinical_history = []
+        self.daily_checkins = []
+        self.version = (None, None)
+        self.loaded = False
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+
+
+class PetContextStore:
+    """
+    Args:
+        backend (CortexBackend): Where the loads, version checks and inserts go
+        check_interval (float): Seconds a version check stays valid, so rapid
+            reruns and the parallel prompt stages share one check
+        recent_limit (int): Newest records of each kind kept in memory for the prompt
+        max_pets (int): Pets kept in memory; the least recently used is evicted
+    """
+
+    def __init__(self, backend, check_interval=2.0, recent_limit=50, max_pets=1000):
+        self.backend = backend
+        self.check_interval = check_interval
+        self.recent_limit = recent_limit
+        self.max_pets = max_pets
+        self._pets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _context(self, pet_id):
+        with self._lock:
+            context = self._pets.get(pet_id)
+            if context is None:
+                context = self._pets[pet_id] = PetHealthContext()
+                while len(self._pets) > self.max_pets:
+                    self._pets.popitem(last=False)
+            else:
+                self._pets.move_to_end(pet_id)
+            return context
+
+    def _load_clinical_history(self, pet_id):
+        result = self.backend.sql(
+            'SELECT date, notes FROM clinical_history WHERE pet_id = ? ORDER BY date DESC LIMIT ?',
+            (pet_id, self.recent_limit)
+        )
+        return [(row['DATE'], row['NOTES']) for row in result]
+
+    def _load_daily_checkins(self, pet_id):
+        result = self.backend.sql(
+            'SELECT date,condition,notes FROM daily_check_ins WHERE pet_id = ? ORDER BY date DESC LIMIT ?',
+            (pet_id, self.recent_limit)
+        )
+        return [(row['DATE'], row['CONDITION'], row['NOTES']) for row in result]
+
+    def _refresh(self, pet_id, context):
+        # Caller holds context.lock
+        if time.monotonic() - context.checked_at < self.check_interval:
+            return
+        row = self.backend.sql(VERSION_SQL, (pet_id, pet_id))[0]
+        clinical_version, checkin_version = row['CLINICAL_VERSION'], row['CHECKIN_VERSION']
+        if not context.loaded or clinical_version != context.version[0]:
+            context.clinical_history = self._load_clinical_history(pet_id)
+        if not context.loaded or checkin_version != context.version[1]:
+            context.daily_checkins = self._load_daily_checkins(pet_id)
+        context.version = (clinical_version, checkin_version)
+        context.loaded = True
+        context.checked_at = time.monotonic()
+
+    def get_clinical_history(self, pet_id):
+        context = self._context(pet_id)
+        with context.lock:
+            self._refresh(pet_id, context)
+            return list(context.clinical_history)
+
+    def get_daily_checkins(self, pet_id):
+        context = self._context(pet_id)
+        with context.lock:
+            self._refresh(pet_id, context)
+            return list(context.daily_checkins)
+
+    def add_clinical_record(self, pet_id, visit_date, notes):
+        context = self._context(pet_id)
+        with context.lock:
+            self.backend.sql(
+                "INSERT INTO clinical_history (id, pet_id, date, notes) SELECT health_record_id_seq.NEXTVAL, ?, ?, ?",
+                (pet_id, visit_date, notes)
+            )
+            if context.loaded:
+                # Served from memory until the next check, which reloads: the new version is only known server-side
+                context.clinical_history = self._newest(context.clinical_history + [(visit_date, notes)])
+                context.version = (None, context.version[1])
+
+    def add_daily_checkin(self, pet_id, check_date, condition, notes):
+        context = self._context(pet_id)
+        with context.lock:
+            self.backend.sql(
+                "INSERT INTO daily_check_ins (id, pet_id, date, condition, notes) "
+                "SELECT health_record_id_seq.NEXTVAL, ?, ?, ?, ?",
+                (pet_id, check_date, condition, notes)
+            )
+            if context.loaded:
+                context.daily_checkins = self._newest(context.daily_checkins + [(check_date, condition, notes)])
+                context.version = (context.version[0], None)
+
+    def _newest(self, records):
+        if len(records) <= self.recent_limit:
+            return records
+        return sorted(records, key=lambda r: str(r[0]), reverse=True)[:self.recent_limit]
+
+    def history_page(self, view, pet_id, start=None, end=None, cursor=None, page_size=25):
+        """
+        One page of a pet's records, newest first, read from Snowflake.
+
+        Args:
+            view (str): "clinical_history" or "daily_checkins"
+            start (date): Earliest date included, or None
+            end (date): Latest date included, or None
+            cursor (tuple): (date, id) of the last row of the previous page,
+                or None for the first page
+            page_size (int): Rows per page
+
+        Returns:
+            tuple: (rows, next_cursor); rows are dicts keyed by upper-case column
+            name, next_cursor is None on the last page
+        """
+        table, columns = HISTORY_VIEWS[view]
+        conditions = ["pet_id = ?"]
+        params = [pet_id]
+        if start is not None:
+            conditions.append("date >= ?")
+            params.append(start)
+        if end is not None:
+            conditions.append("date <= ?")
+            params.append(end)
+        if cursor is not None:
+            conditions.append("(date < ? OR (date = ? AND id < ?))")
+            params.extend([cursor[0], cursor[0], cursor[1]])
+        rows = self.backend.sql(
+            f"SELECT {columns}, id FROM {table} "
+            f"WHERE {' AND '.join(conditions)} ORDER BY date DESC, id DESC LIMIT ?",
+            params + [page_size + 1]
+        )
+        if len(rows) > page_size:
+            last = rows[page_size - 1]
+            return rows[:page_size], (last['DATE'], last['ID'])
+        return rows, None
+
+    def forget(self, pet_id):
+        with self._lock:
+            self._pets.pop(pet_id, None)
@@ -0,0 +1,141 @@
+"""
+Token-budgeted assembly of the answer prompt's sections.
+
+Instead of pasting Python reprs of every list into the prompt, each section
+is serialized compactly and cut to its own token budget, most relevant
+items first. Retrieved chunks overlap (text_chunker splits with
+chunk_overlap=256), so overlapping and duplicate chunks are merged before
+they are counted.
+"""
+import math
+
+from chat_store import SUMMARY_ROLE
+
+# Rough budgets in tokens; estimate_tokens() is a 4-chars-per-token heuristic
+DEFAULT_SECTION_BUDGETS = {
+    "chat_history": 600,
+    "clinical_history": 400,
+    "daily_checkins": 300,
+    "context": 1500,
+}
+MIN_OVERLAP_CHARS = 40
+
+
+def estimate_tokens(text):
+    return math.ceil(len(text) / 4)
+
+
+def _merge_pair(a, b, min_overlap=MIN_OVERLAP_CHARS):
+    """
+    Return a and b joined on their overlap if one continues the other, else None.
+    """
+    if b in a:
+        return a
+    if a in b:
+        return b
+    for first, second in ((a, b), (b, a)):
+        head = second[:min_overlap]
+        if len(head) < min_overlap:
+            continue
+        start = first.find(head)
+        while start != -1:
+            if second.startswith(first[start:]):
+                return first[:start] + second
+            start = first.find(head, start + 1)
+    return None
+
+
+def merge_chunks(chunks, min_overlap=MIN_OVERLAP_CHARS):
+    """
+    Drop duplicate chunks and stitch together chunks that overlap, keeping
+    the retrieval order of the first chunk in each merged group.
+    """
+    merged = []
+    for chunk in chunks:
+        chunk = chunk.strip()
+        if not chunk:
+            continue
+        for i, existing in enumerate(merged):
+            joined = _merge_pair(existing, chunk, min_overlap)
+            if joined is not None:
+                merged[i] = joined
+                break
+        else:
+            merged.append(chunk)
+    return merged
+
+
+def fit_lines(lines, budget):
+    """
+    Keep lines in order until the token budget is used; the line that crosses
+    the budget is cut short rather than dropped.
+    """
+    kept = []
+    used = 0
+    for line in lines:
+        cost = estimate_tokens(line) + 1
+        if used + cost > budget:
+            room = (budget - used - 1) * 4
+            if room > 20:
+                kept.append(line[:room].rstrip() + "…")
+            break
+        kept.append(line)
+        used += cost
+    return kept
+
+
+class PromptBuilder:
+    """
+    Args:
+        budgets (dict): Section name -> token budget; see DEFAULT_SECTION_BUDGETS
+    """
+
+    def __init__(self, budgets=None):
+        self.budgets = {**DEFAULT_SECTION_BUDGETS, **(budgets or {})}
+
+    def chat_history(self, messages):
+        """
+        The rolling summary (chat_store.py) is always kept; the verbatim
+        messages after it share what is left of the budget, newest first.
+        """
+        budget = self.budgets["chat_history"]
+        summary = [f"{m['role']}: {' '.join(str(m['content']).split())}" for m in messages
+                   if m['role'] == SUMMARY_ROLE]
+        summary = fit_lines(summary, budget)
+        budget -= sum(estimate_tokens(line) + 1 for line in summary)
+        # Most recent turns are the ones worth keeping; restore chronological order after cutting
+        lines = [f"{m['role']}: {' '.join(str(m['content']).split())}" for m in reversed(messages)
+                 if m['role'] != SUMMARY_ROLE]
+        return "\n".join(summary + list(reversed(fit_lines(lines, budget))))
+
+    def clinical_history(self, records):
+        records = sorted(records, key=lambda r: str(r[0]), reverse=True)
+        lines = [f"{day}: {' '.join(str(notes).split())}" for day, notes in records]
+        return "\n".join(fit_lines(lines, self.budgets["clinical_history"]))
+
+    def daily_checkins(self, records):
+        records = sorted(records, key=lambda r: str(r[0]), reverse=True)
+        lines = []
+        for day, condition, notes in records:
+            notes = ' '.join(str(notes or '').split())
+            lines.append(f"{day}: {condition}" + (f" - {notes}" if notes else ""))
+        return "\n".join(fit_lines(lines, self.budgets["daily_checkins"]))
+
+    def context(self, results):
+        chunks = merge_chunks(item['chunk'] for item in results if item.get('chunk'))
+        lines = [f"[{i}] {' '.join(chunk.split())}" for i, chunk in enumerate(chunks, 1)]
+        return "\n".join(fit_lines(lines, self.budgets["context"]))
+
+    def build(self, chat_history, clinical_history, daily_checkins, search_results):
+        """
+        Returns:
+            tuple: (sections dict of serialized text, report dict of tokens per section)
+        """
+        sections = {
+            "chat_history": self.chat_history(chat_history),
+            "clinical_history": self.clinical_history(clinical_history),
+            "daily_checkins": self.daily_checkins(daily_checkins),
+            "context": self.context(search_results),
+        }
+        report = {name: estimate_tokens(text) for name, text in sections.items()}
+        return sections, report
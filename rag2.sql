@@ -1,6 +1,12 @@
 -- Purpose: Create a Snowflake database and schema for the animal data project.
 USE animal_data;
 
+-- The chunker lives in text_chunker.py so it can be benchmarked locally
+-- (chunker_benchmark.py). Upload it before creating the function, e.g. with SnowSQL
+-- from the repository root:
+CREATE STAGE IF NOT EXISTS code;
+PUT file://text_chunker.py @code AUTO_COMPRESS = FALSE OVERWRITE = TRUE;
+
 CREATE OR REPLACE FUNCTION text_chunker(pdf_text STRING, file_type STRING)
 RETURNS TABLE (
     main_heading VARCHAR,
@@ -9,261 +15,8 @@ RETURNS TABLE (
 )
 LANGUAGE PYTHON
 RUNTIME_VERSION = '3.9'
-HANDLER = 'text_chunker'
-PACKAGES = ('langchain', 'pandas')
-AS
-$$
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-import pandas as pd
-
-class text_chunker:
-        """
-        A class for processing and chunking text documents with heading extraction.
-        
-        Attributes:
-            base_font_size (float): Reference font size for heading detection
-            base_font_color (tuple): Reference color for heading detection
-        """
-    def __init__(self):
-        self.base_font_size = 12.0  # Default font size
-        self.base_font_color = (0, 0, 0)  # Default black font color
-
-    def process(self, pdf_text: str, file_type: str):
-        """
-        Process the text document based on the file type.
-        
-        Parameters:
-            pdf_text (str): The raw text content from the document
-            file_type (str): Document type ('paragraph', 'table', or 'unknown')
-        
-        Returns:
-            Generator: A generator of tuples containing main_heading, sub_heading, and chunk
-        """
-        print(f"Processing file with type: {file_type}")
-        
-        file_type = file_type.lower().strip()
-        
-        if file_type == "paragraph":
-            return self.process_paragraph_file(pdf_text)
-        elif file_type == "table":
-            return self.process_table_file(pdf_text)
-        elif file_type == "unknown":
-            print("Unknown file type, defaulting to paragraph processing")
-            return self.process_paragraph_file(pdf_text)
-        else:
-            print(f"Unsupported file type: {file_type}")
-            return self.process_paragraph_file(pdf_text)
-
-    def process_paragraph_file(self, pdf_text: str):
-        """
-        Process documents with paragraph-based structure.
-        
-        Args:
-            pdf_text (str): Raw document text
-            
-        Returns:
-            Generator yielding (main_heading, sub_heading, chunk) tuples
-        """
-        headings, chunks = self.extract_headings_and_chunks(pdf_text)
-        data = []
-
-        current_main_heading = "No Main Heading"
-        current_sub_heading = "No Sub Heading"
-
-        for chunk in chunks:
-            for heading in headings:
-                if heading in chunk:
-                    if self.is_main_heading(heading):
-                        current_main_heading = heading
-                    elif self.is_sub_heading(heading):
-                        current_sub_heading = heading
-
-            data.append((current_main_heading, current_sub_heading, chunk))
-
-        df = pd.DataFrame(data, columns=['main_heading', 'sub_heading', 'chunk'])
-        yield from df.itertuples(index=False, name=None)
-
-    def extract_headings_and_chunks(self, pdf_text: str):
-        """
-        Extract headings and split text into manageable chunks.
-        
-        Args:
-            pdf_text (str): Raw document text
-            
-        Returns:
-            tuple: (list of headings, list of text chunks)
-        """
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1512, chunk_overlap=256, length_function=len)
-        chunks = text_splitter.split_text(pdf_text)
-
-        headings = []
-        for line in pdf_text.split("\n"):
-            if self.is_heading(line):
-                headings.append(line.strip())
-
-        return headings, chunks
-
-    def is_heading(self, line: str, font_size: float = None, is_bold: bool = False, font_color: str = None) -> bool:
-        """
-        Determine if a line is a heading based on font size, boldness, and color.
-        
-        Args:
-            line (str): The line of text to check
-            font_size (float): Font size of the line
-            is_bold (bool): Whether the line is bold
-            font_color (str): Color of the line
-            
-        Returns:
-            bool: True if the line is a heading, False otherwise
-        """
-        if font_size and font_size > self.base_font_size * 1.2:
-            return True
-        if is_bold:
-            return True
-        if font_color and font_color != self.base_font_color:
-            return True
-        return False
-
-
-    def is_main_heading(self, heading: str, font_size: float = None) -> bool:
-        """
-        Check if heading is a main/primary heading.
-        
-        Criteria:
-        - Font size > 50% larger than base
-        
-        Args:
-            heading (str): Heading text
-            font_size (float, optional): Heading font size
-            
-        Returns:
-            bool: True if heading is main heading
-        """
-        if font_size and font_size > self.base_font_size * 1.5:  # Font size larger by 50%
-            return True
-        return False
-
-    def is_sub_heading(self, heading: str, font_size: float = None) -> bool:
-        """
-        Check if heading is a sub/secondary heading.
-        
-        Criteria:
-        - Font size between 20% and 50% larger than base
-        
-        Args:
-            heading (str): Heading text
-            font_size (float, optional): Heading font size
-            
-        Returns:
-            bool: True if heading is sub heading
-        """
-        if font_size and self.base_font_size * 1.2 <= font_size <= self.base_font_size * 1.5:
-            return True
-        return False
-        
-    def extract_headings_and_chunks(self, pdf_text: str):
-        """
-        Extract headings and split text into manageable chunks.
-        
-        Args:
-            pdf_text (str): Raw document text
-            
-        Returns:
-            tuple: (list of headings, list of text chunks)
-        """
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1512, chunk_overlap=256, length_function=len)
-        chunks = text_splitter.split_text(pdf_text)
-
-        headings = []
-        for line in pdf_text.split("\n"):
-            if self.is_heading(line):
-                headings.append(line.strip())
-
-        return headings, chunks
-
-    def assign_pet_type(self, chunk: str) -> str:
-        """
-        Determine the pet type based on the text content.
-        
-        Args:
-            chunk (str): The text content to classify
-            
-        Returns:
-            str: The pet type ('Large Cat', 'Small Cat', 'Large Dog', 'Small Dog', or 'Undefined')
-        """
-        prompt = f"""
-        Given the following text, identify if it refers to a large cat, small cat, large dog, or small dog.
-        You must ONLY respond with one of these five options (exactly as written):
-        - 'Large Cat'
-        - 'Small Cat'
-        - 'Large Dog'
-        - 'Small Dog'
-        - 'Undefined'
-
-        Choose 'Undefined' if the text cannot be clearly classified into the other four categories.
-
-        Text:
-        {chunk}
-        """
-        pet_type = session.sql("SELECT SNOWFLAKE.CORTEX.COMPLETE(?, ?)", params=['mistral-large', prompt]).collect()[0][0]
-        
-        # Validate response and default to 'Undefined' if not in expected values
-        valid_types = {'Large Cat', 'Small Cat', 'Large Dog', 'Small Dog', 'Undefined'}
-        return pet_type if pet_type in valid_types else 'Undefined'
-
-    def summarize_condition(self, chunk: str, heading: str) -> str:
-        """
-        Summarize the main condition described in the text based on the provided heading.
-        
-        Args:
-            chunk (str): The text content to summarize
-            heading (str): The related heading to the text
-            
-        Returns:
-            str: The summarized condition
-        """
-        prompt = f"""
-        Based on the following text and its related heading, summarize the main condition described.
-
-        Heading: {heading}
-        Text: {chunk}
-        """
-
-        condition = session.sql("SELECT SNOWFLAKE.CORTEX.COMPLETE(?, ?)", params=['mistral-large', prompt]).collect()[0][0]
-
-        return condition
-
-    def process_table_file(self, pdf_text: str):
-        """
-        Process documents with table-based structure.
-        
-        Args:
-            pdf_text (str): Raw document text
-            
-        Returns:
-            Generator yielding (main_heading, sub_heading, chunk) tuples
-        """
-        rows = pdf_text.split('\n')
-        data = []
-        
-        current_main_heading = "Table Content"
-        current_sub_heading = "Table Row"
-        
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1512,
-            chunk_overlap=256,
-            length_function=len
-        )
-        
-        for row in rows:
-            if row.strip():
-                chunks = text_splitter.split_text(row)
-                for chunk in chunks:
-                    data.append((current_main_heading, current_sub_heading, chunk))
-        
-        df = pd.DataFrame(data, columns=['main_heading', 'sub_heading', 'chunk'])
-        yield from df.itertuples(index=False, name=None)
-$$;
+HANDLER = 'text_chunker.text_chunker'
+IMPORTS = ('@code/text_chunker.py');
 
 -- create stage
 CREATE OR REPLACE STAGE docs_processed
@@ -275,8 +28,8 @@ GRANT READ ON STAGE docs TO ROLE ACCOUNTADMIN;
 GRANT READ ON STAGE docs_processed TO ROLE ACCOUNTADMIN;
 GRANT WRITE ON STAGE docs_processed TO ROLE ACCOUNTADMIN;
 
--- create table
-CREATE OR REPLACE TABLE DOCS_CHUNKS_TABLE ( 
+-- create tables (IF NOT EXISTS: re-running this script must not drop ingested chunks)
+CREATE TABLE IF NOT EXISTS DOCS_CHUNKS_TABLE ( 
     RELATIVE_PATH VARCHAR(16777216),
     SIZE NUMBER(38,0),
     FILE_URL VARCHAR(16777216),
@@ -289,68 +42,196 @@ CREATE OR REPLACE TABLE DOCS_CHUNKS_TABLE (
     CATEGORY VARCHAR(16777216)
 );
 
--- create procedure
-INSERT INTO docs_chunks_table (
-    relative_path, 
-    size, 
-    file_url, 
-    scoped_file_url, 
-    main_heading, 
-    sub_heading, 
-    chunk, 
-    pet_type
-)
-WITH chunk_results AS (
+-- One row per file in @docs: the content hash it was ingested with and how far it got.
+-- STATUS: PENDING (new/changed, needs chunking) -> CHUNKED (needs summaries) -> DONE
+CREATE TABLE IF NOT EXISTS DOCS_INGEST_STATE (
+    RELATIVE_PATH VARCHAR(16777216),
+    CONTENT_HASH VARCHAR(64),
+    STATUS VARCHAR(16),
+    UPDATED_AT TIMESTAMP_LTZ
+);
+
+-- Chat history (chat_store.py): append-only messages, numbered per conversation by SEQ,
+-- and one rolling summary per conversation. Reads are always by (user_id, pet_id), newest
+-- first by (SEQ, ID). SEQ is counted by the session that writes the message, so two sessions
+-- open on the same conversation can write the same SEQ; ID, drawn from CHAT_MESSAGE_ID_SEQ,
+-- makes (SEQ, ID) unique for the pages' keyset cursor. Rows written before ID existed are
+-- numbered once here.
+CREATE SEQUENCE IF NOT EXISTS CHAT_MESSAGE_ID_SEQ;
+CREATE TABLE IF NOT EXISTS CHAT_MESSAGES (
+    ID NUMBER(38,0),
+    USER_ID NUMBER(38,0),
+    PET_ID NUMBER(38,0),
+    SEQ NUMBER(38,0),
+    ROLE VARCHAR(16),
+    CONTENT VARCHAR(16777216),
+    CREATED_AT TIMESTAMP_LTZ
+);
+ALTER TABLE CHAT_MESSAGES ADD COLUMN IF NOT EXISTS ID NUMBER(38,0);
+UPDATE CHAT_MESSAGES SET ID = CHAT_MESSAGE_ID_SEQ.NEXTVAL WHERE ID IS NULL;
+
+CREATE TABLE IF NOT EXISTS CHAT_SUMMARIES (
+    USER_ID NUMBER(38,0),
+    PET_ID NUMBER(38,0),
+    SUMMARY VARCHAR(16777216),
+    THROUGH_SEQ NUMBER(38,0),
+    UPDATED_AT TIMESTAMP_LTZ
+);
+
+-- Pet health records (created by the app setup). The history pages (PetContextStore.history_page)
+-- and the prompt context always read one pet's records newest first, filtered by date:
+--   WHERE pet_id = ? [AND date BETWEEN ...] ORDER BY date DESC, id DESC LIMIT n
+-- ID breaks ties in the pages' (date, id) keyset cursor: two records of the same day can be
+-- identical, so no combination of their other columns is unique. The app's INSERTs draw ids
+-- from HEALTH_RECORD_ID_SEQ; rows written before that are numbered once here.
+CREATE SEQUENCE IF NOT EXISTS HEALTH_RECORD_ID_SEQ;
+ALTER TABLE IF EXISTS CLINICAL_HISTORY ADD COLUMN IF NOT EXISTS ID NUMBER(38,0);
+ALTER TABLE IF EXISTS DAILY_CHECK_INS ADD COLUMN IF NOT EXISTS ID NUMBER(38,0);
+UPDATE CLINICAL_HISTORY SET ID = HEALTH_RECORD_ID_SEQ.NEXTVAL WHERE ID IS NULL;
+UPDATE DAILY_CHECK_INS SET ID = HEALTH_RECORD_ID_SEQ.NEXTVAL WHERE ID IS NULL;
+
+-- Recommended once the tables reach a few million rows (check SYSTEM$CLUSTERING_INFORMATION
+-- first): clustering on (PET_ID, DATE) lets those queries prune to the micro-partitions of one
+-- pet and date range instead of scanning every check-in. Below that, Snowflake's natural insert
+-- order is usually close enough and automatic reclustering only adds cost.
+-- ALTER TABLE CLINICAL_HISTORY CLUSTER BY (PET_ID, DATE);
+-- ALTER TABLE DAILY_CHECK_INS CLUSTER BY (PET_ID, DATE);
+
+-- Users (created by the app setup). auth.py stores PBKDF2 hashes of ~90 characters
+-- (pbkdf2_sha256$<iterations>$<salt>$<hash>) in PASSWORD, which was sized for plaintext.
+-- Snowflake can only widen a VARCHAR, so only columns narrower than 256 are altered and
+-- re-running the script leaves a wider one (e.g. the default VARCHAR(16777216)) alone.
+EXECUTE IMMEDIATE $$
+BEGIN
+    IF (EXISTS (SELECT 1 FROM INFORMATION_SCHEMA.COLUMNS
+                WHERE TABLE_SCHEMA = CURRENT_SCHEMA() AND TABLE_NAME = 'USERS'
+                  AND COLUMN_NAME = 'PASSWORD' AND CHARACTER_MAXIMUM_LENGTH < 256)) THEN
+        ALTER TABLE USERS ALTER COLUMN PASSWORD SET DATA TYPE VARCHAR(256);
+    END IF;
+END;
+$$;
+
+-- Incremental ingestion: only new or changed files are parsed, chunked, classified and
+-- summarized; chunks of files removed from the stage are deleted. Every step is keyed off
+-- DOCS_INGEST_STATE, so after a failure simply CALL ingest_docs() again.
+-- CALL ingest_docs(FALSE) skips the per-chunk CLASSIFY_TEXT/SUMMARIZE calls and leaves files
+-- CHUNKED with empty PET_TYPE/CONDITION; enrichment.py then fills them with batched COMPLETE
+-- calls (many chunks per request) and marks the files DONE.
+CREATE OR REPLACE PROCEDURE ingest_docs(sql_enrichment BOOLEAN DEFAULT TRUE)
+RETURNS VARCHAR
+LANGUAGE SQL
+AS
+$$
+DECLARE
+    pending INTEGER;
+BEGIN
+    ALTER STAGE docs REFRESH;
+
+    -- new files and files whose content changed go (back) to PENDING
+    MERGE INTO docs_ingest_state s
+    USING (SELECT relative_path, COALESCE(md5, etag) AS content_hash FROM directory(@docs)) d
+    ON s.relative_path = d.relative_path
+    WHEN MATCHED AND s.content_hash IS DISTINCT FROM d.content_hash THEN
+        UPDATE SET content_hash = d.content_hash, status = 'PENDING', updated_at = CURRENT_TIMESTAMP()
+    WHEN NOT MATCHED THEN
+        INSERT (relative_path, content_hash, status, updated_at)
+        VALUES (d.relative_path, d.content_hash, 'PENDING', CURRENT_TIMESTAMP());
+
+    -- files removed from the stage
+    DELETE FROM docs_chunks_table
+    WHERE relative_path NOT IN (SELECT relative_path FROM directory(@docs));
+    DELETE FROM docs_ingest_state
+    WHERE relative_path NOT IN (SELECT relative_path FROM directory(@docs));
+
+    SELECT COUNT(*) INTO :pending FROM docs_ingest_state WHERE status = 'PENDING';
+
+    -- replace the chunks of PENDING files atomically; a failure leaves them PENDING
+    BEGIN TRANSACTION;
+    DELETE FROM docs_chunks_table
+    WHERE relative_path IN (SELECT relative_path FROM docs_ingest_state WHERE status = 'PENDING');
+
+    INSERT INTO docs_chunks_table (
+        relative_path, 
+        size, 
+        file_url, 
+        scoped_file_url, 
+        main_heading, 
+        sub_heading, 
+        chunk, 
+        pet_type
+    )
+    WITH chunk_results AS (
+        SELECT 
+            d.relative_path, 
+            d.size, 
+            d.file_url, 
+            build_scoped_file_url(@docs, d.relative_path) AS scoped_file_url,
+            c.main_heading,
+            c.sub_heading,
+            c.chunk
+        FROM directory(@docs) d
+        JOIN docs_ingest_state s
+          ON s.relative_path = d.relative_path AND s.status = 'PENDING'
+        CROSS JOIN TABLE(text_chunker(
+            -- :content is the layout markdown itself; TO_VARCHAR of the whole result would be
+            -- JSON with escaped newlines, which defeats heading and paragraph detection
+            pdf_text => SNOWFLAKE.CORTEX.PARSE_DOCUMENT(@docs, d.relative_path, {'mode': 'LAYOUT'}):content::STRING,
+            file_type => CASE 
+                            WHEN LOWER(d.relative_path) LIKE '%cat_paragraphs%' THEN 'paragraph'
+                            WHEN LOWER(d.relative_path) LIKE '%handbook%' THEN 'table'
+                            ELSE 'paragraph'
+                         END
+        )) c
+    )
     SELECT 
-        d.relative_path, 
-        d.size, 
-        d.file_url, 
-        build_scoped_file_url(@docs, d.relative_path) AS scoped_file_url,
-        c.main_heading,
-        c.sub_heading,
-        c.chunk
-    FROM directory(@docs) d
-    CROSS JOIN TABLE(text_chunker(
-        pdf_text => TO_VARCHAR(SNOWFLAKE.CORTEX.PARSE_DOCUMENT(@docs, d.relative_path, {'mode': 'LAYOUT'})), 
-        file_type => CASE 
-                        WHEN LOWER(d.relative_path) LIKE '%cat_paragraphs%' THEN 'paragraph'
-                        WHEN LOWER(d.relative_path) LIKE '%handbook%' THEN 'table'
-                        ELSE 'paragraph'
-                     END
-    )) c
-)
-SELECT 
-    relative_path,
-    size,
-    file_url,
-    scoped_file_url,
-    main_heading,
-    sub_heading,
-    chunk,
-    CAST(
-        GET_PATH(
-            PARSE_JSON(
-                SNOWFLAKE.CORTEX.CLASSIFY_TEXT(
-                    COALESCE(chunk, ''),
-                    ARRAY_CONSTRUCT('Large Cat', 'Small Cat', 'Large Dog', 'Small Dog', 'Undefined')
-                )
-            ),
-            'label'
-        ) AS STRING
-    ) AS pet_type
-FROM chunk_results;
-
--- update condition summary
-UPDATE docs_chunks_table t
-SET condition = SNOWFLAKE.CORTEX.SUMMARIZE(CONCAT(
-    'Medical Condition Summary:\nHeading: ', 
-    COALESCE(t.MAIN_HEADING, ''),
-    '\nSubheading: ',
-    COALESCE(t.SUB_HEADING, ''),
-    '\nSymptoms and Conditions: ',
-    t.CHUNK
-))
-WHERE t.category IS NULL;
+        relative_path,
+        size,
+        file_url,
+        scoped_file_url,
+        main_heading,
+        sub_heading,
+        chunk,
+        CASE WHEN :sql_enrichment THEN CAST(
+            GET_PATH(
+                PARSE_JSON(
+                    SNOWFLAKE.CORTEX.CLASSIFY_TEXT(
+                        COALESCE(chunk, ''),
+                        ARRAY_CONSTRUCT('Large Cat', 'Small Cat', 'Large Dog', 'Small Dog', 'Undefined')
+                    )
+                ),
+                'label'
+            ) AS STRING
+        ) END AS pet_type
+    FROM chunk_results;
+
+    UPDATE docs_ingest_state SET status = 'CHUNKED', updated_at = CURRENT_TIMESTAMP()
+    WHERE status = 'PENDING';
+    COMMIT;
+
+    IF (NOT sql_enrichment) THEN
+        RETURN pending || ' file(s) chunked; run enrichment.py to classify and summarize';
+    END IF;
+
+    -- summarize only chunks that don't have a condition yet (new rows, or rows a failed run missed)
+    UPDATE docs_chunks_table t
+    SET condition = SNOWFLAKE.CORTEX.SUMMARIZE(CONCAT(
+        'Medical Condition Summary:\nHeading: ', 
+        COALESCE(t.MAIN_HEADING, ''),
+        '\nSubheading: ',
+        COALESCE(t.SUB_HEADING, ''),
+        '\nSymptoms and Conditions: ',
+        t.CHUNK
+    ))
+    WHERE t.condition IS NULL;
+
+    UPDATE docs_ingest_state SET status = 'DONE', updated_at = CURRENT_TIMESTAMP()
+    WHERE status = 'CHUNKED';
+
+    RETURN pending || ' file(s) ingested';
+END;
+$$;
+
+CALL ingest_docs();
 
 SELECT * FROM docs_chunks_table LIMIT 20;
 SELECT COUNT(*) AS total_chunks FROM docs_chunks_table;
@@ -359,10 +240,12 @@ SELECT COUNT(*) AS total_chunks FROM docs_chunks_table;
 USE SCHEMA ANIMAL_DATA.PUBLIC;
 ALTER TABLE docs_chunks_table SET CHANGE_TRACKING = TRUE;
 
--- create exact type search service
+-- create exact type search service: full-text/semantic search over the chunk text, filtered to the
+-- pet's exact type. Fused with condition_match_search (which searches the condition summaries), so it
+-- catches chunks whose condition label misses the question. Filters only work on ATTRIBUTES columns.
 CREATE OR REPLACE CORTEX SEARCH SERVICE exact_type_search
-ON pet_type
-ATTRIBUTES chunk, relative_path, file_url
+ON chunk
+ATTRIBUTES pet_type, relative_path, file_url
 WAREHOUSE = COMPUTE_WH
 TARGET_LAG = '1 day'
 AS (
@@ -0,0 +1,475 @@
+"""
+The FurWell RAG path, independent of Streamlit.
+
+Every round trip goes through a CortexBackend, so the same code runs against
+Snowflake in the app and against LocalBackend in benchmark.py.
+"""
+import contextlib
+import json
+import logging
+import re
+import time
+
+from call_policy import current_budget
+from prompt_builder import PromptBuilder
+from search_fanout import FanOutSearch
+from stage_scheduler import Stage, StageCancelled, StageScheduler
+from tracing import annotate, span, start_span
+
+logger = logging.getLogger(__name__)
+
+CORTEX_SEARCH_DATABASE = "ANIMAL_DATA"
+CORTEX_SEARCH_SCHEMA = "PUBLIC"
+CORTEX_SEARCH_SERVICE = "exact_type_search"
+CORTEX_SEARCH_SERVICE_CONDITION = "condition_match_search"
+
+# Queried together and fused; condition_match_search wins ties
+SEARCH_SERVICES = (CORTEX_SEARCH_SERVICE_CONDITION, CORTEX_SEARCH_SERVICE)
+SEARCH_DEADLINE = 3.0
+# Mirrors the CREATE CORTEX SEARCH SERVICE statements in rag2.sql: searched column and
+# the ATTRIBUTES a filter may use
+SEARCH_SERVICE_COLUMNS = {
+    CORTEX_SEARCH_SERVICE_CONDITION: ("condition", ("chunk", "relative_path", "file_url", "pet_type")),
+    CORTEX_SEARCH_SERVICE: ("chunk", ("pet_type", "relative_path", "file_url")),
+}
+# Values of the PET_TYPE column, as assigned by rag2.sql and the breed index
+PET_TYPES = ('Large Cat', 'Small Cat', 'Large Dog', 'Small Dog', 'Undefined')
+
+NUM_CHUNKS = 5
+COLUMNS = ["chunk", "relative_path", "pet_type"]
+
+# Budget stage (call_policy.STAGE_SHARES) of each COMPLETE stage; others use the whole budget
+COMPLETE_BUDGET_STAGES = {"summarize": "query", "rewrite": "query", "contextual_rewrite": "query",
+                          "answer": "answer"}
+
+# "fused" builds the search query from history and question in one COMPLETE;
+# "chain" is the original summarize_question_with_history -> rewrite_query path.
+REWRITE_MODES = ("fused", "chain")
+
+
+def log_error(message):
+    logger.error(message)
+
+
+def parse_rewrite(text, fallback):
+    """
+    Pull the query out of a contextual rewrite response.
+
+    Accepts the requested {"query": "..."} object, even when the model wraps it
+    in prose or code fences, and otherwise uses the raw text. Falls back to
+    `fallback` when nothing usable comes back.
+    """
+    match = re.search(r"\{.*\}", text, re.S)
+    if match:
+        try:
+            data = json.loads(match.group(0))
+        except ValueError:
+            data = None
+        if isinstance(data, dict) and isinstance(data.get("query"), str) and data["query"].strip():
+            return data["query"].strip().replace("'", "")
+        return fallback
+    text = text.strip().strip('"`').replace("'", "")
+    return text or fallback
+
+
+class RagPipeline:
+    """
+    Builds prompts and answers questions about one pet.
+
+    Attributes:
+        backend (CortexBackend): Where SQL, COMPLETE and search calls go
+        model_name (str): Model of every COMPLETE call when there is no model_route
+        on_error (callable): Receives user-facing error messages
+        scheduler (StageScheduler): Runs the independent create_prompt stages
+        stage_timeouts (dict): Stage name -> seconds; see create_prompt for names
+        rewrite_mode (str): One of REWRITE_MODES
+        completion_cache (CompletionCache): Optional cache for COMPLETE calls;
+            stages are "summarize", "rewrite", "contextual_rewrite" and "answer"
+        search_cache (SearchCache): Optional cache for Cortex Search results
+        context_store (PetContextStore): Optional in-memory source of clinical
+            history and check-ins
+        prompt_builder (PromptBuilder): Serializes and budgets the prompt sections
+        search (FanOutSearch): Queries the search services in parallel and fuses
+            their rankings; defaults to SEARCH_SERVICES under SEARCH_DEADLINE
+        rewrite_gate (RewriteGate): Optional local check that lets self-contained
+            questions skip the rewrite COMPLETE calls
+        cancelled (callable): Optional check, made between stages and before
+            every COMPLETE; when it returns True the question is abandoned
+            with StageCancelled
+        call_policy (CallPolicy): Optional latency budget per question, with
+            hedged and retried COMPLETE and search calls
+        model_route (ModelRoute): Optional model per COMPLETE stage
+            (model_router.py); every call is then accounted to its stage and model
+        last_prompt_report (dict): Estimated tokens per section of the last prompt
+    """
+
+    def __init__(self, backend, model_name="mistral-large2", on_error=log_error,
+                 scheduler=None, stage_timeouts=None, rewrite_mode="fused", completion_cache=None,
+                 search_cache=None, context_store=None, prompt_builder=None, search=None,
+                 rewrite_gate=None, cancelled=None, call_policy=None, model_route=None):
+        if rewrite_mode not in REWRITE_MODES:
+            raise ValueError(f"rewrite_mode must be one of {REWRITE_MODES}, got {rewrite_mode!r}")
+        self.backend = backend
+        self.model_name = model_name
+        self.on_error = on_error
+        self.scheduler = scheduler or StageScheduler()
+        self.stage_timeouts = stage_timeouts or {}
+        self.rewrite_mode = rewrite_mode
+        self.completion_cache = completion_cache
+        self.search_cache = search_cache
+        self.context_store = context_store
+        self.prompt_builder = prompt_builder or PromptBuilder()
+        self.search = search or FanOutSearch(SEARCH_SERVICES, SEARCH_DEADLINE)
+        self.rewrite_gate = rewrite_gate
+        self.cancelled = cancelled
+        self.call_policy = call_policy
+        self.model_route = model_route
+        self.last_prompt_report = {}
+
+    def check_cancelled(self, stage):
+        if self.cancelled is not None and self.cancelled():
+            raise StageCancelled(f"Cancelled before {stage}")
+
+    def question_budget(self):
+        # A new latency budget for one question, or None without a call policy
+        return self.call_policy.question() if self.call_policy is not None else None
+
+    @staticmethod
+    def budget_scope(budget):
+        # Calls made inside run under budget; a no-op without one
+        return budget.active() if budget is not None else contextlib.nullcontext()
+
+    def _call(self, name, fn, stage=None, discard=None):
+        if self.call_policy is None:
+            return fn()
+        return self.call_policy.call(name, fn, stage=stage, discard=discard)
+
+    def model_for(self, stage):
+        return self.model_route.model(stage) if self.model_route is not None else self.model_name
+
+    def _label(self, current, stage):
+        # Experiment variants go on the span, so exported traces can be compared by variant
+        labels = self.model_route.labels(stage) if self.model_route is not None else {}
+        if labels:
+            current.set(variants=labels)
+
+    def _account(self, stage, prompt, response, seconds, cached=False):
+        if self.model_route is not None:
+            self.model_route.record(stage, prompt, response, seconds, cached)
+
+    def complete(self, stage, prompt):
+        self.check_cancelled(stage)
+        model = self.model_for(stage)
+        with span(f"complete.{stage}", model=model, prompt_chars=len(prompt)) as current:
+            self._label(current, stage)
+            # Cache -> call policy -> backend: hits never enter the policy's latency windows
+            def fetch():
+                return self._call(f"complete.{stage}", lambda: self.backend.complete(model, prompt),
+                                  COMPLETE_BUDGET_STAGES.get(stage))
+
+            if self.completion_cache is None:
+                response = fetch()
+            else:
+                response = self.completion_cache.complete(self.backend, model, prompt, stage, fetch=fetch)
+            current.set(response_chars=len(response or ""))
+            self._account(stage, prompt, response, time.perf_counter() - current.start,
+                          cached=bool(current.attributes.get("cache_hit")))
+            return response
+
+    def get_pet_info(self, pet_id):
+        if pet_id is None:
+            return None
+        result = self.backend.sql(
+            """SELECT name, breed, type, gender, age
+               FROM pets WHERE id = ?""",
+            (pet_id,)
+        )
+        return result[0] if result else None
+
+    def search_chunks(self, query, type):
+        # 构建过滤条件
+        filter_condition = {
+          "@or": [
+              {"@eq": {"pet_type": type}}, {"@eq": {"pet_type": "Undefined"}}
+          ]
+        }
+        # Within a question budget, wait only for what the context stage has left
+        budget = current_budget()
+        deadline = budget.stage_remaining("context") if budget is not None else None
+        response = self.search.search(self.search_service, query, COLUMNS, filter=filter_condition, limit=NUM_CHUNKS,
+                                      deadline=deadline)
+        annotate(rows=len(response["results"]), services=response.get("services"))
+        return response
+
+    def search_service(self, service, query, columns, filter=None, limit=NUM_CHUNKS):
+        with span(f"search.{service}", query_chars=len(query)) as current:
+            def fetch():
+                return self._call(f"search.{service}",
+                                  lambda: self.backend.search(service, query, columns, limit=limit, filter=filter),
+                                  "context")
+
+            if self.search_cache is not None:
+                response = self.search_cache.search(self.backend, service, query, columns, limit=limit,
+                                                    filter=filter, fetch=fetch)
+            else:
+                response = fetch()
+            current.set(rows=len(response["results"]))
+            return response
+
+    def search_failed(self, e):
+        self.on_error(f"Error occurred while querying the service: {str(e)}")
+        return {"results": []}
+
+    def get_similar_chunks_search_service(self, query, type):
+        try:
+            return self.search_chunks(query, type)
+        except Exception as e:
+            return self.search_failed(e)
+
+    def summarize_question_with_history(self, chat_history, question):
+        # To get the right context, use the LLM to first summarize the previous conversation
+        # This will be used to get embeddings and find similar chunks in the docs for context
+        prompt = f"""
+            Based on the chat history below and the question, generate a query that extend the question
+            with the chat history provided. The query should be in natual language.
+            Answer with only the query. Do not add any explanation.
+
+            <chat_history>
+            {self.prompt_builder.chat_history(chat_history)}
+            </chat_history>
+            <question>
+            {question}
+            </question>
+            """
+        sumary = self.complete("summarize", prompt)
+        sumary = sumary.replace("'", "")
+
+        return sumary
+
+    def rewrite_query(self, question):
+        """
+        Use the LLM to rewrite the original query into a more contextually aligned and refined query.
+        """
+        prompt = f"""
+            Rewrite the following question to make it more formal, specific, and aligned to retrieve relevant information from a medical database for pets.
+            The rewritten query should focus on key terms and provide clarity for searching.
+            Answer with only the rewritten query. Do not add any explanation.
+
+            <question>
+            {question}
+            </question>
+        """
+        rewritten_query = self.complete("rewrite", prompt)
+
+        # Remove any extra characters like quotes that might break downstream tasks
+        rewritten_query = rewritten_query.replace("'", "")
+
+        return rewritten_query
+
+    def contextual_rewrite_query(self, chat_history, question):
+        """
+        Turn a follow-up question plus chat history into a standalone search
+        query in a single COMPLETE call.
+        """
+        prompt = f"""
+            Based on the chat history below, rewrite the question as a standalone query that can be understood without the chat history.
+            Make it formal, specific, and aligned to retrieve relevant information from a medical database for pets.
+            The query should focus on key terms and provide clarity for searching.
+            Respond with only a JSON object of the form {{"query": "<standalone query>"}}. Do not add any explanation.
+
+            <chat_history>
+            {self.prompt_builder.chat_history(chat_history)}
+            </chat_history>
+            <question>
+            {question}
+            </question>
+        """
+        return parse_rewrite(self.complete("contextual_rewrite", prompt), question)
+
+    def summarize_history(self, previous_summary, messages):
+        """
+        Fold messages into the running conversation summary (chat_store.py).
+        """
+        transcript = "\n".join(f"{m['role']}: {' '.join(str(m['content']).split())}" for m in messages)
+        prompt = f"""
+            Update the summary of a conversation between a pet owner and a pet care assistant.
+            Keep the pet's symptoms, conditions, advice already given and open questions; drop small talk.
+            Answer with only the updated summary in at most 120 words. Do not add any explanation.
+
+            <summary>
+            {previous_summary}
+            </summary>
+            <new_messages>
+            {transcript}
+            </new_messages>
+            """
+        return self.complete("history_summary", prompt).replace("'", "")
+
+    def get_clinical_history(self, pet_id):
+        if self.context_store is not None:
+            return self.context_store.get_clinical_history(pet_id)
+        result = self.backend.sql(
+            'SELECT date, notes FROM clinical_history WHERE pet_id = ?',
+            (pet_id,)
+        )
+        annotate(rows=len(result))
+        return [(row['DATE'], row['NOTES']) for row in result]
+
+    def get_daily_checkins(self, pet_id):
+        if self.context_store is not None:
+            return self.context_store.get_daily_checkins(pet_id)
+        result = self.backend.sql(
+            'SELECT date,condition,notes FROM daily_check_ins WHERE pet_id = ?',
+            (pet_id,)
+        )
+        annotate(rows=len(result))
+        return [(row['DATE'], row['CONDITION'], row['NOTES']) for row in result]
+
+    def search_query(self, myquestion, chat_history, rewrite_mode=None, gate=True):
+        if gate and self.rewrite_gate is not None:
+            decision = self.rewrite_gate.decide(myquestion, bool(chat_history))
+            annotate(rewrite=decision.rewrite, rewrite_reason=decision.reason)
+            if not decision.rewrite:
+                return myquestion
+        if chat_history == []:  # First question, nothing to resolve against
+            stages = ("rewrite",)
+        elif (rewrite_mode or self.rewrite_mode) == "fused":
+            stages = ("contextual_rewrite",)
+        else:
+            stages = ("summarize", "rewrite")
+        if self.call_policy is not None and not self.call_policy.fits([f"complete.{s}" for s in stages], "query"):
+            # Recent rewrites would not fit in what the question has left: search with the raw question
+            self.call_policy.degrade("rewrite")
+            return myquestion
+        if stages == ("rewrite",):
+            return self.rewrite_query(myquestion)
+        if stages == ("contextual_rewrite",):
+            return self.contextual_rewrite_query(chat_history, myquestion)
+        return self.rewrite_query(self.summarize_question_with_history(chat_history, myquestion))
+
+    def prompt_stages(self, myquestion, pet_id, chat_history, pet_info=None):
+        """
+        The stages behind create_prompt. Only the search waits, for the pet type
+        and the rewritten query; everything else runs side by side.
+
+        A history fetch that times out contributes nothing, a rewrite that times
+        out falls back to the raw question, and a failed search to no context.
+        A pet_info the caller already has is used instead of fetching it again.
+        """
+        timeouts = self.stage_timeouts
+        return [
+            Stage("pet_info", lambda: pet_info or self.get_pet_info(pet_id), timeout=timeouts.get("pet_info")),
+            Stage("clinical_history", lambda: self.get_clinical_history(pet_id),
+                  timeout=timeouts.get("clinical_history"), fallback=lambda e: []),
+            Stage("daily_checkins", lambda: self.get_daily_checkins(pet_id),
+                  timeout=timeouts.get("daily_checkins"), fallback=lambda e: []),
+            Stage("query", lambda: self.search_query(myquestion, chat_history),
+                  timeout=timeouts.get("query"), fallback=lambda e: myquestion),
+            Stage("context", lambda pet_info, query: self.search_chunks(query, pet_info['TYPE']),
+                  after=("pet_info", "query"), timeout=timeouts.get("context"), fallback=self.search_failed),
+        ]
+
+    def create_prompt(self, myquestion, pet_id, chat_history, pet_info=None):
+        with span("create_prompt") as current:
+            prompt, relative_paths = self._create_prompt(myquestion, pet_id, chat_history, pet_info)
+            current.set(prompt_chars=len(prompt), section_tokens=self.last_prompt_report)
+            return prompt, relative_paths
+
+    def _create_prompt(self, myquestion, pet_id, chat_history, pet_info=None):
+        results = self.scheduler.run(self.prompt_stages(myquestion, pet_id, chat_history, pet_info),
+                                     cancelled=self.cancelled)
+        prompt_context = results["context"]
+        sections, self.last_prompt_report = self.prompt_builder.build(
+            chat_history, results["clinical_history"], results["daily_checkins"], prompt_context['results']
+        )
+
+        prompt = f"""
+           You are an expert chat assistance to offer professional suggestions about pet daily care and disease related problems.
+           You need to extract information from the CONTEXT provided between <context> and </context> tags.
+           You offer a chat experience considering the information included in the CHAT HISTORY provided between <chat_history> and </chat_history> tags.
+           You need to take the information included in the CLINICAL HISTORY provided between <clinical_history> and </clinical_history> tags.
+           You need to take the information included in the DAILY CHECKINS provided between <daily_ckeckins> and </daily_checkins> tags.
+           When ansering the question contained between <question> and </question> tags be concise and do not hallucinate.
+           If you don't have the information, give a general idea and mention you are not sure.
+
+           Do not mention the CONTEXT used in your answer.
+           Do not mention the CHAT HISTORY used in your asnwer.
+
+           - Explain medical terms or complex issues in language that anyone without medical knowledge can understand.
+           - Provide ACTIONABLE ADVICE where applicable.
+           - Keep the response conversational and easy to understand.
+           - Be empathetic and reassuring when addressing concerns.
+
+           Only anwer the question if you can extract it from the CONTEXT provideed.
+
+           <chat_history>
+           {sections["chat_history"]}
+           </chat_history>
+           <clinical_history>
+           {sections["clinical_history"]}
+           </clinical_history>
+           <daily_checkins>
+           {sections["daily_checkins"]}
+           </daily_checkins>
+           <context>
+           {sections["context"]}
+           </context>
+           <question>
+           {myquestion}
+           </question>
+           Answer:
+           """
+
+        relative_paths = set(item['relative_path'] for item in prompt_context['results'])
+
+        return prompt, relative_paths
+
+    def answer_question(self, myquestion, pet_id, chat_history, pet_info=None):
+        with span("answer_question", pet_id=pet_id, question_chars=len(myquestion)), \
+                self.budget_scope(self.question_budget()):
+            prompt, relative_paths = self.create_prompt(myquestion, pet_id, chat_history, pet_info)
+            response = self.complete("answer", prompt)
+            return response, relative_paths
+
+    def answer_question_stream(self, myquestion, pet_id, chat_history, pet_info=None):
+        """
+        Like answer_question, but the answer is an iterator of text pieces.
+
+        The prompt is built before returning; the COMPLETE call only starts
+        when the iterator is first advanced. Under a call policy the wait for
+        the first piece is hedged and retried within the question budget; the
+        rest of the answer streams as it comes.
+        """
+        budget = self.question_budget()
+        with self.budget_scope(budget):
+            prompt, relative_paths = self.create_prompt(myquestion, pet_id, chat_history, pet_info)
+        self.check_cancelled("answer")
+        return self._traced_stream(prompt, budget), relative_paths
+
+    def _first_piece(self, prompt):
+        stream = self.backend.complete_stream(self.model_for("answer"), prompt)
+        for piece in stream:
+            return piece, stream
+        return "", stream
+
+    def _traced_stream(self, prompt, budget=None):
+        # Not a `with span(...)`: the generator is resumed from the caller's frames
+        current = start_span("complete.answer", model=self.model_for("answer"), prompt_chars=len(prompt), stream=True)
+        self._label(current, "answer")
+        pieces = []
+        try:
+            with self.budget_scope(budget):
+                # A hedge that loses has its stream closed
+                piece, stream = self._call("complete.answer.first_piece", lambda: self._first_piece(prompt),
+                                           "answer", discard=lambda result: result[1].close())
+            if piece:
+                current.set(ttft_ms=round((time.perf_counter() - current.start) * 1000, 3))
+                pieces.append(piece)
+                yield piece
+            for piece in stream:
+                pieces.append(piece)
+                yield piece
+            self._account("answer", prompt, "".join(pieces), time.perf_counter() - current.start)
+        finally:
+            current.set(response_chars=sum(map(len, pieces)))
+            current.end()
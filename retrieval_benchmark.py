@@ -0,0 +1,122 @@
+"""
+Throughput and recall of local_retrieval.py against Cortex Search.
+
+Record what the Cortex services return for a set of queries once:
+
+    python retrieval_benchmark.py record --out cortex_results.json
+
+then measure the local index against it, offline:
+
+    python retrieval_benchmark.py run --index retrieval_index --saved cortex_results.json
+
+Without --index, `run` builds an index over benchmark.py's synthetic corpus
+(--chunks rows) so throughput can be measured without any export.
+recall@k is the share of the chunks Cortex returned that the local index
+also returns in its top k.
+"""
+import argparse
+import json
+import statistics
+import tempfile
+import time
+
+from benchmark import CONDITIONS, PET_TYPES, QUESTIONS, make_chunks
+from local_retrieval import HybridIndex, SERVICE_COLUMNS, load_indexes, write_rows
+from rag_pipeline import COLUMNS, NUM_CHUNKS
+
+
+def default_queries():
+    """
+    (service, query, filter) triples shaped like the app's searches.
+    """
+    queries = []
+    for i, text in enumerate(QUESTIONS + CONDITIONS):
+        pet_type = PET_TYPES[i % 4]
+        filter = {"@or": [{"@eq": {"pet_type": pet_type}}, {"@eq": {"pet_type": "Undefined"}}]}
+        for service in SERVICE_COLUMNS:
+            queries.append((service, text, filter))
+    return queries
+
+
+def record(backend, queries, limit=NUM_CHUNKS):
+    saved = []
+    for service, query, filter in queries:
+        response = backend.search(service, query, COLUMNS, filter=filter, limit=limit)
+        saved.append({"service": service, "query": query, "filter": filter,
+                      "chunks": [row["chunk"] for row in response["results"]]})
+    return saved
+
+
+def synthetic_indexes(n_chunks, directory):
+    rows = make_chunks(n_chunks)
+    write_rows(rows, directory, sorted({col for _, attributes in SERVICE_COLUMNS.values() for col in attributes}))
+    for service, (on, attributes) in SERVICE_COLUMNS.items():
+        HybridIndex.build(rows, on, attributes).save(f"{directory}/{service}")
+    return load_indexes(directory)
+
+
+def run(indexes, queries, saved=None, repeat=20, limit=NUM_CHUNKS):
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for service, query, filter in queries:
+            t = time.perf_counter()
+            indexes[service].search(query, COLUMNS, filter=filter, limit=limit)
+            latencies.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    result = {
+        "rows": {name: len(index) for name, index in indexes.items()},
+        "queries": len(latencies),
+        "qps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 3),
+        "p95_ms": round(latencies[int(0.95 * (len(latencies) - 1))] * 1000, 3),
+    }
+    if saved:
+        recalls = []
+        for entry in saved:
+            expected = set(entry["chunks"])
+            if not expected or entry["service"] not in indexes:
+                continue
+            got = {row["chunk"] for row in indexes[entry["service"]].search(
+                entry["query"], COLUMNS, filter=entry["filter"], limit=limit)}
+            recalls.append(len(expected & got) / len(expected))
+        result[f"recall@{limit}"] = round(statistics.mean(recalls), 3) if recalls else None
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    rec = sub.add_parser("record", help="Save Cortex Search results for the benchmark queries")
+    rec.add_argument("--out", default="cortex_results.json")
+    bench = sub.add_parser("run", help="Measure the local index")
+    bench.add_argument("--index", help="Directory from `local_retrieval.py export`")
+    bench.add_argument("--saved", help="JSON from `record`; enables recall")
+    bench.add_argument("--chunks", type=int, default=5000, help="Synthetic corpus size without --index")
+    bench.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.command == "record":
+        from cortex_backend import SnowparkBackend
+        from session_pool import connection_params_from_env
+
+        backend = SnowparkBackend.from_connection_params(connection_params_from_env(), pool_size=1)
+        with open(args.out, "w") as f:
+            json.dump(record(backend, default_queries()), f, indent=2)
+        return
+
+    saved = None
+    if args.saved:
+        with open(args.saved) as f:
+            saved = json.load(f)
+    queries = [(e["service"], e["query"], e["filter"]) for e in saved] if saved else default_queries()
+    if args.index:
+        print(json.dumps(run(load_indexes(args.index), queries, saved, args.repeat), indent=2))
+        return
+    with tempfile.TemporaryDirectory() as directory:
+        print(json.dumps(run(synthetic_indexes(args.chunks, directory), queries, saved, args.repeat), indent=2))
+
+
+if __name__ == "__main__":
+    main()
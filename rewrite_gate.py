@@ -0,0 +1,197 @@
+"""
+Local decision whether a question needs the LLM query rewrite.
+
+rewrite_query (and, for follow-ups, the contextual rewrite) costs one or two
+COMPLETE round trips per question, even for questions that are already good
+search queries, like "What vaccines does a small dog need?". RewriteGate
+skips the rewrite when a question
+
+- does not lean on the chat history (no pronouns or anaphora to resolve),
+- has enough content words to be specific, and
+- names at least one term from the medical vocabulary of the indexed
+  documents (the CONDITION summaries in DOCS_CHUNKS_TABLE).
+
+Every decision is logged with its features, and optionally appended to a
+JSON lines file, so the retrieval quality of skipped rewrites can be
+audited (see `benchmark.py --audit-gate`).
+"""
+import json
+import logging
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+VOCABULARY_SQL = "SELECT DISTINCT condition FROM docs_chunks_table WHERE condition IS NOT NULL"
+
+# Words that only make sense with the previous turns
+ANAPHORA = {
+    "it", "its", "it's", "itself", "that", "this", "these", "those", "they", "them", "their", "theirs",
+    "he", "him", "his", "she", "her", "hers", "there", "then", "same", "also", "too", "again",
+    "such", "one", "ones", "else", "other", "former", "latter", "above", "mentioned",
+}
+ANAPHORA_PHRASES = ("what about", "how about", "and if", "what if", "and for", "the other", "as well")
+
+STOPWORDS = {
+    "a", "an", "the", "and", "or", "but", "if", "of", "to", "in", "on", "for", "with", "at", "by", "from",
+    "is", "are", "was", "were", "be", "been", "do", "does", "did", "can", "could", "should", "would",
+    "will", "may", "might", "must", "have", "has", "had", "what", "which", "who", "whom", "when",
+    "where", "why", "how", "i", "me", "my", "we", "our", "you", "your", "am", "not", "no", "so",
+    "very", "much", "many", "some", "any", "about", "need", "needs", "get", "got", "pet", "pets",
+    "dog", "dogs", "cat", "cats", "puppy", "kitten", "please", "tell", "know", "okay", "ok",
+} | ANAPHORA
+
+# Always treated as medical, so the gate works before the vocabulary is loaded
+SEED_TERMS = {
+    "vaccine", "vaccines", "vaccination", "vomiting", "diarrhea", "fever", "allergy", "allergies",
+    "infection", "parasite", "parasites", "flea", "fleas", "tick", "ticks", "worms", "dental",
+    "arthritis", "diabetes", "kidney", "liver", "seizure", "seizures", "cough", "coughing",
+    "itching", "itchy", "rash", "limping", "lethargy", "appetite", "weight", "obesity", "hydration",
+    "dehydration", "poisoning", "toxic", "medication", "dose", "dosage", "surgery", "neuter", "spay",
+    "symptom", "symptoms", "treatment", "disease", "injury", "wound", "bleeding", "ear", "eye",
+}
+
+# Everyday words that show up in condition summaries without naming anything medical
+COMMON_WORDS = {
+    "after", "before", "during", "while", "over", "under", "into", "than", "then", "when", "with",
+    "without", "more", "most", "less", "least", "very", "also", "only", "just", "well", "often",
+    "time", "times", "day", "days", "week", "weeks", "month", "months", "year", "years", "age", "old",
+    "older", "young", "new", "high", "low", "level", "levels", "change", "changes", "good", "normal",
+    "general", "common", "usual", "usually", "sign", "signs", "issue", "issues", "problem", "problems",
+    "condition", "conditions", "related", "cause", "causes", "caused", "care", "health", "healthy",
+    "owner", "owners", "home", "help", "helps", "make", "makes", "keep", "keeps", "give", "given",
+    "take", "takes", "show", "shows", "include", "includes", "including", "such", "like", "other",
+    "each", "every", "both", "either", "several", "large", "small", "long", "short", "information",
+    "advice", "guide", "overview", "section", "document", "page", "schedule", "activity", "exercise",
+    "excessive", "sudden", "gain", "loss",
+}
+# A word in more than this share of the conditions is too generic to mark a question as medical
+MAX_DOCUMENT_FREQUENCY = 0.2
+# Below this many conditions the share says nothing, and only COMMON_WORDS filters
+MIN_CONDITIONS_FOR_DF = 20
+
+WORD_RE = re.compile(r"[a-z][a-z'-]*")
+
+
+def words(text):
+    return WORD_RE.findall(str(text or "").lower())
+
+
+def stem(word):
+    # Crude plural folding so "vaccines" matches "vaccine" and "viruses" matches "virus".
+    # "es" is only a plural ending after a sibilant; "illness", "virus" and "otitis" are singular
+    if len(word) <= 4:
+        return word
+    if word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith(("sses", "xes", "zes", "ches", "shes", "uses")):
+        return word[:-2]
+    if word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        return word[:-1]
+    return word
+
+
+def build_vocabulary(conditions, max_df=MAX_DOCUMENT_FREQUENCY):
+    """
+    Content words of the condition summaries, stemmed, plus SEED_TERMS.
+
+    Stopwords, COMMON_WORDS and, given at least MIN_CONDITIONS_FOR_DF
+    conditions, words found in more than max_df of them are left out.
+    """
+    document_frequency = {}
+    n_conditions = 0
+    for condition in conditions:
+        n_conditions += 1
+        for term in {stem(word) for word in words(condition)
+                     if len(word) >= 4 and word not in STOPWORDS and word not in COMMON_WORDS}:
+            document_frequency[term] = document_frequency.get(term, 0) + 1
+    vocabulary = {stem(term) for term in SEED_TERMS}
+    for term, count in document_frequency.items():
+        if n_conditions < MIN_CONDITIONS_FOR_DF or count <= max_df * n_conditions:
+            vocabulary.add(term)
+    return vocabulary
+
+
+def load_vocabulary(backend):
+    return build_vocabulary(row[0] for row in backend.sql(VOCABULARY_SQL))
+
+
+class RewriteDecision:
+    """
+    Attributes:
+        rewrite (bool): Whether the LLM rewrite should run
+        reason (str): Short code for the deciding rule
+        features (dict): The measurements behind the decision
+    """
+
+    def __init__(self, rewrite, reason, features):
+        self.rewrite = rewrite
+        self.reason = reason
+        self.features = features
+
+    def to_dict(self):
+        return {"rewrite": self.rewrite, "reason": self.reason, **self.features}
+
+
+class RewriteGate:
+    """
+    Args:
+        vocabulary (set): Stemmed medical terms; see build_vocabulary
+        min_content_words (int): Fewer content words than this is too vague to search as is
+        min_medical_terms (int): Medical terms a question needs to be searched as is
+        log_path (str): Optional JSON lines file every decision is appended to
+    """
+
+    def __init__(self, vocabulary=None, min_content_words=2, min_medical_terms=1, log_path=None):
+        self.vocabulary = vocabulary if vocabulary is not None else build_vocabulary(())
+        self.min_content_words = min_content_words
+        self.min_medical_terms = min_medical_terms
+        self.log_path = log_path
+        self._lock = threading.Lock()
+        self.counts = {"rewrite": 0, "skip": 0}
+
+    def decide(self, question, has_history):
+        """
+        Args:
+            question (str): The user's question
+            has_history (bool): Whether earlier turns exist for pronouns to refer to
+
+        Returns:
+            RewriteDecision
+        """
+        tokens = words(question)
+        lowered = " ".join(tokens)
+        anaphora = sorted({token for token in tokens if token in ANAPHORA} |
+                          {phrase for phrase in ANAPHORA_PHRASES if f" {phrase} " in f" {lowered} "})
+        content = [token for token in tokens if token not in STOPWORDS]
+        medical = sorted({token for token in content if stem(token) in self.vocabulary})
+        features = {"words": len(tokens), "content_words": len(content),
+                    "anaphora": anaphora, "medical_terms": medical, "has_history": has_history}
+
+        if has_history and anaphora:
+            decision = RewriteDecision(True, "anaphora", features)
+        elif len(content) < self.min_content_words:
+            decision = RewriteDecision(True, "too_short", features)
+        elif len(medical) < self.min_medical_terms:
+            decision = RewriteDecision(True, "no_medical_terms", features)
+        else:
+            decision = RewriteDecision(False, "self_contained", features)
+        self._log(question, decision)
+        return decision
+
+    def _log(self, question, decision):
+        record = {"timestamp": time.time(), "question": question, **decision.to_dict()}
+        logger.info("rewrite gate: %s", json.dumps(record))
+        with self._lock:
+            self.counts["rewrite" if decision.rewrite else "skip"] += 1
+            if self.log_path:
+                try:
+                    with open(self.log_path, "a") as f:
+                        f.write(json.dumps(record) + "\n")
+                except OSError as e:
+                    logger.warning("Could not write rewrite gate log %s: %s", self.log_path, e)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts)
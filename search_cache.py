@@ -0,0 +1,131 @@
+"""
+Shared cache for Cortex Search results.
+
+The search services in rag2.sql refresh with TARGET_LAG = '1 day', so a
+result for the same (service, query, columns, filter, limit) cannot change
+more often than that. Entries expire after the service's lag, read from
+SHOW CORTEX SEARCH SERVICES at startup (load_target_lags), and can be
+dropped by hand with invalidate() after a re-ingestion.
+
+Cached results are shared between sessions; callers must not mutate them.
+"""
+import json
+import logging
+import re
+import threading
+
+from completion_cache import LRUTTLCache
+from tracing import annotate
+
+logger = logging.getLogger(__name__)
+
+# TARGET_LAG of the services created in rag2.sql; used when the deployed lags cannot be read
+SERVICE_TARGET_LAGS = {
+    "exact_type_search": "1 day",
+    "condition_match_search": "1 day",
+}
+
+SHOW_SEARCH_SERVICES_SQL = "SHOW CORTEX SEARCH SERVICES"
+
+_LAG_UNITS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+
+def parse_target_lag(lag):
+    """
+    Convert a Snowflake TARGET_LAG such as '1 day' or '30 minutes' to seconds.
+    """
+    match = re.fullmatch(r"\s*(\d+)\s*(second|minute|hour|day)s?\s*", lag.lower())
+    if not match:
+        raise ValueError(f"Unrecognised TARGET_LAG: {lag!r}")
+    return int(match.group(1)) * _LAG_UNITS[match.group(2)]
+
+
+def load_target_lags(backend):
+    """
+    TARGET_LAG of each deployed search service, from SHOW CORTEX SEARCH
+    SERVICES. Services not listed, or with a lag parse_target_lag() does not
+    understand, keep their SERVICE_TARGET_LAGS entry; so do all of them if
+    the statement fails.
+
+    Returns:
+        dict: Service name (lower case) -> TARGET_LAG string
+    """
+    lags = dict(SERVICE_TARGET_LAGS)
+    try:
+        rows = backend.sql(SHOW_SEARCH_SERVICES_SQL)
+    except Exception as e:
+        logger.warning("Could not read search service target lags (%s); using SERVICE_TARGET_LAGS", e)
+        return lags
+    for row in rows:
+        service, lag = str(row["name"]).lower(), row["target_lag"]
+        try:
+            parse_target_lag(lag)
+        except (AttributeError, ValueError) as e:
+            logger.warning("Ignoring target lag of %s: %s", service, e)
+            continue
+        lags[service] = lag
+    return lags
+
+
+class SearchCache:
+    """
+    Args:
+        target_lags (dict): Service name -> TARGET_LAG string, e.g. from load_target_lags();
+            defaults to SERVICE_TARGET_LAGS
+        max_entries (int): In-memory LRU capacity
+        default_ttl (float): Seconds for services missing from target_lags
+    """
+
+    def __init__(self, target_lags=None, max_entries=2048, default_ttl=3600):
+        lags = SERVICE_TARGET_LAGS if target_lags is None else target_lags
+        self.ttls = {service: parse_target_lag(lag) for service, lag in lags.items()}
+        self.default_ttl = default_ttl
+        self.entries = LRUTTLCache(max_entries)
+        self._lock = threading.Lock()
+        self._generation = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, service, query, columns, filter, limit):
+        generation = self._generation.get(service, 0)
+        return json.dumps(
+            [service, generation, " ".join(query.split()), list(columns), filter, limit], sort_keys=True
+        )
+
+    def search(self, backend, service, query, columns, filter=None, limit=5, fetch=None):
+        """
+        backend.search(...) served from cache while within the service's lag.
+        On a miss, fetch() makes the call instead when given (e.g. through a
+        CallPolicy, so that only real round trips are timed).
+        """
+        key = self._key(service, query, columns, filter, limit)
+        result = self.entries.get(key)
+        annotate(cache_hit=result is not None)
+        with self._lock:
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if result is None:
+            if fetch is None:
+                result = backend.search(service, query, columns, filter=filter, limit=limit)
+            else:
+                result = fetch()
+            self.entries.set(key, result, self.ttls.get(service, self.default_ttl))
+        return result
+
+    def invalidate(self, service=None):
+        """
+        Drop cached results for one service, or for all of them. Call after
+        re-ingesting DOCS_CHUNKS_TABLE and refreshing the search services.
+        """
+        if service is None:
+            self.entries.clear()
+            return
+        # Bumping the generation orphans the old keys; LRU eviction reclaims them
+        with self._lock:
+            self._generation[service] = self._generation.get(service, 0) + 1
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries)}
@@ -0,0 +1,122 @@
+"""
+Query several search services at once and merge their rankings.
+
+rag2.sql creates exact_type_search (on the chunk text) and
+condition_match_search (on condition). FanOutSearch sends the same query to
+every service in parallel under one shared deadline and fuses the rankings
+with reciprocal rank fusion, deduplicating by chunk. Services that miss the
+deadline or fail are left out, so a slow service costs recall, never latency.
+"""
+import contextvars
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_WORKERS = 8
+RRF_K = 60
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_search_executor():
+    """
+    Process-wide pool for service calls. Separate from the stage scheduler's
+    pool because the fan-out itself runs inside a scheduler stage.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=DEFAULT_MAX_WORKERS, thread_name_prefix="search-fanout")
+        return _executor
+
+
+def reciprocal_rank_fusion(rankings, key="chunk", k=RRF_K, limit=None):
+    """
+    Merge ranked result lists: each item scores sum(1 / (k + rank)) over the
+    lists it appears in. Items are identified by row[key]; the first copy seen
+    is kept. Ties keep the order in which items were first seen.
+
+    Args:
+        rankings (list[list[dict]]): Result lists, best first
+        key (str): Column identifying an item
+        k (int): RRF damping constant
+        limit (int): Maximum number of items returned
+
+    Returns:
+        list[dict]: Fused results, best first
+    """
+    scores = {}
+    rows = {}
+    for results in rankings:
+        for rank, row in enumerate(results, 1):
+            ident = row.get(key)
+            scores[ident] = scores.get(ident, 0.0) + 1.0 / (k + rank)
+            rows.setdefault(ident, row)
+    fused = [rows[ident] for ident in sorted(scores, key=lambda ident: -scores[ident])]
+    return fused[:limit] if limit is not None else fused
+
+
+class FanOutSearch:
+    """
+    Args:
+        services (tuple): Search service names, in tie-breaking order
+        deadline (float): Seconds to wait for all services together
+        executor (Executor): Pool for the service calls; defaults to a shared one
+        k (int): RRF damping constant
+    """
+
+    def __init__(self, services, deadline=3.0, executor=None, k=RRF_K):
+        self.services = tuple(services)
+        self.deadline = deadline
+        self.executor = executor or get_search_executor()
+        self.k = k
+
+    def search(self, search_fn, query, columns, filter=None, limit=5, deadline=None):
+        """
+        Args:
+            search_fn (callable): search_fn(service, query, columns, filter=, limit=)
+                -> {"results": [...]}, e.g. CortexBackend.search
+            deadline (float): Seconds to wait this time, if shorter than self.deadline
+
+        Returns:
+            dict: {"results": fused rows, "services": service -> "ok" | "error" | "timeout"}
+
+        Raises:
+            Exception: The first service error, if every service failed
+        """
+        if len(self.services) == 1:
+            response = search_fn(self.services[0], query, columns, filter=filter, limit=limit)
+            return {"results": response["results"], "services": {self.services[0]: "ok"}}
+
+        started = time.monotonic()
+        futures = {
+            service: self.executor.submit(contextvars.copy_context().run, search_fn, service, query, columns,
+                                          filter=filter, limit=limit)
+            for service in self.services
+        }
+        wait(futures.values(), timeout=self.deadline if deadline is None else min(deadline, self.deadline))
+
+        rankings = []
+        status = {}
+        errors = []
+        for service, future in futures.items():
+            if not future.done():
+                # Left running; its result is dropped
+                status[service] = "timeout"
+                continue
+            try:
+                rankings.append(future.result()["results"])
+                status[service] = "ok"
+            except Exception as e:
+                logger.warning("Search service %s failed: %s", service, e)
+                status[service] = "error"
+                errors.append(e)
+        if errors and len(errors) == len(futures):
+            raise errors[0]
+        if "timeout" in status.values():
+            logger.info("Search deadline hit after %.2fs: %s", time.monotonic() - started, status)
+        return {"results": reciprocal_rank_fusion(rankings, k=self.k, limit=limit), "services": status}
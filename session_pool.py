@@ -0,0 +1,178 @@
+"""
+Bounded pool of Snowflake connections shared by the whole process.
+
+Streamlit re-runs the script for every interaction, so creating a Session at
+module level means a login per run and one Session shared by every user
+without any concurrency control. The pool creates at most max_size
+connections, hands each to one caller at a time, checks idle ones before
+reuse and transparently replaces connections that went bad.
+"""
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(TimeoutError):
+    pass
+
+
+def connection_params_from_env():
+    """
+    Connection parameters from the SNOWFLAKE_* variables in .env.example, for
+    command-line tools that run outside Streamlit (and its secrets.toml).
+    """
+    return {
+        "account": os.environ["SNOWFLAKE_ACCOUNT"],
+        "user": os.environ["SNOWFLAKE_USER"],
+        "password": os.environ["SNOWFLAKE_PASSWORD"],
+        "role": os.environ["SNOWFLAKE_ROLE"],
+        "database": os.environ["SNOWFLAKE_DATABASE"],
+        "schema": os.environ["SNOWFLAKE_SCHEMA"],
+        "warehouse": os.environ["SNOWFLAKE_WAREHOUSE"],
+    }
+
+
+class SnowflakeConnection:
+    """
+    A Snowpark session plus the snowflake.core Root over it.
+    """
+
+    def __init__(self, session, root):
+        self.session = session
+        self.root = root
+        self.services = {}
+
+    @classmethod
+    def create(cls, connection_params):
+        from snowflake.core import Root
+        from snowflake.snowpark.session import Session
+
+        session = Session.builder.configs(connection_params).create()
+        return cls(session, Root(session))
+
+    def is_healthy(self):
+        try:
+            self.session.sql("SELECT 1").collect()
+            return True
+        except Exception:
+            return False
+
+    def close(self):
+        try:
+            self.session.close()
+        except Exception:
+            pass
+
+
+class ConnectionPool:
+    """
+    Args:
+        factory (callable): Creates a new connection
+        max_size (int): Upper bound on open connections
+        checkout_timeout (float): Seconds to wait for a free connection
+        health_check_after (float): Idle seconds after which a connection is
+            checked with is_healthy() before being handed out
+    """
+
+    def __init__(self, factory, max_size=4, checkout_timeout=30.0, health_check_after=300.0):
+        self.factory = factory
+        self.max_size = max_size
+        self.checkout_timeout = checkout_timeout
+        self.health_check_after = health_check_after
+        self._idle = []  # (connection, returned_at)
+        self._size = 0
+        self._cond = threading.Condition()
+        self._metrics = {
+            "checkouts": 0, "waits": 0, "wait_s_total": 0.0, "wait_s_max": 0.0,
+            "created": 0, "reconnects": 0, "timeouts": 0,
+        }
+
+    def _acquire(self):
+        started = time.monotonic()
+        deadline = started + self.checkout_timeout
+        with self._cond:
+            waited = False
+            while not self._idle and self._size >= self.max_size:
+                waited = True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._metrics["timeouts"] += 1
+                    raise PoolTimeout(f"No Snowflake connection free after {self.checkout_timeout}s")
+                self._cond.wait(remaining)
+            wait_s = time.monotonic() - started
+            self._metrics["checkouts"] += 1
+            if waited:
+                self._metrics["waits"] += 1
+                self._metrics["wait_s_total"] += wait_s
+                self._metrics["wait_s_max"] = max(self._metrics["wait_s_max"], wait_s)
+            if self._idle:
+                connection, returned_at = self._idle.pop()
+            else:
+                connection, returned_at = None, None
+                self._size += 1
+
+        if connection is None:
+            return self._create()
+        if time.monotonic() - returned_at > self.health_check_after and not connection.is_healthy():
+            logger.warning("Replacing unhealthy Snowflake connection")
+            connection.close()
+            with self._cond:
+                self._metrics["reconnects"] += 1
+            return self._create()
+        return connection
+
+    def _create(self):
+        try:
+            connection = self.factory()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._metrics["created"] += 1
+        return connection
+
+    def _release(self, connection, broken=False):
+        with self._cond:
+            if broken:
+                self._size -= 1
+                self._metrics["reconnects"] += 1
+            else:
+                self._idle.append((connection, time.monotonic()))
+            self._cond.notify()
+        if broken:
+            connection.close()
+
+    @contextmanager
+    def checkout(self):
+        """
+        Borrow a connection for the duration of the with block. If the block
+        raises and the connection no longer answers, it is discarded so the
+        next checkout reconnects.
+        """
+        connection = self._acquire()
+        broken = False
+        try:
+            yield connection
+        except Exception:
+            broken = not connection.is_healthy()
+            raise
+        finally:
+            self._release(connection, broken)
+
+    def metrics(self):
+        with self._cond:
+            return {**self._metrics, "size": self._size, "idle": len(self._idle),
+                    "in_use": self._size - len(self._idle), "max_size": self.max_size}
+
+    def close(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+        for connection, _ in idle:
+            connection.close()
@@ -0,0 +1,144 @@
+"""
+Runs the independent stages of a pipeline concurrently on a thread pool.
+
+A stage only waits for the stages named in its `after` list, and receives
+their results as keyword arguments. Stages can have a timeout and a
+fallback; the fallback runs on the calling thread, so it is safe to use
+Streamlit from it.
+"""
+import contextvars
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from tracing import span
+
+DEFAULT_MAX_WORKERS = 8
+
+_default_executor = None
+_default_executor_lock = threading.Lock()
+
+
+def get_default_executor():
+    """
+    Process-wide pool shared by every scheduler that wasn't given its own.
+    """
+    global _default_executor
+    with _default_executor_lock:
+        if _default_executor is None:
+            _default_executor = ThreadPoolExecutor(max_workers=DEFAULT_MAX_WORKERS, thread_name_prefix="rag-stage")
+        return _default_executor
+
+
+class StageTimeout(TimeoutError):
+    pass
+
+
+class StageCancelled(Exception):
+    """
+    Raised by run() when its `cancelled` check turns true between stages.
+    """
+
+
+class Stage:
+    """
+    One unit of work in a StageScheduler run.
+
+    Args:
+        name (str): Key of the result, and keyword name for dependants
+        fn (callable): Called with the results of `after` as keyword arguments
+        after (tuple): Names of the stages this one depends on
+        timeout (float): Seconds after submission before the stage is abandoned
+        fallback (callable): fallback(exc) -> result used on error or timeout;
+            without one the error propagates out of run()
+    """
+
+    def __init__(self, name, fn, after=(), timeout=None, fallback=None):
+        self.name = name
+        self.fn = fn
+        self.after = tuple(after)
+        self.timeout = timeout
+        self.fallback = fallback
+
+
+class StageScheduler:
+    """
+    Dependency-aware stage runner.
+
+    Args:
+        executor (Executor): Pool to run stages on; defaults to the shared pool.
+            Pass ThreadPoolExecutor(max_workers=1) to run strictly in sequence.
+    """
+
+    def __init__(self, executor=None):
+        self.executor = executor
+
+    def run(self, stages, cancelled=None):
+        """
+        Run stages, starting each one as soon as its dependencies are done.
+
+        Args:
+            stages (list[Stage]): The stages to run
+            cancelled (callable): Checked before starting stages; when it returns
+                True, stages not yet started are skipped and StageCancelled is
+                raised. Stages already running finish in the background.
+
+        Returns:
+            dict: stage name -> result
+        """
+        executor = self.executor or get_default_executor()
+        pending = {stage.name: stage for stage in stages}
+        for stage in stages:
+            missing = [dep for dep in stage.after if dep not in pending]
+            if missing:
+                raise ValueError(f"Stage {stage.name} depends on unknown stages {missing}")
+
+        results = {}
+        running = {}
+        while pending or running:
+            if cancelled is not None and cancelled():
+                for future in running:
+                    future.cancel()
+                raise StageCancelled(f"Cancelled before {sorted(pending) or 'the end'}")
+            for name, stage in list(pending.items()):
+                if all(dep in results for dep in stage.after):
+                    # copy_context() carries the current tracing span into the worker
+                    future = executor.submit(contextvars.copy_context().run, self._run_stage, stage,
+                                             {dep: results[dep] for dep in stage.after})
+                    deadline = None if stage.timeout is None else time.monotonic() + stage.timeout
+                    running[future] = (stage, deadline)
+                    del pending[name]
+            if not running:
+                raise ValueError(f"Stages {sorted(pending)} can never run")
+
+            deadlines = [deadline for _, deadline in running.values() if deadline is not None]
+            timeout = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+            done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                stage, _ = running.pop(future)
+                try:
+                    results[stage.name] = future.result()
+                except Exception as e:
+                    results[stage.name] = self._fail(stage, e)
+
+            now = time.monotonic()
+            for future, (stage, deadline) in list(running.items()):
+                if deadline is not None and deadline <= now:
+                    future.cancel()
+                    del running[future]
+                    results[stage.name] = self._fail(
+                        stage, StageTimeout(f"Stage {stage.name} timed out after {stage.timeout}s")
+                    )
+        return results
+
+    @staticmethod
+    def _run_stage(stage, kwargs):
+        with span(stage.name):
+            return stage.fn(**kwargs)
+
+    @staticmethod
+    def _fail(stage, exc):
+        if stage.fallback is None:
+            raise exc
+        return stage.fallback(exc)
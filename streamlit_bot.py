@@ -2,12 +2,26 @@ import streamlit as st
 from streamlit_extras.let_it_rain import rain
 #from snowflake.snowpark.context import get_active_session
 from datetime import date
-from snowflake.core import Root
 import json
+import os
+import uuid
 
 #from dotenv import load_dotenv
-from snowflake.snowpark.session import Session
-import os
+import auth
+import tracing
+from answer_worker import DONE, FINISHED, AnswerWorker
+from breed_index import BreedIndex
+from call_policy import DEFAULT_BUDGET, CallPolicy
+from chat_store import ChatHistoryStore, Conversation
+from completion_cache import CompletionCache
+from cortex_backend import SnowparkBackend, create_backend
+from data_access import RequestScope, SharedBackend
+from model_router import MODEL_CHOICES, ModelRouter
+from pet_context import PetContextStore
+from rag_pipeline import SEARCH_DEADLINE, SEARCH_SERVICES, RagPipeline
+from rewrite_gate import RewriteGate, load_vocabulary
+from search_cache import SearchCache, load_target_lags
+from search_fanout import FanOutSearch
 
 #load_dotenv()
 
@@ -21,7 +35,45 @@ connection_params = {
     "warehouse": st.secrets["snowflake"]["warehouse"]
 }
 
-session = Session.builder.configs(connection_params).create()
+POOL_HEADROOM = 4
+
+
+@st.cache_resource
+def get_backend():
+    # FURWELL_BACKEND swaps Snowflake for a registered stand-in (see load_test.py)
+    if os.environ.get("FURWELL_BACKEND"):
+        return create_backend(os.environ["FURWELL_BACKEND"])
+    # One connection pool per process instead of a fresh login on every script run. Each answer
+    # job can hold two connections during a blocking COMPLETE or search (an attempt and its hedge);
+    # streamed answers return theirs before streaming. The rest is headroom for logins, history
+    # pages and chat writes, so they never queue behind answers.
+    workers = st.secrets.get("worker", {}).get("max_workers", 4)
+    snowpark = SnowparkBackend.from_connection_params(
+        connection_params, pool_size=st.secrets.get("pool", {}).get("size", 2 * workers + POOL_HEADROOM)
+    )
+    # Optional: answer searches from a local index built by `python local_retrieval.py export`
+    local_index = st.secrets.get("retrieval", {}).get("local_index")
+    if local_index:
+        from local_retrieval import LocalRetrievalBackend
+        return LocalRetrievalBackend.from_directory(local_index, snowpark)
+    return snowpark
+
+
+backend = get_backend()
+# Streamlit re-executes this module on every rerun, so db is scoped to one rerun:
+# identical reads are sent once and every statement is counted for the debug panel
+db = RequestScope(backend).activate()
+# What the process-wide stores use; their statements still count towards db
+shared_backend = SharedBackend(backend)
+
+
+@st.cache_resource
+def configure_tracing():
+    # [tracing] export_path appends every question's trace to a JSON lines file
+    tracing.configure(export_path=st.secrets.get("tracing", {}).get("export_path"))
+
+
+configure_tracing()
 
 # -------------------------------
 # Session State Initialization
@@ -33,11 +85,11 @@ def init_user_session():
         "current_user": None,
         "pets": [],
         "current_pet": None,
-        "messages": {},
-        "clinical_history": {},
-        "daily_check_ins": {},
+        "conversations": {},
         "current_view": "Current Pet",
-        "model_name": 'mistral-large2'
+        "pending_answer": None,
+        "model_overrides": {},
+        "rewrite_mode": st.secrets.get("rag", {}).get("rewrite_mode", "fused")
     }
     
     
@@ -56,11 +108,16 @@ def change_view(new_view):
     st.rerun()
 
 def handle_logout():
-    for key in ['user_logged_in', 'current_user', 'pets', 'messages', 
-                'clinical_history', 'daily_check_ins', 'current_pet']:
+    if st.session_state.pending_answer is not None:
+        settle_answer(st.session_state.pending_answer, cancel=True)
+    if st.session_state.current_user is not None:
+        # Answer jobs only: a running summary refresh still finishes and is saved
+        get_answer_worker().cancel(st.session_state.current_user)
+    get_chat_store().flush()
+    for key in ['user_logged_in', 'current_user', 'pets', 'conversations', 'current_pet']:
         if key in st.session_state:
             st.session_state[key] = None if key in ['current_user', 'current_pet'] else (
-                {} if key in ['messages', 'clinical_history', 'daily_check_ins'] else (
+                {} if key == 'conversations' else (
                     [] if key == 'pets' else False))
     st.session_state.current_view = "Current Pet"
     st.rerun()
@@ -69,187 +126,182 @@ def handle_logout():
 # -------------------------------
 # Call RAG Service
 # -------------------------------
-CORTEX_SEARCH_DATABASE = "ANIMAL_DATA"
-CORTEX_SEARCH_SCHEMA = "PUBLIC"
-CORTEX_SEARCH_SERVICE = "exact_type_search"
-CORTEX_SEARCH_SERVICE_CONDITION = "condition_match_search"
 
+@st.cache_resource
+def get_completion_cache():
+    # Shared by every session; [cache] sqlite_path in secrets keeps it across restarts
+    return CompletionCache(sqlite_path=st.secrets.get("cache", {}).get("sqlite_path"))
 
 
-root = Root(session)    
-NUM_CHUNKS = 5
-slide_window = 7
-COLUMNS=["chunk", "relative_path", "pet_type"]
+@st.cache_resource
+def get_search_cache():
+    # Shared by every session; call get_search_cache().invalidate() after re-ingestion
+    return SearchCache(load_target_lags(shared_backend))
 
-svc = root.databases[CORTEX_SEARCH_DATABASE].schemas[CORTEX_SEARCH_SCHEMA].cortex_search_services[CORTEX_SEARCH_SERVICE_CONDITION]
 
-def get_similar_chunks_search_service(query, type):
-    # 构建过滤条件
-    filter_condition = {
-      "@or": [
-          {"@eq": {"pet_type": type}}, {"@eq": {"pet_type": "Undefined"}}
-      ]
-    }
-    
-    try:
-        response = svc.search(query, COLUMNS, limit=NUM_CHUNKS, filter=filter_condition)
-        json_response = json.loads(response.to_json())
-        return json_response
-    
-    except Exception as e:
-        st.error(f"Error occurred while querying the service: {str(e)}")
-        return {"results": []}
-        
+@st.cache_resource
+def get_context_store():
+    # Shared by every session so one pet's records are loaded once per process
+    return PetContextStore(shared_backend)
 
-def get_chat_history():
-    
-    chat_history = []
-    
-    start_index = max(0, len(st.session_state.messages[st.session_state.current_pet]) - slide_window)
-    for i in range (start_index , len(st.session_state.messages[st.session_state.current_pet]) -1):
-         chat_history.append(st.session_state.messages[st.session_state.current_pet][i])
 
-    return chat_history
+@st.cache_resource
+def get_rewrite_gate():
+    # Medical vocabulary from the ingested condition summaries, loaded once per process.
+    # [rag] rewrite_gate = false always rewrites; rewrite_gate_log keeps decisions for auditing.
+    settings = st.secrets.get("rag", {})
+    if not settings.get("rewrite_gate", True):
+        return None
+    return RewriteGate(load_vocabulary(shared_backend), log_path=settings.get("rewrite_gate_log"))
 
-def summarize_question_with_history(chat_history, question):
-# To get the right context, use the LLM to first summarize the previous conversation
-# This will be used to get embeddings and find similar chunks in the docs for context
 
-    prompt = f"""
-        Based on the chat history below and the question, generate a query that extend the question
-        with the chat history provided. The query should be in natual language. 
-        Answer with only the query. Do not add any explanation.
-        
-        <chat_history>
-        {chat_history}
-        </chat_history>
-        <question>
-        {question}
-        </question>
-        """
-    sumary = session.sql(
-        "SELECT SNOWFLAKE.CORTEX.COMPLETE(?, ?)", 
-        params=[st.session_state.model_name, prompt]
-        ).collect()[0]['SNOWFLAKE.CORTEX.COMPLETE(?, ?)']
+@st.cache_resource
+def get_call_policy():
+    # Shared so every session's calls feed the latency windows the hedges are timed from.
+    # [calls] budget = 0 turns the per-question budget off; hedge = false never hedges.
+    settings = st.secrets.get("calls", {})
+    return CallPolicy(budget=settings.get("budget", DEFAULT_BUDGET) or None,
+                      max_attempts=settings.get("max_attempts", 3),
+                      hedge=("search.", "complete.") if settings.get("hedge", True) else ())
 
 
-    sumary = sumary.replace("'", "")
+@st.cache_resource
+def get_model_router():
+    # [models] maps stages to models and holds the A/B experiments; shared so usage adds up per process
+    return ModelRouter.from_settings(st.secrets.get("models", {}))
 
-    return sumary
 
-def rewrite_query(question):
-    """
-    Use the LLM to rewrite the original query into a more contextually aligned and refined query.
-    """
-    prompt = f"""
-        Rewrite the following question to make it more formal, specific, and aligned to retrieve relevant information from a medical database for pets.
-        The rewritten query should focus on key terms and provide clarity for searching.
-        Answer with only the rewritten query. Do not add any explanation.
-
-        <question>
-        {question}
-        </question>
-    """
-    rewritten_query = session.sql(
-        "SELECT SNOWFLAKE.CORTEX.COMPLETE(?, ?)", 
-        params=[st.session_state.model_name, prompt]
-    ).collect()[0]['SNOWFLAKE.CORTEX.COMPLETE(?, ?)']
+def get_model_route():
+    # Experiments are assigned per user; the debug sidebar can override stages for this session
+    return get_model_router().route(st.session_state.current_user, st.session_state.model_overrides)
+
+
+def get_pipeline(scope=None):
+    search = FanOutSearch(SEARCH_SERVICES, st.secrets.get("rag", {}).get("search_deadline", SEARCH_DEADLINE))
+    return RagPipeline(scope or db, model_route=get_model_route(), on_error=st.error,
+                       rewrite_mode=st.session_state.rewrite_mode, completion_cache=get_completion_cache(),
+                       search_cache=get_search_cache(), context_store=get_context_store(), search=search,
+                       rewrite_gate=get_rewrite_gate(), call_policy=get_call_policy())
+
+
+@st.cache_resource
+def get_chat_store():
+    settings = st.secrets.get("chat", {})
+    return ChatHistoryStore(shared_backend, page_size=settings.get("page_size", 20),
+                            refresh_every=settings.get("summary_every", 2))
 
-    # Remove any extra characters like quotes that might break downstream tasks
-    rewritten_query = rewritten_query.replace("'", "")
 
-    return rewritten_query
+def get_conversation():
+    # Loaded lazily, one page at a time, the first time a pet is opened in this session
+    pet = st.session_state.current_pet
+    if pet not in st.session_state.conversations:
+        st.session_state.conversations[pet] = get_chat_store().open(st.session_state.current_user, pet)
+    return st.session_state.conversations[pet]
+
+
+def get_chat_history():
+    # Rolling summary + the messages after it, instead of a raw sliding window
+    return get_conversation().prompt_history()
 
 
 def create_prompt (myquestion):
-    pet_info = get_pet_info()
-    type = pet_info['TYPE']
-    # st.write(type)
-    chat_history = get_chat_history()   
-    clinical_history = []
-    daily_checkins = []
-    result = session.sql(
-                'SELECT date, notes FROM clinical_history WHERE pet_id = ?', 
-                (st.session_state.current_pet,)
-                ).collect()
-    for row in result:
-        clinical_history.append((row['DATE'],row['NOTES']))
-    result = session.sql(
-                'SELECT date,condition,notes FROM daily_check_ins WHERE pet_id = ?', 
-                (st.session_state.current_pet,)
-                ).collect()
-    for row in result:
-        daily_checkins.append((row['DATE'],row['CONDITION'],row['NOTES']))
-
-
-    if chat_history!= []: #There is chat_history, so not first question
-        question_summary = summarize_question_with_history(chat_history, myquestion)
-        # prompt_context =  get_similar_chunks_search_service(question_summary, type)
-        prompt_context =  get_similar_chunks_search_service(rewrite_query(question_summary), type)
-    else:
-        # prompt_context = get_similar_chunks_search_service(myquestion, type)
-        prompt_context = get_similar_chunks_search_service(rewrite_query(myquestion), type) #First question when using history
-        
-        # 将搜索结果显示到前端
-        # st.subheader("Search Results")
-        # st.write(prompt_context)
-        
-    prompt = f"""
-           You are an expert chat assistance to offer professional suggestions about pet daily care and disease related problems.
-           You need to extract information from the CONTEXT provided between <context> and </context> tags.
-           You offer a chat experience considering the information included in the CHAT HISTORY provided between <chat_history> and </chat_history> tags.
-           You need to take the information included in the CLINICAL HISTORY provided between <clinical_history> and </clinical_history> tags.
-           You need to take the information included in the DAILY CHECKINS provided between <daily_ckeckins> and </daily_checkins> tags.
-           When ansering the question contained between <question> and </question> tags be concise and do not hallucinate. 
-           If you don't have the information, give a general idea and mention you are not sure.
-           
-           Do not mention the CONTEXT used in your answer.
-           Do not mention the CHAT HISTORY used in your asnwer.
-
-           - Explain medical terms or complex issues in language that anyone without medical knowledge can understand.
-           - Provide ACTIONABLE ADVICE where applicable.
-           - Keep the response conversational and easy to understand.
-           - Be empathetic and reassuring when addressing concerns.
-
-           Only anwer the question if you can extract it from the CONTEXT provideed.
-           
-           <chat_history>
-           {chat_history}
-           </chat_history>
-           <clinical_history>
-           {clinical_history}
-           </clinical_history>
-           <daily_checkins>
-           {daily_checkins}
-           </daily_checkins>
-           <context>          
-           {prompt_context}
-           </context>
-           <question>  
-           {myquestion}
-           </question>
-           Answer: 
-           """
-           
-    # json_data = json.loads(prompt_context)
-
-    # relative_paths = set(item['relative_path'] for item in json_data['results'])
-    relative_paths = set(item['relative_path'] for item in prompt_context['results'])
-
-    return prompt, relative_paths
+    return get_pipeline().create_prompt(myquestion, st.session_state.current_pet, get_chat_history(),
+                                        pet_info=get_pet_info())
 
 
 def answer_question(myquestion):
+    return get_pipeline().answer_question(myquestion, st.session_state.current_pet, get_chat_history(),
+                                          pet_info=get_pet_info())
 
-    prompt, relative_paths =create_prompt (myquestion)
-    response = session.sql(
-        "SELECT SNOWFLAKE.CORTEX.COMPLETE(?, ?)", 
-        params=[st.session_state.model_name, prompt]
-        ).collect()[0]['SNOWFLAKE.CORTEX.COMPLETE(?, ?)']
-    return response, relative_paths
 
+@st.cache_resource
+def get_answer_worker():
+    return AnswerWorker(max_workers=st.secrets.get("worker", {}).get("max_workers", 4))
 
-def assign_pet_type(chunk: str) -> str:
+
+def submit_answer(myquestion):
+    """
+    Answer on the worker pool instead of blocking this script run. Everything
+    the job needs from session state is read here, on the script thread; the
+    job gets its own RequestScope because it outlives this rerun.
+    """
+    user, pet = st.session_state.current_user, st.session_state.current_pet
+    key = (user, pet, uuid.uuid4().hex)
+    pipeline = get_pipeline(scope=RequestScope(backend))
+    chat_history = get_chat_history()
+    pet_info = get_pet_info()
+
+    def run(job):
+        # Only streams into the job; settle_answer() stores the result on the script thread
+        pipeline.on_error = job.error
+        pipeline.cancelled = job.cancelled
+        with tracing.span("question", user=user, pet_id=pet):
+            stream, job.relative_paths = pipeline.answer_question_stream(myquestion, pet, chat_history,
+                                                                         pet_info=pet_info)
+            for piece in stream:
+                job.append(piece)
+
+    get_answer_worker().submit(key, run)
+    st.session_state.pending_answer = key
+
+
+def settle_answer(key, cancel=False):
+    """
+    Store a job's answer in its conversation, on the script thread, and
+    write the question and answer to CHAT_MESSAGES with one INSERT. A job
+    that was cancelled (superseded, pet switch, logout) or failed keeps what
+    it streamed so far, so no question is left without an answer.
+    """
+    worker, chat_store = get_answer_worker(), get_chat_store()
+    st.session_state.pending_answer = None
+    job = worker.pop(key)
+    if job is None:
+        return None
+    if cancel:
+        job.cancel()
+    state = job.snapshot()
+    text = state["text"].replace("'", "")
+    if cancel or state["status"] != DONE:
+        text = text + " …" if text else "(No answer: the question was cancelled or failed.)"
+    conversation = (st.session_state.conversations or {}).get(job.pet)
+    if conversation is not None:
+        chat_store.append(conversation, "assistant", text)
+        chat_store.flush()
+        if chat_store.needs_summary(conversation):
+            pipeline = get_pipeline(scope=RequestScope(backend))
+
+            def refresh_summary(summary_job):
+                pipeline.on_error = summary_job.error
+                pipeline.cancelled = summary_job.cancelled
+                chat_store.refresh_summary(conversation, pipeline.summarize_history)
+
+            worker.submit((job.user, job.pet, "summary"), refresh_summary, supersede=False)
+    return state
+
+
+@st.fragment(run_every=0.5)
+def pending_answer():
+    """
+    Poll the pending job; only this fragment reruns while the answer streams in.
+    """
+    key = st.session_state.pending_answer
+    job = get_answer_worker().get(key) if key is not None else None
+    if job is None:
+        st.session_state.pending_answer = None
+        return
+    state = job.snapshot()
+    if state["status"] not in FINISHED:
+        with st.chat_message("assistant"):
+            st.markdown(state["text"].replace("'", "") + "▌" if state["text"] else "Thinking...")
+        return
+
+    settle_answer(key)
+    for message in state["errors"]:
+        st.toast(message, icon="⚠️")
+    st.rerun()
+
+
+def llm_pet_type(chunk: str) -> str:
         # Use LLM to determine pet type
         prompt = f"""
         Given the following text, classify it as one of the following categories:
@@ -265,9 +317,23 @@ def assign_pet_type(chunk: str) -> str:
         {chunk}
         """
 
-        pet_type = session.sql("SELECT SNOWFLAKE.CORTEX.COMPLETE(?, ?)", params=['mistral-large2', prompt]).collect()[0][0]
-        # Validate response and default to 'Undefined' if not in expected values
-        return pet_type
+        route = get_model_route()
+        with tracing.span("complete.pet_type", model=route.model("pet_type"), prompt_chars=len(prompt)) as current:
+            response = get_completion_cache().complete(backend, route.model("pet_type"), prompt, "pet_type")
+        route.record("pet_type", prompt, response, current.duration, cached=bool(current.attributes.get("cache_hit")))
+        return response
+
+
+@st.cache_resource
+def get_breed_index():
+    # Loaded once per process; [breeds] learned_path in secrets keeps LLM-learned breeds across restarts
+    return BreedIndex(learned_path=st.secrets.get("breeds", {}).get("learned_path"))
+
+
+def assign_pet_type(chunk: str) -> str:
+    # Common breeds resolve locally; only unknown ones cost a COMPLETE.
+    # Responses outside the five labels come back as 'Undefined'
+    return get_breed_index().classify(chunk, llm_pet_type)
 
 # -------------------------------
 # Registration & Login Functions
@@ -281,22 +347,20 @@ def register_user():
         submitted = st.form_submit_button("Register")
 
         if submitted:
-            result = session.sql("SELECT username FROM users").collect()
-            all_usernames = [row['USERNAME'] for row in result]
             if not new_username or not new_password:
                 st.error("Please fill out both username and password!")
-            elif new_username in all_usernames:
+            elif not auth.create_user(db, new_username, new_password, get_auth_iterations()):
                 st.error("Username already exists. Please choose a different one.")
             else:
-                session.sql("INSERT INTO users (username, password) VALUES (?, ?)", 
-                          (new_username, new_password)).collect()
                 st.success("Registration successful! You can now log in.")
                 change_view("Login")
 
-def login_user():
-    result = session.sql("SELECT username,password FROM users").collect()
-    all_pairs = {row['USERNAME']:row['PASSWORD'] for row in result}
+def get_auth_iterations():
+    # PBKDF2 cost; only paid when a form is submitted, never on render
+    return st.secrets.get("auth", {}).get("iterations", auth.DEFAULT_ITERATIONS)
+
 
+def login_user():
     st.subheader("User Login")
     with st.form("login_user_form", clear_on_submit=True):
         username = st.text_input("Username:")
@@ -304,20 +368,16 @@ def login_user():
         submitted = st.form_submit_button("Login")
 
         if submitted:
-            if username in all_pairs.keys() and all_pairs.get(username,'') == password:
+            user_id = auth.authenticate(db, username, password, get_auth_iterations()) if username else None
+            if user_id is not None:
                 st.session_state.user_logged_in = True
-                st.session_state.current_user = session.sql("select ID from users where username=?",
-                                                          (username,)).collect()[0]['ID']
+                st.session_state.current_user = user_id
                 
                 # Check if user has any pets
-                result = session.sql("SELECT COUNT(*) as pet_count FROM pets WHERE user_id = ?",
-                                   (st.session_state.current_user,)).collect()
-                has_pets = result[0]['PET_COUNT'] > 0
+                pets_result = get_user_pets()
                 
-                if has_pets:
+                if pets_result:
                     # If user has pets, load them and set current pet to the first one
-                    pets_result = session.sql("SELECT id FROM pets WHERE user_id = ?",
-                                            (st.session_state.current_user,)).collect()
                     st.session_state.pets = [row['ID'] for row in pets_result]
                     st.session_state.current_pet = st.session_state.pets[0]
                     change_view("Current Pet")
@@ -354,19 +414,17 @@ def add_pet():
             if pet_type=='Undefined':
                 st.error("Try to provide more information about the breed!")
                 return
-            result = session.sql("SELECT name FROM pets WHERE user_id = ?", 
-                               (st.session_state.current_user,)).collect()
-            existing_names = [row['NAME'] for row in result]
+            existing_names = [row['NAME'] for row in get_user_pets()]
             
             if pet_name in existing_names:
                 st.error("You already have a pet with this name!")
                 return
                 
-            session.sql(
+            db.sql(
                 """INSERT INTO pets (user_id, name, breed, type, gender, age) 
                    VALUES (?, ?, ?, ?, ?, ?)""",
                 (st.session_state.current_user, pet_name, pet_breed, pet_type, pet_gender, age)
-            ).collect()
+            )
             # st.write(f"Debugging Inputs:")
             # st.write(f"user_id: {st.session_state.current_user}")
             # st.write(f"name: {pet_name}")
@@ -374,29 +432,32 @@ def add_pet():
             # st.write(f"type: {pet_type}")
             # st.write(f"gender: {pet_gender}")
             # st.write(f"age: {age}")
-            inserted_id = session.sql(
+            inserted_id = db.sql(
                 """SELECT id FROM pets 
                    WHERE user_id = ? AND name = ? 
                    ORDER BY id DESC LIMIT 1""",
                 (st.session_state.current_user, pet_name)
-            ).collect()[0]['ID']
+            )[0]['ID']
             
             if inserted_id not in st.session_state.pets:
                 st.session_state.pets.append(inserted_id)
             st.session_state.current_pet = inserted_id
-            st.session_state.messages[inserted_id] = []
-            st.session_state.clinical_history[inserted_id] = []
-            st.session_state.daily_check_ins[inserted_id] = []
+            st.session_state.conversations[inserted_id] = Conversation(st.session_state.current_user, inserted_id)
             
             st.success(f"Added {pet_name} successfully!")
             st.balloons()
             change_view("Current Pet")
 
-def switch_pet():
-    result = session.sql(
-        "SELECT name, id FROM pets WHERE user_id=?",
+def get_user_pets():
+    # One query serves the pet switcher, the "any pets?" checks and the current pet's details
+    return db.sql(
+        "SELECT id, name, breed, type, gender, age FROM pets WHERE user_id = ?",
         (st.session_state.current_user,)
-    ).collect()
+    )
+
+
+def switch_pet():
+    result = get_user_pets()
     
     pet_names = {row['NAME']:row['ID'] for row in result}
     if pet_names:
@@ -418,9 +479,7 @@ def logout():
     st.session_state.user_logged_in = False
     st.session_state.current_user = None
     st.session_state.pets = []
-    st.session_state.messages = {}
-    st.session_state.clinical_history = {}
-    st.session_state.daily_check_ins = {}
+    st.session_state.conversations = {}
     st.session_state.current_pet = None
     st.session_state.current_view = "Current Pet"
     st.success("You have been logged out.")
@@ -437,11 +496,7 @@ def record_clinical_history():
     st.subheader("Record Clinical History")
     
     # Check if there are any pets
-    result = session.sql(
-        "SELECT COUNT(*) as pet_count FROM pets WHERE user_id = ?",
-        (st.session_state.current_user,)
-    ).collect()
-    pet_count = result[0]['PET_COUNT']
+    pet_count = len(get_user_pets())
     
     if pet_count == 0:
         st.warning("⚠️ You haven't added any pets yet! Please add a pet first before recording clinical history.")
@@ -460,26 +515,14 @@ def record_clinical_history():
 
         if submitted:
             if notes:
-                record = {
-                    "date": visit_date,
-                    "notes": notes,
-                }
-                st.session_state.clinical_history.get(current_pet,[]).append(record)
-                session.sql(
-                    "INSERT INTO clinical_history (pet_id, date, notes) VALUES (?, ?, ?)", 
-                    (st.session_state.current_pet, record['date'], record['notes'])).collect()
+                get_context_store().add_clinical_record(current_pet, visit_date, notes)
                 st.success("Clinical history saved!")
             else:
                 st.error("Please enter some notes.")
 
     # Display existing history
     st.write("### Clinical History Records")
-    result = session.sql(
-                'SELECT date, notes FROM clinical_history WHERE pet_id = ?', 
-                (st.session_state.current_pet,)
-                ).collect()
-    for row in result:
-        st.write(f"**Date**: {row['DATE']} - **Notes**: {row['NOTES']}")
+    history_table("clinical_history", {"DATE": "Date", "NOTES": "Notes"})
 
 def daily_check_in():
     """
@@ -489,11 +532,7 @@ def daily_check_in():
     st.subheader("Daily/Regular Check-In")
     
     # Check if there are any pets
-    result = session.sql(
-        "SELECT COUNT(*) as pet_count FROM pets WHERE user_id = ?",
-        (st.session_state.current_user,)
-    ).collect()
-    pet_count = result[0]['PET_COUNT']
+    pet_count = len(get_user_pets())
     
     if pet_count == 0:
         st.warning("⚠️ You haven't added any pets yet! Please add a pet first before doing a daily check-in.")
@@ -513,24 +552,53 @@ def daily_check_in():
         notes = st.text_area("Additional Notes:", "")
         submitted = st.form_submit_button("Save Check-In")
         if submitted:
-            record = {
-                "date": check_date,
-                "condition": condition,
-                "notes": notes,
-            }
-            st.session_state.daily_check_ins.get(st.session_state.current_pet,[]).append(record)
-            # Execute the SQL insert without displaying the result
-            session.sql(
-                "INSERT INTO daily_check_ins (pet_id, date, condition, notes) VALUES (?, ?, ?, ?)", 
-                (st.session_state.current_pet, record['date'], record['condition'],record['notes'])
-            ).collect()
+            get_context_store().add_daily_checkin(st.session_state.current_pet, check_date, condition, notes)
             st.success("Daily check-in saved!")
             
     # Display existing check-in data
     st.write("### Check-In History")
-    result = session.sql("select date, condition, notes from daily_check_ins where pet_id=?",(st.session_state.current_pet,)).collect()
-    for row in result:
-        st.write(f"**Date**: {row['DATE']} - **Condition**: {row['CONDITION']} - **Notes**: {row['NOTES']}")
+    history_table("daily_checkins", {"DATE": "Date", "CONDITION": "Condition", "NOTES": "Notes"})
+
+
+def history_table(view, labels):
+    """
+    One page of the current pet's records, newest first, with a date-range
+    filter. Only the visible page is queried (keyset pagination in
+    PetContextStore.history_page) and it is drawn as a single st.dataframe
+    instead of one element per record.
+
+    Args:
+        view (str): "clinical_history" or "daily_checkins"
+        labels (dict): Result column -> table header, in display order
+    """
+    pet = st.session_state.current_pet
+    # Empty until the user picks a range; while picking, only the start is set
+    dates = tuple(st.date_input("Show records between:", value=(), key=f"{view}_dates"))
+    start = dates[0] if dates else None
+    end = dates[1] if len(dates) > 1 else None
+
+    # Cursors of the pages seen so far, so "Newer" can step back; reset when the filter changes
+    pages = st.session_state.get(f"{view}_pages")
+    if pages is None or pages["filter"] != (pet, start, end):
+        pages = st.session_state[f"{view}_pages"] = {"filter": (pet, start, end), "cursors": [None]}
+    page_size = st.secrets.get("history", {}).get("page_size", 25)
+    rows, next_cursor = get_context_store().history_page(view, pet, start, end, pages["cursors"][-1], page_size)
+
+    if rows:
+        st.dataframe([{label: row[column] for column, label in labels.items()} for row in rows],
+                     hide_index=True, use_container_width=True)
+    else:
+        st.info("No records for these dates.")
+
+    newer, page, older = st.columns(3)
+    if newer.button("← Newer", key=f"{view}_newer", disabled=len(pages["cursors"]) == 1):
+        pages["cursors"].pop()
+        st.rerun()
+    page.caption(f"Page {len(pages['cursors'])}")
+    if older.button("Older →", key=f"{view}_older", disabled=next_cursor is None):
+        pages["cursors"].append(next_cursor)
+        st.rerun()
+
 # --------------------------------
 # Bubbles effect
 # --------------------------------
@@ -554,14 +622,67 @@ def config_options():
 
 
 
+def set_model_override(stage):
+    model = st.session_state[f"model_{stage}"]
+    overrides = dict(st.session_state.model_overrides)
+    if model == get_model_router().route(st.session_state.current_user).model(stage):
+        overrides.pop(stage, None)
+    else:
+        overrides[stage] = model
+    st.session_state.model_overrides = overrides
+
+
+def model_options():
+    # Overrides are kept in session state, so they outlive the widgets when debug mode is off
+    route = get_model_route()
+    with st.sidebar.expander("Models"):
+        for stage, model in sorted(route.models.items()):
+            choices = list(dict.fromkeys((*MODEL_CHOICES, model)))
+            st.selectbox(stage, choices, index=choices.index(model), key=f"model_{stage}",
+                         on_change=set_model_override, args=(stage,))
+        if route.variants:
+            st.caption("Experiments: " + ", ".join(f"{name}={variant}" for name, variant in route.variants.items()))
+        stats = get_model_router().stats()
+        st.dataframe(stats["by_model"], hide_index=True)
+        if stats["by_variant"]:
+            st.dataframe(stats["by_variant"], hide_index=True)
+
+
+def debug_panel():
+    if not st.sidebar.toggle("Debug mode"):
+        return
+    with st.sidebar.expander("This rerun", expanded=True):
+        st.json(db.summary())
+    with st.sidebar.expander("Process"):
+        st.json({
+            # Stand-in backends (FURWELL_BACKEND) have no pool
+            "connection_pool": backend.pool.metrics() if getattr(backend, "pool", None) else "none",
+            "completion_cache": get_completion_cache().stats(),
+            "search_cache": get_search_cache().stats(),
+            "answer_worker": get_answer_worker().metrics(),
+            "rewrite_gate": get_rewrite_gate().stats() if get_rewrite_gate() else "off",
+            "call_policy": get_call_policy().stats(),
+        })
+    model_options()
+    with st.sidebar.expander("Stage latency (ms)"):
+        st.dataframe([{"stage": name, **stats} for name, stats in tracing.tracer.histograms().items()],
+                     hide_index=True)
+    traces = tracing.tracer.recent_traces(user=st.session_state.current_user)
+    if traces:
+        with st.sidebar.expander("Last question trace"):
+            st.dataframe([
+                {"span": "  " * depth + span["name"], "start_ms": span["offset_ms"], "ms": span["duration_ms"],
+                 "thread": span["thread"], "attributes": json.dumps(span["attributes"], default=str)}
+                for depth, span in tracing.flatten(traces[0])
+            ], hide_index=True)
+
+
 def get_pet_info():
-    if st.session_state.current_pet is not None:
-        result = session.sql(
-            """SELECT name, breed, type, gender, age 
-               FROM pets WHERE id = ?""",
-            (st.session_state.current_pet,)
-        ).collect()
-        return result[0] if result else None
+    if st.session_state.current_pet is None:
+        return None
+    for pet in get_user_pets():
+        if pet['ID'] == st.session_state.current_pet:
+            return pet
     return None
 
 # --------------------------------
@@ -620,30 +741,31 @@ def main():
                     attention or can be handled at home."""
                 )
 
-                if st.session_state.current_pet not in st.session_state.messages.keys():
-                    st.session_state.messages[st.session_state.current_pet] = []
+                conversation = get_conversation()
+                if conversation.has_more and st.button("Load earlier messages"):
+                    get_chat_store().load_earlier(conversation)
 
-                for message in st.session_state.messages[st.session_state.current_pet]:
+                for message in conversation.messages:
                     with st.chat_message(message["role"]):
                         st.markdown(message["content"])
 
+                pending = st.session_state.pending_answer
+                if pending is not None and pending[1] != st.session_state.current_pet:
+                    # Switched pets: nobody will read that answer
+                    settle_answer(pending, cancel=True)
+
                 if question := st.chat_input(f"Ask about {pet_info['NAME']}"):
-                    st.session_state.messages[st.session_state.current_pet].append(
-                        {"role": "user", "content": question}
-                    )
+                    if st.session_state.pending_answer is not None:
+                        # Superseded: the new job cancels it anyway, keep what it answered so far
+                        settle_answer(st.session_state.pending_answer, cancel=True)
+                    get_chat_store().append(conversation, "user", question)
                     with st.chat_message("user"):
                         st.markdown(question)
-                    
-                    with st.chat_message("assistant"):
-                        message_placeholder = st.empty()
-                        question = question.replace("'","")
-                        with st.spinner("Thinking..."):
-                            response, _ = answer_question(question)            
-                            response = response.replace("'", "")
-                            message_placeholder.markdown(response)
-            
-                    
-                    st.session_state.messages[st.session_state.current_pet].append({"role": "assistant", "content": response})
+                    # Supersedes (and cancels) any answer still running for this user
+                    submit_answer(question.replace("'",""))
+
+                if st.session_state.pending_answer is not None:
+                    pending_answer()
                                 
 
         elif st.session_state.current_view == "Add Another Pet":
@@ -653,5 +775,7 @@ def main():
         elif st.session_state.current_view == "Daily Check In":
             daily_check_in()
 
+        debug_panel()
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,80 @@
+import threading
+import time
+
+from answer_worker import CANCELLED, DONE, FAILED, AnswerWorker
+from stage_scheduler import StageCancelled
+
+
+def wait_finished(job, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while job.finished is None:
+        assert time.monotonic() < deadline, "job did not finish"
+        time.sleep(0.01)
+    return job.status
+
+
+def streaming(release):
+    def run(job):
+        job.append("partial")
+        release.wait(2)
+        job.append(" answer")
+    return run
+
+
+def test_newer_question_supersedes_the_running_one():
+    worker = AnswerWorker(max_workers=2)
+    release = threading.Event()
+    first = worker.submit((1, 10, "a"), streaming(release))
+    second = worker.submit((1, 11, "b"), lambda job: job.append("done"))
+    release.set()
+    assert wait_finished(first) == CANCELLED
+    assert first.snapshot()["text"] == "partial"
+    assert wait_finished(second) == DONE
+
+
+def test_other_users_are_not_superseded():
+    worker = AnswerWorker(max_workers=2)
+    release = threading.Event()
+    first = worker.submit((1, 10, "a"), streaming(release))
+    worker.submit((2, 20, "b"), lambda job: None)
+    release.set()
+    assert wait_finished(first) == DONE
+
+
+def test_cancel_leaves_housekeeping_jobs_running():
+    worker = AnswerWorker(max_workers=2)
+    release = threading.Event()
+    answer = worker.submit((1, 10, "a"), streaming(release))
+    summary = worker.submit((1, 10, "summary"), lambda job: release.wait(2), supersede=False)
+    worker.cancel(1)
+    release.set()
+    assert wait_finished(answer) == CANCELLED
+    assert wait_finished(summary) == DONE
+
+
+def test_cancel_for_one_pet():
+    worker = AnswerWorker(max_workers=2)
+    release = threading.Event()
+    job = worker.submit((1, 10, "a"), streaming(release))
+    worker.cancel(1, pet=11)
+    release.set()
+    assert wait_finished(job) == DONE
+    assert worker.pop((1, 10, "a")) is job
+    assert worker.get((1, 10, "a")) is None
+
+
+def test_failures_and_pipeline_cancellation_are_reported():
+    worker = AnswerWorker(max_workers=1)
+
+    def fail(job):
+        raise RuntimeError("boom")
+
+    def cancelled(job):
+        raise StageCancelled("stopped")
+
+    failed = worker.submit((1, 10, "a"), fail, supersede=False)
+    stopped = worker.submit((2, 10, "b"), cancelled)
+    assert wait_finished(failed) == FAILED
+    assert failed.snapshot()["errors"] == ["Error occurred while answering: boom"]
+    assert wait_finished(stopped) == CANCELLED
+    assert worker.metrics()["failed"] == 1 and worker.metrics()["cancelled"] == 1
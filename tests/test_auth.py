@@ -0,0 +1,51 @@
+import auth
+
+ITERATIONS = 1000
+
+
+class FakeUsers:
+    def __init__(self, password):
+        self.row = {"ID": 7, "PASSWORD": password}
+        self.statements = []
+
+    def sql(self, query, params=None):
+        self.statements.append((query, params))
+        if query.startswith("SELECT"):
+            return [dict(self.row)] if params[0] == "ann" else []
+        if query.startswith("UPDATE"):
+            self.row["PASSWORD"] = params[0]
+        return []
+
+
+def test_hash_is_salted_and_verifies():
+    first = auth.hash_password("secret", ITERATIONS)
+    second = auth.hash_password("secret", ITERATIONS)
+    assert first != second
+    assert first.startswith(f"pbkdf2_sha256${ITERATIONS}$")
+    assert auth.verify_password("secret", first, ITERATIONS) == (True, False)
+    assert auth.verify_password("wrong", first, ITERATIONS) == (False, False)
+
+
+def test_other_iteration_count_needs_rehash():
+    stored = auth.hash_password("secret", ITERATIONS)
+    assert auth.verify_password("secret", stored, ITERATIONS * 2) == (True, True)
+
+
+def test_malformed_hash_is_a_failed_verification():
+    for stored in ("pbkdf2_sha256$abc$c2FsdA==$ZGlnZXN0", "pbkdf2_sha256$1000$not base64!$ZGlnZXN0",
+                   "pbkdf2_sha256$0$c2FsdA==$ZGlnZXN0"):
+        assert auth.verify_password("secret", stored, ITERATIONS) == (False, False)
+
+
+def test_legacy_plaintext_is_upgraded_on_login():
+    users = FakeUsers("secret")
+    assert auth.authenticate(users, "ann", "secret", ITERATIONS) == 7
+    assert users.row["PASSWORD"].startswith("pbkdf2_sha256$")
+    assert auth.authenticate(users, "ann", "secret", ITERATIONS) == 7
+    assert sum(query.startswith("UPDATE") for query, _ in users.statements) == 1
+
+
+def test_wrong_password_and_unknown_user_fail():
+    users = FakeUsers(auth.hash_password("secret", ITERATIONS))
+    assert auth.authenticate(users, "ann", "wrong", ITERATIONS) is None
+    assert auth.authenticate(users, "bob", "secret", ITERATIONS) is None
@@ -0,0 +1,54 @@
+from breed_index import BreedIndex, normalize_breed
+
+
+def test_species_word_is_kept():
+    assert normalize_breed("Persian kitten") == "persian cat"
+    assert normalize_breed("Lab-mix puppy") == "lab dog"
+    assert normalize_breed("cat dog cross") == ""
+
+
+def test_matching_species_still_resolves():
+    index = BreedIndex()
+    assert index.resolve("Maine Coon cat") == "Large Cat"
+    assert index.resolve("labrador dog") == "Large Dog"
+    assert index.resolve("beagel") == "Small Dog"
+
+
+def test_contradicting_species_is_rejected():
+    index = BreedIndex()
+    assert index.resolve("maltese") == "Small Dog"
+    assert index.resolve("maltese cat") is None
+    assert index.resolve("siamese dog") is None
+
+
+def test_learned_species_variant_leaves_the_breed_alone(tmp_path):
+    index = BreedIndex(learned_path=str(tmp_path / "learned.json"))
+    assert index.classify("maltese cat", lambda breed: "Small Cat") == "Small Cat"
+    assert index.resolve("maltese cat") == "Small Cat"
+    assert index.resolve("maltese") == "Small Dog"
+
+
+def test_llm_answer_of_the_other_species_is_not_learned():
+    index = BreedIndex()
+    assert index.classify("maltese cat", lambda breed: "Small Dog") == "Undefined"
+    assert index.resolve("maltese cat") is None
+
+
+def test_bulldog_and_poodle_variants():
+    index = BreedIndex()
+    assert index.resolve("Bulldog") == "Large Dog"
+    assert index.resolve("English Bulldog puppy") == "Large Dog"
+    assert index.resolve("American bulldog") == "Large Dog"
+    assert index.resolve("French bulldog") == "Small Dog"
+    assert index.resolve("Poodle") == "Large Dog"
+    assert index.resolve("Standard poodle") == "Large Dog"
+    assert index.resolve("Miniature poodle") == "Small Dog"
+    assert index.resolve("toy poodle mix") == "Small Dog"
+
+
+def test_learned_breed_reaches_the_species_tables():
+    index = BreedIndex()
+    assert index.resolve("kooikerhondje dog") is None
+    index.learn("kooikerhondje", "Small Dog")
+    assert index.resolve("kooikerhondje dog") == "Small Dog"
+    assert index.resolve("kooikerhondje cat") is None
@@ -0,0 +1,148 @@
+import time
+
+import pytest
+
+from call_policy import CallPolicy, DeadlineExceeded, QuestionBudget, is_transient
+from completion_cache import CompletionCache
+from cortex_backend import LocalBackend
+from rag_pipeline import RagPipeline
+
+
+def make_policy(**kwargs):
+    kwargs.setdefault("backoff", 0.001)
+    kwargs.setdefault("max_backoff", 0.005)
+    return CallPolicy(**kwargs)
+
+
+def test_transient_errors_are_retried_until_success():
+    policy = make_policy()
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ConnectionError("connection reset by peer")
+        return "ok"
+
+    assert policy.call("complete.rewrite", flaky) == "ok"
+    assert len(attempts) == 3
+    assert policy.stats()["retries"] == 2
+
+
+def test_non_transient_errors_are_raised_without_retry():
+    policy = make_policy()
+    attempts = []
+
+    def broken():
+        attempts.append(1)
+        raise ValueError("bad prompt")
+
+    with pytest.raises(ValueError):
+        policy.call("complete.rewrite", broken)
+    assert len(attempts) == 1
+
+
+def test_retries_stop_at_max_attempts():
+    policy = make_policy(max_attempts=2)
+    attempts = []
+
+    def always_throttled():
+        attempts.append(1)
+        raise RuntimeError("429 Too Many Requests")
+
+    with pytest.raises(RuntimeError):
+        policy.call("search.svc", always_throttled)
+    assert len(attempts) == 2
+
+
+def test_is_transient():
+    assert is_transient(TimeoutError())
+    assert is_transient(RuntimeError("Service temporarily unavailable"))
+    assert not is_transient(DeadlineExceeded())
+    assert not is_transient(KeyError("chunk"))
+
+
+def test_stage_deadline_is_enforced():
+    policy = make_policy(budget=0.4, shares={"query": 0.25})
+    budget = policy.question()
+    with budget.active():
+        started = time.monotonic()
+        with pytest.raises(DeadlineExceeded):
+            policy.call("complete.rewrite", lambda: time.sleep(1.0), stage="query")
+    # 25% of 0.4 s, not the 30 s call timeout
+    assert time.monotonic() - started < 0.5
+    assert policy.stats()["deadline_exceeded"] == 1
+
+
+def test_retries_do_not_outlive_the_deadline():
+    policy = make_policy(budget=0.3, max_attempts=100)
+    attempts = []
+
+    def timing_out():
+        attempts.append(1)
+        time.sleep(0.05)
+        raise TimeoutError("warehouse timed out")
+
+    with policy.question().active():
+        started = time.monotonic()
+        with pytest.raises((TimeoutError, DeadlineExceeded)):
+            policy.call("complete.answer", timing_out, stage="answer")
+    assert time.monotonic() - started < 0.6
+    assert len(attempts) < 100
+
+
+def test_slow_attempt_is_hedged_and_loser_discarded():
+    policy = make_policy(min_samples=5)
+    for _ in range(5):
+        policy.call("complete.rewrite", lambda: time.sleep(0.01))
+    calls = []
+    discarded = []
+
+    def slow_then_fast():
+        calls.append(1)
+        attempt = len(calls)
+        time.sleep(0.5 if attempt == 1 else 0.01)
+        return attempt
+
+    started = time.monotonic()
+    assert policy.call("complete.rewrite", slow_then_fast, discard=discarded.append) == 2
+    assert time.monotonic() - started < 0.3
+    stats = policy.stats()
+    assert stats["hedges"] == 1 and stats["hedge_wins"] == 1
+    time.sleep(0.6)
+    assert discarded == [1]
+
+
+def test_calls_without_hedge_prefix_are_not_hedged():
+    policy = make_policy(min_samples=2, hedge=("search.",))
+    for _ in range(2):
+        policy.call("complete.answer", lambda: time.sleep(0.01))
+    policy.call("complete.answer", lambda: time.sleep(0.1))
+    assert policy.stats()["hedges"] == 0
+
+
+def test_fits_uses_recent_latency():
+    policy = make_policy(min_samples=3, budget=1.0, shares={"query": 0.25})
+    for _ in range(3):
+        policy.call("complete.rewrite", lambda: time.sleep(0.3))
+    with policy.question().active():
+        assert not policy.fits(["complete.rewrite"], "query")
+        assert policy.fits(["complete.unknown"], "query")
+
+
+def test_budget_stage_deadline_is_fixed_on_first_use():
+    budget = QuestionBudget(10.0, {"query": 0.5})
+    first = budget.stage_deadline("query")
+    time.sleep(0.01)
+    assert budget.stage_deadline("query") == first
+
+
+def test_cache_hits_stay_out_of_the_latency_window():
+    policy = make_policy(min_samples=1)
+    backend = LocalBackend(complete_latency=0.02)
+    pipeline = RagPipeline(backend, completion_cache=CompletionCache(), call_policy=policy)
+    for _ in range(20):
+        pipeline.complete("rewrite", "<question>why is my cat sneezing</question>")
+    assert backend.stats.snapshot()["complete_calls"] == 1
+    assert policy.stats()["calls"] == 1
+    assert policy.expected("complete.rewrite") >= 0.02
@@ -0,0 +1,118 @@
+import itertools
+
+from chat_store import SUMMARY_ROLE, ChatHistoryStore
+from cortex_backend import LocalBackend
+
+
+class FakeChatTables:
+    """
+    CHAT_MESSAGES and CHAT_SUMMARIES in memory, with ids from a sequence.
+    """
+
+    def __init__(self):
+        self.messages = []
+        self.summaries = {}
+        self._ids = itertools.count(1)
+
+    def _newest(self, params, limit):
+        user, pet = params[0], params[1]
+        rows = sorted((row for row in self.messages if row["USER_ID"] == user and row["PET_ID"] == pet),
+                      key=lambda row: (row["SEQ"], row["ID"]), reverse=True)
+        return rows[:limit]
+
+    def _insert(self, params):
+        for i in range(0, len(params), 5):
+            user, pet, seq, role, content = params[i:i + 5]
+            self.messages.append({"ID": next(self._ids), "USER_ID": user, "PET_ID": pet, "SEQ": seq,
+                                  "ROLE": role, "CONTENT": content})
+        return []
+
+    def _earlier(self, params):
+        seq, _, row_id, limit = params[2:]
+        return [row for row in self._newest(params, len(self.messages))
+                if (row["SEQ"], row["ID"]) < (seq, row_id)][:limit]
+
+    def _save_summary(self, params):
+        self.summaries[(params[0], params[1])] = {"SUMMARY": params[2], "THROUGH_SEQ": params[3]}
+        return []
+
+    def install(self, backend):
+        backend.add_sql_handler(r"^INSERT INTO chat_messages", self._insert)
+        backend.add_sql_handler(r"AND \(seq < \?", self._earlier)
+        backend.add_sql_handler(r"FROM chat_messages", lambda p: self._newest(p, p[-1]))
+        backend.add_sql_handler(r"^MERGE INTO chat_summaries", self._save_summary)
+        backend.add_sql_handler(r"FROM chat_summaries",
+                                lambda p: [self.summaries[(p[0], p[1])]] if (p[0], p[1]) in self.summaries else [])
+        return backend
+
+
+def make_store(**kwargs):
+    tables = FakeChatTables()
+    return ChatHistoryStore(tables.install(LocalBackend()), **kwargs), tables
+
+
+def test_earlier_pages_load_every_message_once():
+    store, _ = make_store(page_size=3)
+    conversation = store.open(1, 1)
+    for i in range(10):
+        store.append(conversation, "user", f"message {i}")
+    store.flush()
+
+    reopened = store.open(1, 1)
+    assert [m["content"] for m in reopened.messages] == ["message 7", "message 8", "message 9"]
+    while reopened.has_more:
+        store.load_earlier(reopened)
+    assert [m["content"] for m in reopened.messages] == [f"message {i}" for i in range(10)]
+
+
+def test_paging_survives_two_sessions_writing_the_same_seq():
+    store, _ = make_store(page_size=2)
+    first, second = store.open(1, 1), store.open(1, 1)
+    for i in range(3):
+        store.append(first, "user", f"first {i}")
+        store.append(second, "user", f"second {i}")
+    store.flush()
+
+    reopened = store.open(1, 1)
+    while reopened.has_more:
+        store.load_earlier(reopened)
+    contents = [m["content"] for m in reopened.messages]
+    assert sorted(contents) == sorted([f"first {i}" for i in range(3)] + [f"second {i}" for i in range(3)])
+
+
+def test_one_insert_per_flush():
+    store, _ = make_store()
+    conversation = store.open(1, 1)
+    store.append(conversation, "user", "question")
+    store.append(conversation, "assistant", "answer")
+    store.backend.stats.reset()
+    assert store.flush() == 2
+    assert store.backend.stats.snapshot()["sql_calls"] == 1
+
+
+def test_summary_folds_older_turns_and_is_reloaded():
+    store, _ = make_store(refresh_every=2, keep_recent=2)
+    conversation = store.open(1, 1)
+    for i in range(3):
+        store.append(conversation, "user", f"question {i}")
+        store.append(conversation, "assistant", f"answer {i}")
+    store.flush()
+    folded = []
+
+    def summarize(previous, messages):
+        folded.extend(messages)
+        return "owner asked about questions 0 and 1"
+
+    assert store.refresh_summary(conversation, summarize)
+    assert [m["content"] for m in folded] == ["question 0", "answer 0", "question 1", "answer 1"]
+    # The summary, then everything after it except the newest message (the question being answered)
+    assert conversation.prompt_history() == [
+        {"role": SUMMARY_ROLE, "content": "owner asked about questions 0 and 1"},
+        {"role": "user", "content": "question 2"},
+    ]
+    assert not store.refresh_summary(conversation, summarize)
+
+    reopened = store.open(1, 1)
+    assert reopened.summary == "owner asked about questions 0 and 1"
+    assert reopened.summary_seq == conversation.summary_seq
+    assert reopened.next_seq == conversation.next_seq
@@ -0,0 +1,86 @@
+import time
+
+import pytest
+
+from completion_cache import CompletionCache, LRUTTLCache
+
+
+class FakeBackend:
+    def __init__(self):
+        self.calls = 0
+
+    def complete(self, model, prompt):
+        self.calls += 1
+        return f"answer {self.calls}"
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    return now
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = LRUTTLCache(max_entries=2)
+    cache.set("a", 1, ttl=60)
+    cache.set("b", 2, ttl=60)
+    cache.get("a")
+    cache.set("c", 3, ttl=60)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_entries_expire_after_their_ttl(clock):
+    cache = LRUTTLCache()
+    cache.set("a", 1, ttl=10)
+    clock[0] += 9
+    assert cache.get("a") == 1
+    clock[0] += 1
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_cached_stage_calls_the_backend_once():
+    backend = FakeBackend()
+    cache = CompletionCache()
+    first = cache.complete(backend, "m", "Rewrite:  the question", "rewrite")
+    second = cache.complete(backend, "m", "Rewrite: the\nquestion", "rewrite")
+    assert first == second == "answer 1"
+    assert backend.calls == 1
+    assert cache.stats() == {"rewrite": {"hits": 1, "misses": 1}}
+
+
+def test_uncached_stage_always_calls_the_backend():
+    backend = FakeBackend()
+    cache = CompletionCache()
+    cache.complete(backend, "m", "prompt", "answer")
+    cache.complete(backend, "m", "prompt", "answer")
+    assert backend.calls == 2
+
+
+def test_models_do_not_share_entries():
+    backend = FakeBackend()
+    cache = CompletionCache()
+    cache.complete(backend, "small", "prompt", "rewrite")
+    cache.complete(backend, "large", "prompt", "rewrite")
+    assert backend.calls == 2
+
+
+def test_sqlite_tier_survives_a_restart(tmp_path):
+    path = str(tmp_path / "completions.sqlite")
+    backend = FakeBackend()
+    CompletionCache(sqlite_path=path).complete(backend, "m", "prompt", "pet_type")
+    restarted = CompletionCache(sqlite_path=path)
+    assert restarted.complete(backend, "m", "prompt", "pet_type") == "answer 1"
+    assert backend.calls == 1
+    assert len(restarted.memory) == 1
+
+
+def test_sqlite_tier_drops_expired_entries(tmp_path, clock):
+    path = str(tmp_path / "completions.sqlite")
+    CompletionCache(stage_ttls={"rewrite": 10}, sqlite_path=path).complete(FakeBackend(), "m", "prompt", "rewrite")
+    clock[0] += 11
+    restarted = CompletionCache(stage_ttls={"rewrite": 10}, sqlite_path=path)
+    assert restarted.get("m", "rewrite", "prompt") is None
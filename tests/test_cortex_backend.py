@@ -0,0 +1,79 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+import requests
+
+from cortex_backend import SnowparkBackend
+from session_pool import ConnectionPool
+
+
+class FakeSession:
+    connection = SimpleNamespace(host="acct.snowflakecomputing.com", rest=SimpleNamespace(token="t0ken"))
+
+    def sql(self, query, params=None):
+        return SimpleNamespace(collect=lambda: [["blocking answer"]])
+
+
+class FakeConnection:
+    session = FakeSession()
+
+    def is_healthy(self):
+        return True
+
+    def close(self):
+        pass
+
+
+class FakeResponse:
+    def __init__(self, status_code, lines=()):
+        self.status_code = status_code
+        self.lines = lines
+
+    def iter_lines(self, decode_unicode=False):
+        return iter(self.lines)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def make_backend():
+    return SnowparkBackend(ConnectionPool(FakeConnection, max_size=1), "db", "schema")
+
+
+def sse(*pieces):
+    return [f"data: {json.dumps({'choices': [{'delta': {'content': piece}}]})}" for piece in pieces] + \
+        ["", "data: [DONE]"]
+
+
+def test_streams_the_event_stream_pieces(monkeypatch):
+    sent = {}
+
+    def post(url, **kwargs):
+        sent.update(url=url, **kwargs)
+        return FakeResponse(200, sse("Keep ", "her ", "hydrated."))
+
+    monkeypatch.setattr(requests, "post", post)
+    assert list(make_backend().complete_stream("mistral-large2", "prompt")) == ["Keep ", "her ", "hydrated."]
+    assert sent["url"] == "https://acct.snowflakecomputing.com/api/v2/cortex/inference:complete"
+    assert sent["headers"]["Authorization"] == 'Snowflake Token="t0ken"'
+
+
+@pytest.mark.parametrize("failure", [requests.ConnectionError("refused"), requests.Timeout("slow")])
+def test_request_errors_fall_back_to_the_sql_function(monkeypatch, failure):
+    def post(url, **kwargs):
+        raise failure
+
+    monkeypatch.setattr(requests, "post", post)
+    assert list(make_backend().complete_stream("mistral-large2", "prompt")) == ["blocking answer"]
+
+
+def test_http_errors_fall_back_to_the_sql_function(monkeypatch):
+    monkeypatch.setattr(requests, "post", lambda url, **kwargs: FakeResponse(503))
+    assert list(make_backend().complete_stream("mistral-large2", "prompt")) == ["blocking answer"]
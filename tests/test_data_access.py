@@ -0,0 +1,45 @@
+import contextvars
+
+from cortex_backend import LocalBackend
+from data_access import RequestScope, SharedBackend
+
+
+def make_backend():
+    backend = LocalBackend()
+    backend.add_sql_handler(r"^SELECT", lambda params: [{"NAME": "Rex", "ID": params[0] if params else 0}])
+    return backend
+
+
+def test_identical_reads_run_once_per_scope():
+    backend = make_backend()
+    scope = RequestScope(backend)
+    first = scope.sql("SELECT name FROM pets WHERE id = ?", [1])
+    assert scope.sql("SELECT  name\n FROM pets WHERE id = ?", [1]) is first
+    scope.sql("SELECT name FROM pets WHERE id = ?", [2])
+    assert backend.stats.snapshot()["sql_calls"] == 2
+    assert scope.summary()["deduped_reads"] == 1 and scope.summary()["statements"] == 2
+
+
+def test_a_write_forgets_memoized_reads():
+    backend = make_backend()
+    scope = RequestScope(backend)
+    scope.sql("SELECT name FROM pets WHERE id = ?", [1])
+    scope.sql("UPDATE pets SET name = ? WHERE id = ?", ["Max", 1])
+    scope.sql("SELECT name FROM pets WHERE id = ?", [1])
+    assert backend.stats.snapshot()["sql_calls"] == 3
+
+
+def test_shared_backend_counts_in_the_active_scope_only():
+    backend = make_backend()
+    shared = SharedBackend(backend)
+
+    def rerun():
+        scope = RequestScope(backend).activate()
+        shared.sql("SELECT name FROM pets WHERE id = ?", [1])
+        shared.sql("SELECT name FROM pets WHERE id = ?", [1])
+        return scope
+
+    scope = contextvars.copy_context().run(rerun)
+    assert scope.summary()["from_shared_stores"] == 2 and scope.summary()["deduped_reads"] == 0
+    shared.sql("SELECT 1")
+    assert scope.summary()["statements"] == 2
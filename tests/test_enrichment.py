@@ -0,0 +1,49 @@
+import json
+
+from enrichment import BatchEnricher, parse_batch_response
+
+
+def test_parse_keeps_only_expected_ids_with_valid_pet_types():
+    text = "Here you go:\n" + json.dumps([
+        {"id": 1, "pet_type": "Large Dog", "condition": " Hip dysplasia. "},
+        {"id": 2, "pet_type": "Hamster", "condition": "Wet tail."},
+        {"id": 3, "pet_type": "Cat", "condition": ""},
+        {"id": 9, "pet_type": "Small Cat", "condition": "Not asked for."},
+    ])
+    assert parse_batch_response(text, {"1", "2", "3"}) == {
+        "1": {"pet_type": "Large Dog", "condition": "Hip dysplasia."}}
+
+
+def test_parse_without_a_json_array_returns_nothing():
+    assert parse_batch_response("Sorry, I cannot help.", {"1"}) == {}
+    assert parse_batch_response("[not json]", {"1"}) == {}
+
+
+class FlakyBackend:
+    """Answers every item, except item "2" the first time it is asked."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def complete(self, model, prompt):
+        self.calls += 1
+        ids = [line.split('"')[1] for line in prompt.splitlines() if line.strip().startswith("<item id=")]
+        return json.dumps([{"id": i, "pet_type": "Small Cat", "condition": f"condition {i}"}
+                           for i in ids if i != "2" or self.calls > 1])
+
+
+def test_invalid_items_are_retried():
+    backend = FlakyBackend()
+    results, failed = BatchEnricher(backend, batch_size=10, max_workers=1).enrich(
+        [(1, "Cats", "text"), (2, "Cats", "text")])
+    assert sorted(results) == ["1", "2"] and failed == []
+    assert backend.calls == 2
+
+
+def test_items_that_never_validate_are_reported():
+    class Backend:
+        def complete(self, model, prompt):
+            raise RuntimeError("warehouse suspended")
+
+    results, failed = BatchEnricher(Backend(), max_retries=1).enrich([(1, "Dogs", "text")])
+    assert results == {} and failed == ["1"]
@@ -0,0 +1,55 @@
+import pytest
+
+from cortex_backend import matches_filter
+from local_retrieval import HybridIndex, RowStore, SERVICE_COLUMNS, load_indexes, write_rows
+
+PET_TYPES = ["Large Dog", "Small Dog", "Cat", "Bird"]
+
+ROWS = [
+    {"chunk": f"{pet} vaccine schedule note {i}", "relative_path": f"doc{i % 7}.pdf",
+     "file_url": f"url{i}", "pet_type": pet, "condition": f"condition {i % 3}"}
+    for i, pet in enumerate(PET_TYPES * 10)
+]
+
+FILTERS = [
+    {"@eq": {"pet_type": "Cat"}},
+    {"@eq": {"pet_type": "Fish"}},
+    {"@or": [{"@eq": {"pet_type": "Cat"}}, {"@eq": {"pet_type": "Bird"}}]},
+    {"@and": [{"@eq": {"pet_type": "Large Dog"}}, {"@not": {"@eq": {"relative_path": "doc0.pdf"}}}]},
+]
+
+
+@pytest.fixture
+def indexes(tmp_path):
+    write_rows(ROWS, tmp_path, sorted({col for _, attributes in SERVICE_COLUMNS.values() for col in attributes}))
+    for service, (on, attributes) in SERVICE_COLUMNS.items():
+        HybridIndex.build(ROWS, on, attributes).save(tmp_path / service)
+    return load_indexes(tmp_path, None)
+
+
+@pytest.mark.parametrize("filter", FILTERS)
+def test_mask_matches_row_filtering(indexes, filter):
+    expected = [matches_filter(row, filter) for row in ROWS]
+    for index in indexes.values():
+        assert index.mask(filter).tolist() == expected
+    built = HybridIndex.build(ROWS, "chunk", SERVICE_COLUMNS["exact_type_search"][1])
+    assert built.mask(filter).tolist() == expected
+
+
+def test_filtered_search_returns_only_matching_rows(indexes):
+    results = indexes["exact_type_search"].search("cat vaccine", ["chunk", "pet_type"],
+                                                  filter={"@eq": {"pet_type": "Cat"}}, limit=5)
+    assert results and all(row["pet_type"] == "Cat" for row in results)
+
+
+def test_masking_does_not_decode_rows(indexes, monkeypatch):
+    def decode(self, i):
+        raise AssertionError("row decoded while masking")
+
+    monkeypatch.setattr(RowStore, "__getitem__", decode)
+    assert indexes["exact_type_search"].mask({"@eq": {"pet_type": "Cat"}}).sum() == 10
+
+
+def test_filter_on_a_column_outside_attributes_is_rejected(indexes):
+    with pytest.raises(ValueError, match="condition"):
+        indexes["exact_type_search"].search("cat", ["chunk"], filter={"@eq": {"condition": "condition 1"}})
@@ -0,0 +1,46 @@
+import pytest
+
+from model_router import LARGE_MODEL, SMALL_MODEL, Experiment, ModelRouter
+
+
+def test_stages_use_their_default_models():
+    route = ModelRouter().route()
+    assert route.model("rewrite") == SMALL_MODEL
+    assert route.model("answer") == LARGE_MODEL
+    assert route.model("unknown_stage") == LARGE_MODEL
+
+
+def test_assignment_is_stable_and_follows_weights():
+    experiment = Experiment("rewrite-model", ["rewrite"], {"a": "mistral-7b", "b": "llama3.1-8b"},
+                            weights={"a": 3, "b": 1})
+    users = [f"user{i}" for i in range(2000)]
+    assert [experiment.assign(user) for user in users] == [experiment.assign(user) for user in users]
+    share = sum(experiment.assign(user) == "a" for user in users) / len(users)
+    assert share == pytest.approx(0.75, abs=0.05)
+
+
+def test_experiment_with_no_variants_is_rejected():
+    with pytest.raises(ValueError):
+        Experiment("empty", ["rewrite"], {})
+
+
+def test_override_wins_and_leaves_the_experiment():
+    router = ModelRouter.from_settings({"answer": "llama3.1-70b", "experiments": {
+        "rewrite-model": {"stages": ["rewrite"], "variants": {"only": "mistral-7b"}}}})
+    route = router.route("alice")
+    assert route.model("answer") == "llama3.1-70b"
+    assert route.model("rewrite") == "mistral-7b" and route.labels("rewrite") == {"rewrite-model": "only"}
+    overridden = router.route("alice", overrides={"rewrite": "mixtral-8x7b"})
+    assert overridden.model("rewrite") == "mixtral-8x7b" and overridden.variants == {}
+
+
+def test_usage_is_accounted_per_stage_and_variant():
+    router = ModelRouter(experiments=[Experiment("rewrite-model", ["rewrite"], {"only": "mistral-7b"})])
+    route = router.route("alice")
+    route.record("rewrite", "x" * 400, "y" * 40, 0.2)
+    route.record("rewrite", "x" * 400, "y" * 40, 0.0, cached=True)
+    stats = router.stats()
+    (row,) = stats["by_model"]
+    assert (row["stage"], row["model"], row["calls"], row["cached"]) == ("rewrite", "mistral-7b", 2, 1)
+    assert row["prompt_tokens"] == 200 and row["p50_ms"] == 200.0
+    assert [row["variant"] for row in stats["by_variant"]] == ["rewrite-model=only"]
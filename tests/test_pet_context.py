@@ -0,0 +1,53 @@
+from datetime import date
+
+from cortex_backend import LocalBackend
+from pet_context import PetContextStore
+
+
+def make_store(clinical, **kwargs):
+    """
+    Store over a LocalBackend serving `clinical` (pet_id -> list of row dicts),
+    with a content fingerprint standing in for HASH_AGG.
+    """
+    backend = LocalBackend()
+    backend.add_sql_handler(r"AS clinical_version", lambda p: [{
+        "CLINICAL_VERSION": hash(tuple(tuple(sorted(row.items())) for row in clinical.get(p[0], []))),
+        "CHECKIN_VERSION": 0,
+    }])
+    backend.add_sql_handler(r"FROM clinical_history WHERE pet_id = \?", lambda p: list(clinical.get(p[0], [])))
+    backend.add_sql_handler(r"FROM daily_check_ins WHERE pet_id = \?", lambda p: [])
+    return PetContextStore(backend, check_interval=0, **kwargs), backend
+
+
+def test_edit_is_reloaded():
+    clinical = {1: [{"ID": 1, "DATE": date(2024, 1, 1), "NOTES": "Healthy."}]}
+    store, _ = make_store(clinical)
+    assert store.get_clinical_history(1) == [(date(2024, 1, 1), "Healthy.")]
+    clinical[1][0] = {**clinical[1][0], "NOTES": "Limping."}
+    assert store.get_clinical_history(1) == [(date(2024, 1, 1), "Limping.")]
+
+
+def test_delete_paired_with_insert_is_reloaded():
+    clinical = {1: [{"ID": 1, "DATE": date(2024, 1, 1), "NOTES": "First visit."}]}
+    store, _ = make_store(clinical)
+    store.get_clinical_history(1)
+    clinical[1] = [{"ID": 2, "DATE": date(2024, 2, 1), "NOTES": "Second visit."}]
+    assert store.get_clinical_history(1) == [(date(2024, 2, 1), "Second visit.")]
+
+
+def test_unchanged_tables_are_not_reloaded():
+    clinical = {1: [{"ID": 1, "DATE": date(2024, 1, 1), "NOTES": "Healthy."}]}
+    store, backend = make_store(clinical)
+    store.get_clinical_history(1)
+    backend.stats.reset()
+    store.get_clinical_history(1)
+    assert backend.stats.snapshot()["sql_calls"] == 1
+
+
+def test_least_recently_used_pet_is_evicted():
+    store, _ = make_store({}, max_pets=2)
+    store.get_clinical_history(1)
+    store.get_clinical_history(2)
+    store.get_clinical_history(1)
+    store.get_clinical_history(3)
+    assert list(store._pets) == [1, 3]
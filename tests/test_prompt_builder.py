@@ -0,0 +1,30 @@
+from chat_store import SUMMARY_ROLE
+from prompt_builder import PromptBuilder, merge_chunks
+
+
+def test_summary_is_kept_and_newest_messages_fill_the_rest():
+    builder = PromptBuilder({"chat_history": 40})
+    messages = [{"role": SUMMARY_ROLE, "content": "Dog had diarrhea last week."}] + [
+        {"role": "user", "content": f"question number {i} about the dog"} for i in range(10)
+    ]
+    lines = builder.chat_history(messages).split("\n")
+    assert lines[0] == "summary: Dog had diarrhea last week."
+    assert lines[-1] == "user: question number 9 about the dog"
+    assert "user: question number 0 about the dog" not in lines
+
+
+def test_sections_stay_within_their_budgets():
+    builder = PromptBuilder({"clinical_history": 30, "context": 30})
+    records = [(f"2024-01-{day:02d}", "Routine visit, weight stable, no concerns.") for day in range(1, 29)]
+    sections, report = builder.build([], records, [], [{"chunk": "Hydration matters. " * 50}])
+    assert report["clinical_history"] <= 30
+    assert report["context"] <= 30
+    # Newest records first
+    assert sections["clinical_history"].startswith("2024-01-28:")
+    assert sections["context"].endswith("…")
+
+
+def test_overlapping_and_duplicate_chunks_are_merged():
+    a = "Vomiting in dogs can follow a sudden change of diet or eating something unusual."
+    b = "a sudden change of diet or eating something unusual. Withhold food for twelve hours."
+    assert merge_chunks([a, b, a]) == [a[:a.index("a sudden")] + b]
@@ -0,0 +1,37 @@
+import pytest
+
+from rewrite_gate import RewriteGate, build_vocabulary, stem
+
+DISEASES = ["kidney failure", "otitis", "pancreatitis", "hip dysplasia", "cataracts", "glaucoma", "anemia",
+            "hepatitis", "gingivitis", "bronchitis", "mange", "ringworm", "colitis", "cystitis", "pyoderma",
+            "heartworm", "giardia", "parvovirus", "distemper", "rabies"]
+
+
+def test_common_words_are_not_medical():
+    vocabulary = build_vocabulary(["Signs of kidney failure in older pets after a diet change"])
+    assert "kidney" in vocabulary
+    assert not {"sign", "older", "after", "change"} & vocabulary
+
+
+def test_words_in_most_conditions_are_dropped():
+    vocabulary = build_vocabulary([f"Owners walking their pet notice {disease}" for disease in DISEASES])
+    assert "walking" not in vocabulary
+    assert "notice" not in vocabulary
+    assert "glaucoma" in vocabulary
+
+
+def test_generic_question_is_rewritten():
+    gate = RewriteGate(build_vocabulary([f"Owners walking their pet notice {disease}" for disease in DISEASES]))
+    assert gate.decide("Owners walking every morning, normal?", False).reason == "no_medical_terms"
+    assert not gate.decide("Early signs of glaucoma in beagles", False).rewrite
+
+
+@pytest.mark.parametrize("singular, plural", [("vaccine", "vaccines"), ("virus", "viruses"), ("illness", "illnesses"),
+                                              ("rash", "rashes"), ("allergy", "allergies"), ("tick", "ticks")])
+def test_singular_and_plural_share_a_stem(singular, plural):
+    assert stem(singular) == stem(plural)
+
+
+def test_plural_question_matches_singular_condition():
+    gate = RewriteGate(build_vocabulary(["Core vaccine schedule for puppies"]))
+    assert not gate.decide("Which vaccines should a beagle puppy get first?", False).rewrite
@@ -0,0 +1,47 @@
+import os
+import re
+
+from cortex_backend import LocalBackend
+from search_cache import SERVICE_TARGET_LAGS, SearchCache, load_target_lags
+
+RAG2_SQL = os.path.join(os.path.dirname(__file__), os.pardir, "rag2.sql")
+
+
+def test_fallback_lags_match_rag2_sql():
+    with open(RAG2_SQL) as f:
+        sql = f.read()
+    lags = dict(re.findall(r"CREATE OR REPLACE CORTEX SEARCH SERVICE (\w+).*?TARGET_LAG = '([^']+)'", sql, re.S))
+    assert lags == SERVICE_TARGET_LAGS
+
+
+def test_target_lags_are_read_from_the_deployed_services():
+    backend = LocalBackend()
+    backend.add_sql_handler(r"^SHOW CORTEX SEARCH SERVICES", lambda params: [
+        {"name": "EXACT_TYPE_SEARCH", "target_lag": "30 minutes"},
+        {"name": "CONDITION_MATCH_SEARCH", "target_lag": "DOWNSTREAM"},
+    ])
+    lags = load_target_lags(backend)
+    assert lags == {"exact_type_search": "30 minutes",
+                    "condition_match_search": SERVICE_TARGET_LAGS["condition_match_search"]}
+    assert SearchCache(lags).ttls["exact_type_search"] == 1800
+
+
+def test_target_lags_fall_back_when_show_fails():
+    class Backend:
+        def sql(self, query, params=None):
+            raise RuntimeError("insufficient privileges")
+
+    assert load_target_lags(Backend()) == SERVICE_TARGET_LAGS
+
+
+def test_repeated_search_is_served_from_cache_until_invalidated():
+    backend = LocalBackend()
+    backend.add_search_service("exact_type_search", [{"chunk": "kennel cough vaccine"}], on="chunk")
+    cache = SearchCache()
+    for query in ("kennel cough", "  kennel   cough "):
+        cache.search(backend, "exact_type_search", query, ["chunk"])
+    assert backend.stats.snapshot()["search_calls"] == 1
+    cache.invalidate("exact_type_search")
+    cache.search(backend, "exact_type_search", "kennel cough", ["chunk"])
+    assert backend.stats.snapshot()["search_calls"] == 2
+    assert cache.stats()["hits"] == 1
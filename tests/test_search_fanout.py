@@ -0,0 +1,60 @@
+import threading
+
+import pytest
+
+from search_fanout import FanOutSearch, reciprocal_rank_fusion
+
+
+def rows(*chunks):
+    return [{"chunk": chunk} for chunk in chunks]
+
+
+def test_items_found_by_both_services_rank_first():
+    fused = reciprocal_rank_fusion([rows("a", "b", "c"), rows("c", "d")])
+    assert [row["chunk"] for row in fused] == ["c", "a", "b", "d"]
+
+
+def test_fusion_deduplicates_ties_in_first_seen_order_and_limits():
+    fused = reciprocal_rank_fusion([rows("a", "b"), rows("x", "y")], limit=3)
+    assert [row["chunk"] for row in fused] == ["a", "x", "b"]
+
+
+def test_fusion_keeps_the_first_copy_of_a_row():
+    fused = reciprocal_rank_fusion([[{"chunk": "a", "source": 1}], [{"chunk": "a", "source": 2}]])
+    assert fused == [{"chunk": "a", "source": 1}]
+
+
+def test_slow_service_is_dropped_at_the_deadline():
+    release = threading.Event()
+
+    def search(service, query, columns, filter=None, limit=5):
+        if service == "slow":
+            release.wait(5)
+            return {"results": rows("late")}
+        return {"results": rows("fast")}
+
+    try:
+        response = FanOutSearch(("fast", "slow"), deadline=0.1).search(search, "q", ["chunk"])
+    finally:
+        release.set()
+    assert response["services"] == {"fast": "ok", "slow": "timeout"}
+    assert [row["chunk"] for row in response["results"]] == ["fast"]
+
+
+def test_failed_service_is_left_out():
+    def search(service, query, columns, filter=None, limit=5):
+        if service == "broken":
+            raise RuntimeError("down")
+        return {"results": rows("a")}
+
+    response = FanOutSearch(("ok", "broken")).search(search, "q", ["chunk"])
+    assert response["services"] == {"ok": "ok", "broken": "error"}
+    assert response["results"] == rows("a")
+
+
+def test_every_service_failing_raises():
+    def search(service, query, columns, filter=None, limit=5):
+        raise RuntimeError(service)
+
+    with pytest.raises(RuntimeError):
+        FanOutSearch(("a", "b")).search(search, "q", ["chunk"])
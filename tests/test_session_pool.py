@@ -0,0 +1,118 @@
+import threading
+import time
+
+import pytest
+
+from session_pool import ConnectionPool, PoolTimeout
+
+
+class FakeConnection:
+    def __init__(self, number):
+        self.number = number
+        self.healthy = True
+        self.closed = False
+
+    def is_healthy(self):
+        return self.healthy
+
+    def close(self):
+        self.closed = True
+
+
+def make_pool(**kwargs):
+    created = []
+
+    def factory():
+        created.append(FakeConnection(len(created)))
+        return created[-1]
+
+    return ConnectionPool(factory, **kwargs), created
+
+
+def test_idle_connections_are_reused():
+    pool, created = make_pool(max_size=2)
+    with pool.checkout() as first:
+        pass
+    with pool.checkout() as second:
+        pass
+    assert first is second
+    assert len(created) == 1
+
+
+def test_checkout_waits_for_a_free_connection_then_times_out():
+    pool, _ = make_pool(max_size=1, checkout_timeout=0.1)
+    with pool.checkout():
+        with pytest.raises(PoolTimeout):
+            with pool.checkout():
+                pass
+    assert pool.metrics()["timeouts"] == 1
+
+
+def test_waiter_gets_connection_when_released():
+    pool, created = make_pool(max_size=1, checkout_timeout=2.0)
+    got = []
+
+    def borrower():
+        with pool.checkout() as connection:
+            got.append(connection)
+
+    with pool.checkout():
+        thread = threading.Thread(target=borrower)
+        thread.start()
+        time.sleep(0.05)
+        assert got == []
+    thread.join(1.0)
+    assert got == [created[0]]
+    assert pool.metrics()["waits"] == 1
+
+
+def test_broken_connection_is_replaced_after_error():
+    pool, created = make_pool(max_size=1)
+    with pytest.raises(RuntimeError):
+        with pool.checkout() as connection:
+            connection.healthy = False
+            raise RuntimeError("network down")
+    assert connection.closed
+    with pool.checkout() as replacement:
+        assert replacement is not connection
+    metrics = pool.metrics()
+    assert metrics["reconnects"] == 1 and metrics["size"] == 1
+
+
+def test_error_on_healthy_connection_keeps_it():
+    pool, created = make_pool(max_size=1)
+    with pytest.raises(ValueError):
+        with pool.checkout():
+            raise ValueError("bad SQL")
+    with pool.checkout():
+        pass
+    assert len(created) == 1
+
+
+def test_stale_idle_connection_is_health_checked():
+    pool, created = make_pool(max_size=1, health_check_after=0.0)
+    with pool.checkout() as connection:
+        pass
+    connection.healthy = False
+    time.sleep(0.01)
+    with pool.checkout() as replacement:
+        assert replacement is not connection
+    assert connection.closed and pool.metrics()["reconnects"] == 1
+
+
+def test_factory_failure_frees_the_slot():
+    attempts = []
+
+    def factory():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise ConnectionError("login failed")
+        return FakeConnection(len(attempts))
+
+    pool = ConnectionPool(factory, max_size=1, checkout_timeout=0.1)
+    with pytest.raises(ConnectionError):
+        with pool.checkout():
+            pass
+    with pool.checkout():
+        pass
+    assert pool.metrics()["size"] == 1
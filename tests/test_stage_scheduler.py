@@ -0,0 +1,67 @@
+import threading
+import time
+
+import pytest
+
+from stage_scheduler import Stage, StageCancelled, StageScheduler, StageTimeout
+
+
+def test_dependencies_receive_results():
+    results = StageScheduler().run([
+        Stage("a", lambda: 1),
+        Stage("b", lambda: 2),
+        Stage("c", lambda a, b: a + b, after=("a", "b")),
+    ])
+    assert results == {"a": 1, "b": 2, "c": 3}
+
+
+def test_independent_stages_run_concurrently():
+    started = time.monotonic()
+    StageScheduler().run([Stage(name, lambda: time.sleep(0.2)) for name in ("a", "b", "c")])
+    assert time.monotonic() - started < 0.5
+
+
+def test_timeout_uses_fallback():
+    started = time.monotonic()
+    results = StageScheduler().run([
+        Stage("slow", lambda: time.sleep(1.0), timeout=0.1, fallback=lambda e: type(e).__name__),
+    ])
+    assert results == {"slow": "StageTimeout"}
+    assert time.monotonic() - started < 0.5
+
+
+def test_timeout_without_fallback_raises():
+    with pytest.raises(StageTimeout):
+        StageScheduler().run([Stage("slow", lambda: time.sleep(1.0), timeout=0.05)])
+
+
+def test_error_uses_fallback_and_dependants_still_run():
+    def boom():
+        raise RuntimeError("search failed")
+
+    results = StageScheduler().run([
+        Stage("search", boom, fallback=lambda e: []),
+        Stage("prompt", lambda search: len(search), after=("search",)),
+    ])
+    assert results == {"search": [], "prompt": 0}
+
+
+def test_cancelled_skips_stages_not_started():
+    cancel = threading.Event()
+    ran = []
+
+    def first():
+        cancel.set()
+        return 1
+
+    with pytest.raises(StageCancelled):
+        StageScheduler().run([
+            Stage("first", first),
+            Stage("second", lambda first: ran.append(first), after=("first",)),
+        ], cancelled=cancel.is_set)
+    assert ran == []
+
+
+def test_unknown_dependency_is_rejected():
+    with pytest.raises(ValueError):
+        StageScheduler().run([Stage("a", lambda b: b, after=("b",))])
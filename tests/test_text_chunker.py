@@ -0,0 +1,61 @@
+import random
+
+from text_chunker import iter_chunk_spans, iter_pieces, text_chunker
+
+
+def make_text(seed=1, paragraphs=60):
+    rng = random.Random(seed)
+    words = ["fever", "vomiting", "dog", "cat", "vaccine", "appetite", "the", "and", "supercalifragilistic" * 5]
+    return "\n\n".join(
+        "\n".join(" ".join(rng.choice(words) for _ in range(rng.randint(1, 80))) for _ in range(rng.randint(1, 4)))
+        for _ in range(paragraphs)
+    )
+
+
+def test_pieces_cover_the_text_within_the_size_limit():
+    text = make_text()
+    pieces = list(iter_pieces(text, 0, len(text), chunk_size=100))
+    assert pieces[0][0] == 0 and pieces[-1][1] == len(text)
+    assert all(a[1] == b[0] for a, b in zip(pieces, pieces[1:]))
+    assert all(0 < end - start <= 100 for start, end in pieces)
+
+
+def test_chunks_cover_the_text_and_respect_size_and_overlap():
+    text = make_text(seed=2)
+    spans = list(iter_chunk_spans(text, chunk_size=300, chunk_overlap=50))
+    assert spans[0][0] == 0 and spans[-1][1] == len(text)
+    for (start, end), (next_start, next_end) in zip(spans, spans[1:]):
+        assert end - start <= 300
+        # No gap between chunks, and no more overlap than allowed
+        assert start < next_start <= end
+        assert end - next_start <= 50
+    assert spans[-1][1] - spans[-1][0] <= 300
+
+
+def test_span_limits_restrict_chunking():
+    text = "first line\n" + "second " * 40 + "\nthird line"
+    start = text.index("second")
+    end = text.index("\nthird")
+    spans = list(iter_chunk_spans(text, start, end, chunk_size=50, chunk_overlap=0))
+    assert spans[0][0] == start and spans[-1][1] == end
+    assert "".join(text[s:e] for s, e in spans) == text[start:end]
+
+
+def test_chunks_are_labelled_with_their_headings():
+    text = "# Dogs\nintro\n\n## Vaccines\n" + "core vaccine schedule " * 20 + "\n\n# Cats\n" + "feline " * 30
+    rows = list(text_chunker(chunk_size=200, chunk_overlap=0).process(text, "paragraph"))
+    # A heading that starts inside a chunk labels that chunk
+    assert rows[0][:2] == ("Dogs", "Vaccines")
+    assert rows[-1][:2] == ("Cats", "No Sub Heading")
+    assert all(len(chunk) <= 200 for _, _, chunk in rows)
+
+
+def test_table_rows_are_chunked_line_by_line():
+    text = "a | b\n\n" + "x" * 30 + "\nc | d"
+    rows = list(text_chunker(chunk_size=20, chunk_overlap=0).process(text, "table"))
+    assert [chunk for _, _, chunk in rows] == ["a | b", "x" * 20, "x" * 10, "c | d"]
+    assert {row[:2] for row in rows} == {("Table Content", "Table Row")}
+
+
+def test_empty_document_yields_nothing():
+    assert list(text_chunker().process("", "paragraph")) == []
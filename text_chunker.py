@@ -0,0 +1,168 @@
+"""
+Single-pass document chunker behind the text_chunker UDTF in rag2.sql.
+
+The UDTF used to split the whole document into a list, then test every
+heading against every chunk with substring checks (O(chunks x headings x
+chunk_len)) and round-trip the rows through a pandas DataFrame. This
+version walks the text once:
+
+- pieces are found lazily by the same separator hierarchy as
+  RecursiveCharacterTextSplitter and kept as (start, end) offsets,
+- chunks are cut from the original string with the same size/overlap rules,
+- headings are tracked by character offset, so each one is looked at once,
+- rows are yielded as they are produced; memory stays bounded by one chunk.
+
+PARSE_DOCUMENT in LAYOUT mode returns markdown, so '#' lines are main
+headings and '##'..'######' lines sub headings.
+
+It has no dependencies so it can be uploaded to a stage and imported by the
+UDTF, and benchmarked locally with chunker_benchmark.py.
+"""
+import re
+from collections import deque
+
+CHUNK_SIZE = 1512
+CHUNK_OVERLAP = 256
+SEPARATORS = ("\n\n", "\n", " ", "")
+
+HEADING_RE = re.compile(r"^(#{1,6})[ \t]+(.+?)[ \t#]*$", re.M)
+
+
+def iter_pieces(text, start, end, chunk_size=CHUNK_SIZE, separators=SEPARATORS):
+    """
+    Yield (start, end) spans of text[start:end], none longer than chunk_size.
+
+    Splits on the first separator present in the span, keeping each
+    separator at the start of the following piece, and recurses into pieces
+    that are still too long with the remaining separators.
+    """
+    for i, separator in enumerate(separators):
+        if separator == "":
+            for offset in range(start, end, chunk_size):
+                yield offset, min(offset + chunk_size, end)
+            return
+        cut = text.find(separator, start, end)
+        if cut == -1:
+            continue
+        piece_start = start
+        while True:
+            if cut == -1 or cut >= end:
+                cut = end
+            if cut > piece_start:
+                if cut - piece_start <= chunk_size:
+                    yield piece_start, cut
+                else:
+                    yield from iter_pieces(text, piece_start, cut, chunk_size, separators[i + 1:])
+            if cut == end:
+                return
+            piece_start = cut
+            cut = text.find(separator, cut + len(separator), end)
+    if end > start:
+        yield start, end
+
+
+def iter_chunk_spans(text, start=0, end=None, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+    """
+    Merge pieces into (start, end) chunk spans of at most chunk_size chars,
+    each sharing up to chunk_overlap trailing chars with the next one.
+    """
+    end = len(text) if end is None else end
+    window = deque()
+    total = 0
+    for piece in iter_pieces(text, start, end, chunk_size):
+        length = piece[1] - piece[0]
+        if window and total + length > chunk_size:
+            yield window[0][0], window[-1][1]
+            while window and (total > chunk_overlap or total + length > chunk_size):
+                first = window.popleft()
+                total -= first[1] - first[0]
+        window.append(piece)
+        total += length
+    if window:
+        yield window[0][0], window[-1][1]
+
+
+def iter_headings(text):
+    """
+    Yield (offset, level, heading) for markdown headings, in document order.
+    """
+    for match in HEADING_RE.finditer(text):
+        yield match.start(), len(match.group(1)), match.group(2).strip()
+
+
+class text_chunker:
+    """
+    Chunks documents and labels each chunk with the headings it falls under.
+
+    The class name is the UDTF handler name used in rag2.sql.
+
+    Attributes:
+        chunk_size (int): Maximum chunk length in characters
+        chunk_overlap (int): Characters shared between consecutive chunks
+    """
+
+    def __init__(self, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+
+    def process(self, pdf_text: str, file_type: str):
+        """
+        Process the text document based on the file type.
+
+        Parameters:
+            pdf_text (str): The raw text content from the document
+            file_type (str): Document type ('paragraph', 'table', or 'unknown')
+
+        Returns:
+            Generator: A generator of tuples containing main_heading, sub_heading, and chunk
+        """
+        if not pdf_text:
+            return iter(())
+        if (file_type or "").lower().strip() == "table":
+            return self.process_table_file(pdf_text)
+        return self.process_paragraph_file(pdf_text)
+
+    def process_paragraph_file(self, pdf_text: str):
+        """
+        Process documents with paragraph-based structure.
+
+        Each chunk gets the last main and sub heading that starts before the
+        chunk ends, so a heading inside a chunk labels that chunk.
+
+        Yields:
+            (main_heading, sub_heading, chunk) tuples
+        """
+        headings = iter_headings(pdf_text)
+        next_heading = next(headings, None)
+        current_main_heading = "No Main Heading"
+        current_sub_heading = "No Sub Heading"
+
+        for start, end in iter_chunk_spans(pdf_text, chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap):
+            while next_heading is not None and next_heading[0] < end:
+                _, level, heading = next_heading
+                if level == 1:
+                    current_main_heading = heading
+                    current_sub_heading = "No Sub Heading"
+                else:
+                    current_sub_heading = heading
+                next_heading = next(headings, None)
+            chunk = pdf_text[start:end].strip()
+            if chunk:
+                yield current_main_heading, current_sub_heading, chunk
+
+    def process_table_file(self, pdf_text: str):
+        """
+        Process documents with table-based structure: every non-empty line is
+        chunked on its own.
+
+        Yields:
+            (main_heading, sub_heading, chunk) tuples
+        """
+        for line in re.finditer(r"[^\n]+", pdf_text):
+            if not line.group().strip():
+                continue
+            for start, end in iter_chunk_spans(pdf_text, line.start(), line.end(),
+                                               self.chunk_size, self.chunk_overlap):
+                chunk = pdf_text[start:end].strip()
+                if chunk:
+                    yield "Table Content", "Table Row", chunk
@@ -0,0 +1,221 @@
+"""
+Lightweight in-process tracing for the RAG pipeline.
+
+Wrap work in `with span("name", attr=value):`. Spans nest through a context
+variable; StageScheduler and FanOutSearch copy the context into their
+worker threads, so stage and search spans land under the span that started
+them. When a root span ends its trace is kept in a ring buffer for the
+debug panel and, if configured, appended to a JSON lines file. Every span
+also feeds a rolling latency window per span name, summarized as
+p50/p95/p99.
+
+    from tracing import span, annotate
+
+    with span("answer", prompt_chars=len(prompt)):
+        ...
+        annotate(cache_hit=True)
+"""
+import contextvars
+import itertools
+import json
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_ids = itertools.count(1)
+
+
+def percentile(sorted_values, q):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(q / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+class Span:
+    """
+    A timed unit of work.
+
+    Attributes:
+        name (str): Stage or operation name; also the histogram key
+        attributes (dict): Free-form details such as prompt_chars, rows, cache_hit
+        parent (Span): Enclosing span, or None for a root
+        children (list): Spans started under this one
+    """
+
+    def __init__(self, tracer, name, parent=None, **attributes):
+        self.tracer = tracer
+        self.name = name
+        self.parent = parent
+        self.attributes = attributes
+        self.span_id = next(_ids)
+        self.children = []
+        self.thread = threading.current_thread().name
+        self.start_wall = time.time()
+        self.start = time.perf_counter()
+        self.duration = None
+        if parent is not None:
+            with parent.tracer._lock:
+                parent.children.append(self)
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self, error=None):
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self.start
+        if error is not None:
+            self.attributes["error"] = type(error).__name__
+        self.tracer._finish(self)
+
+    def to_dict(self, root_start=None):
+        root_start = self.start if root_start is None else root_start
+        with self.tracer._lock:
+            children = list(self.children)
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "offset_ms": round((self.start - root_start) * 1000, 3),
+            "duration_ms": None if self.duration is None else round(self.duration * 1000, 3),
+            "thread": self.thread,
+            "attributes": self.attributes,
+            "children": [child.to_dict(root_start) for child in children],
+        }
+
+
+class Tracer:
+    """
+    Args:
+        max_traces (int): Finished traces kept for display
+        window (int): Latest durations kept per span name for the percentiles
+        export_path (str): Optional JSON lines file every finished trace is appended to
+    """
+
+    def __init__(self, max_traces=50, window=1000, export_path=None):
+        self._lock = threading.Lock()
+        self.window = window
+        self.export_path = export_path
+        self.traces = deque(maxlen=max_traces)
+        self.durations = {}
+
+    def start_span(self, name, **attributes):
+        """
+        Start a span under the current one without making it current; call
+        end() on it. Useful for work that outlives a `with` block, like a
+        streamed answer.
+        """
+        return Span(self, name, _current_span.get(), **attributes)
+
+    @contextmanager
+    def span(self, name, **attributes):
+        current = self.start_span(name, **attributes)
+        token = _current_span.set(current)
+        try:
+            yield current
+        except BaseException as e:
+            current.end(error=e)
+            raise
+        finally:
+            _current_span.reset(token)
+            current.end()
+
+    def _finish(self, span):
+        with self._lock:
+            samples = self.durations.get(span.name)
+            if samples is None:
+                samples = self.durations[span.name] = deque(maxlen=self.window)
+            samples.append(span.duration)
+        if span.parent is None:
+            self._finish_trace(span)
+
+    def _finish_trace(self, root):
+        trace = {"trace_id": root.span_id, "timestamp": root.start_wall, **root.to_dict()}
+        with self._lock:
+            self.traces.append(trace)
+        if self.export_path:
+            try:
+                with open(self.export_path, "a") as f:
+                    f.write(json.dumps(trace, default=str) + "\n")
+            except OSError as e:
+                logger.warning("Could not export trace to %s: %s", self.export_path, e)
+
+    def histograms(self):
+        """
+        Returns:
+            dict: span name -> count, mean_ms, p50_ms, p95_ms, p99_ms over the rolling window
+        """
+        with self._lock:
+            windows = {name: sorted(samples) for name, samples in self.durations.items()}
+        return {
+            name: {
+                "count": len(samples),
+                "mean_ms": round(sum(samples) / len(samples) * 1000, 2),
+                **{f"p{q}_ms": round(percentile(samples, q) * 1000, 2) for q in (50, 95, 99)},
+            }
+            for name, samples in sorted(windows.items()) if samples
+        }
+
+    def recent_traces(self, **match):
+        """
+        Finished traces, newest first, whose root attributes include `match`.
+        """
+        with self._lock:
+            traces = list(self.traces)
+        return [trace for trace in reversed(traces)
+                if all(trace["attributes"].get(key) == value for key, value in match.items())]
+
+    def reset(self):
+        with self._lock:
+            self.traces.clear()
+            self.durations.clear()
+
+
+tracer = Tracer()
+
+
+def configure(max_traces=None, window=None, export_path=None):
+    """
+    Adjust the process-wide tracer. Settings left as None are unchanged.
+    """
+    with tracer._lock:
+        if max_traces is not None and max_traces != tracer.traces.maxlen:
+            tracer.traces = deque(tracer.traces, maxlen=max_traces)
+        if window is not None:
+            tracer.window = window
+        if export_path is not None:
+            tracer.export_path = export_path
+
+
+def span(name, **attributes):
+    return tracer.span(name, **attributes)
+
+
+def start_span(name, **attributes):
+    return tracer.start_span(name, **attributes)
+
+
+def annotate(**attributes):
+    """
+    Set attributes on the current span, if there is one.
+    """
+    current = _current_span.get()
+    if current is not None:
+        current.set(**attributes)
+
+
+def flatten(trace, depth=0):
+    """
+    Yield (depth, span dict without children) for a trace, depth first.
+    """
+    yield depth, {key: value for key, value in trace.items() if key != "children"}
+    for child in trace["children"]:
+        yield from flatten(child, depth + 1)